@@ -1,18 +1,66 @@
-from sqladmin import Admin, ModelView
+from sqladmin import Admin, ModelView, action
+from sqladmin.filters import BooleanFilter, ForeignKeyFilter, OperationColumnFilter, StaticValuesFilter
 from database import engine
-from models import User, City, Order, Invoice, Conversation, Message
+from models import User, City, Order, Invoice, Conversation, Message, OrderStatus, InvoiceStatus
 from auth import verify_password
 from sqlalchemy.orm import Session
 from database import AsyncSessionLocal as SessionLocal
+from realtime import order_events, order_status_event, invoice_status_event
+from sqlalchemy import select, or_, false
+from search import message_index, order_index
+from admin_pagination import LargeTableView
+from database import SessionLocal as SyncSessionLocal
+from executors import run_db
+from fastapi.responses import HTMLResponse
+import bulk
+import html
 from fastapi import Request, HTTPException, status
 import base64
 from wtforms import DateField
 from datetime import date
 
-class UserAdmin(ModelView, model=User):
+def _request_admin(db: Session, request: Request) -> User:
+    # admin_auth_middleware has already checked the password
+    username = base64.b64decode(request.headers["authorization"].split(" ")[1]).decode("utf-8").split(":", 1)[0]
+    return db.query(User).filter(User.admin_username == username, User.is_admin == True).one()
+
+def _bulk_form(request: Request, title: str, field: str, error: str = None) -> HTMLResponse:
+    """Ask for the one value a bulk action needs, then submit back to the same action"""
+    pks = html.escape(request.query_params.get("pks", ""))
+    message = f"<p>{html.escape(error)}</p>" if error else ""
+    return HTMLResponse(
+        f"<h3>{html.escape(title)}</h3>{message}<p>Selected ids: {pks}</p>"
+        f"<form method='get'><input type='hidden' name='pks' value='{pks}'>{field} <button type='submit'>Apply</button></form>"
+    )
+
+async def _run_bulk(view: ModelView, request: Request, title: str, change, value) -> HTMLResponse:
+    """Run a bulk.* change for the selected rows and show what was changed and what was rejected"""
+    ids = [int(pk) for pk in request.query_params.get("pks", "").split(",") if pk.strip().isdigit()]
+
+    def run():
+        with SyncSessionLocal() as db:
+            return change(db, ids, value, _request_admin(db, request))
+
+    back = f"<p><a href='{request.url_for('admin:list', identity=view.identity)}'>Back to list</a></p>"
+    try:
+        result = await run_db(run)
+    except HTTPException as e:
+        return HTMLResponse(f"<h3>{html.escape(title)}</h3><p>{html.escape(str(e.detail))}</p>{back}", status_code=e.status_code)
+    rejected = "".join(f"<li>{row_id}: {html.escape(reason)}</li>" for row_id, reason in sorted(result["rejected"].items()))
+    return HTMLResponse(
+        f"<h3>{html.escape(title)}</h3>"
+        f"<p>Changed ({len(result['affected'])}): {', '.join(map(str, result['affected'])) or 'none'}</p>"
+        f"<p>Rejected ({len(result['rejected'])}):</p><ul>{rejected}</ul>{back}"
+    )
+
+class UserAdmin(LargeTableView, model=User):
     column_list = [User.id, User.phone_number, User.email, User.name, User.date_of_birth, User.is_verified, User.otp, User.otp_created_at, User.is_admin, User.role, User.admin_username, User.admin_password_hash, User.city_id]
     column_searchable_list = [User.phone_number, User.email, User.name]
-    column_filters = [User.is_verified, User.role, User.is_admin]
+    column_filters = [
+        BooleanFilter(User.is_verified),
+        StaticValuesFilter(User.role, [('Customer', 'Customer'), ('Admin', 'Admin'), ('Courier', 'Courier')]),
+        BooleanFilter(User.is_admin),
+    ]
     form_columns = [User.phone_number, User.email, User.name, User.date_of_birth, User.is_verified, User.otp, User.is_admin, User.role, User.admin_username, User.admin_password_hash, User.city_id]
 
     column_choices = {
@@ -37,13 +85,17 @@ class CityAdmin(ModelView, model=City):
     __name__ = "Cities"
     column_list = [City.id, City.name, City.icon, City.active]
     column_searchable_list = [City.name]
-    column_filters = [City.active]
+    column_filters = [BooleanFilter(City.active)]
     form_columns = [City.name, City.icon, City.active]
 
-class OrderAdmin(ModelView, model=Order):
+class OrderAdmin(LargeTableView, model=Order):
     column_list = [Order.id, Order.order_id, Order.created_by_user_id, Order.assigned_to_user_id, Order.description, Order.creation_date, Order.delivery_date, Order.status, Order.comments, Order.updated_at, Order.city_id]
     column_searchable_list = [Order.order_id, Order.description]
-    column_filters = [Order.status, Order.city_id]
+    # Enum columns store the member name, the value is what is shown
+    column_filters = [
+        StaticValuesFilter(Order.status, [(s.name, s.value) for s in OrderStatus]),
+        ForeignKeyFilter(Order.city_id, City.name),
+    ]
     form_columns = [Order.order_id, Order.created_by_user_id, Order.assigned_to_user_id, Order.description, Order.delivery_date, Order.status, Order.comments, Order.city_id]
 
     column_choices = {
@@ -58,10 +110,56 @@ class OrderAdmin(ModelView, model=Order):
         }
     }
 
-class InvoiceAdmin(ModelView, model=Invoice):
+    @action(name="bulk_status", label="Change status", confirmation_message="Change the status of the selected orders?", add_in_detail=False)
+    async def bulk_status(self, request: Request):
+        status_value = request.query_params.get("status")
+        # Assigning and cancelling have their own actions and checks
+        choices = [s.value for s in OrderStatus if s not in (OrderStatus.RECEIVED_BY_COURIER, OrderStatus.CANCELLED)]
+        if status_value not in choices:
+            options = "".join(f"<option value='{value}'>{value}</option>" for value in choices)
+            error = f"Unknown status: {status_value}" if status_value else None
+            return _bulk_form(request, "Change status", f"<select name='status'>{options}</select>", error)
+        return await _run_bulk(self, request, "Change status", bulk.change_order_status, OrderStatus(status_value))
+
+    @action(name="bulk_assign", label="Assign to courier", confirmation_message="Assign the selected orders to a courier?", add_in_detail=False)
+    async def bulk_assign(self, request: Request):
+        courier_id = request.query_params.get("courier_id", "")
+        if not courier_id.isdigit():
+            return _bulk_form(request, "Assign to courier", "Courier user ID <input type='number' name='courier_id' required>")
+        return await _run_bulk(self, request, "Assign to courier", bulk.assign_orders, int(courier_id))
+
+    @action(name="bulk_cancel", label="Cancel", confirmation_message="Cancel the selected orders?", add_in_detail=False)
+    async def bulk_cancel(self, request: Request):
+        reason = request.query_params.get("reason", "").strip()
+        if not reason:
+            return _bulk_form(request, "Cancel orders", "Reason <input type='text' name='reason' required>")
+        return await _run_bulk(self, request, "Cancel orders", bulk.cancel_orders, reason)
+
+    def search_query(self, stmt, term):
+        # Order numbers by prefix, descriptions through the full-text index
+        matches = order_index.match_ids(term)
+        if matches is None:
+            return stmt.where(Order.order_id.startswith(term.strip()))
+        return stmt.where(or_(Order.order_id.startswith(term.strip()), Order.id.in_(matches)))
+
+    async def on_model_change(self, data, model, is_created, request):
+        # Admin edits count as a change for optimistic concurrency too
+        if not is_created:
+            data["version"] = (model.version or 1) + 1
+            # The courier the order may be taken from, still on the model here
+            request.state.previous_courier_id = model.assigned_to_user_id
+
+    async def after_model_change(self, data, model, is_created, request):
+        previous_courier_id = getattr(request.state, "previous_courier_id", None)
+        order_events.publish((model.created_by_user_id, model.assigned_to_user_id, previous_courier_id), order_status_event(model))
+
+class InvoiceAdmin(LargeTableView, model=Invoice):
     column_list = [Invoice.id, Invoice.invoice_id, Invoice.order_id, Invoice.full_amount, Invoice.service_fee, Invoice.order_only_price, Invoice.courier_fee, Invoice.status, Invoice.description, Invoice.comment, Invoice.sent_to_user_via_email, Invoice.sent_at, Invoice.due_date, Invoice.tax_amount, Invoice.discount_amount, Invoice.created_at, Invoice.updated_at]
     column_searchable_list = [Invoice.invoice_id]
-    column_filters = [Invoice.status, Invoice.sent_to_user_via_email]
+    column_filters = [
+        StaticValuesFilter(Invoice.status, [(s.name, s.value) for s in InvoiceStatus]),
+        BooleanFilter(Invoice.sent_to_user_via_email),
+    ]
     form_columns = [Invoice.invoice_id, Invoice.order_id, Invoice.full_amount, Invoice.service_fee, Invoice.order_only_price, Invoice.courier_fee, Invoice.status, Invoice.description, Invoice.comment, Invoice.sent_to_user_via_email, Invoice.sent_at, Invoice.due_date, Invoice.tax_amount, Invoice.discount_amount]
 
     column_choices = {
@@ -74,10 +172,25 @@ class InvoiceAdmin(ModelView, model=Invoice):
         }
     }
 
+    @action(name="mark_paid", label="Mark paid", confirmation_message="Mark the selected invoices as paid?", add_in_detail=False)
+    async def mark_paid(self, request: Request):
+        return await _run_bulk(self, request, "Mark invoices paid", bulk.change_invoice_status, InvoiceStatus.PAID)
+
+    @action(name="mark_refunded", label="Mark refunded", confirmation_message="Mark the selected invoices as refunded?", add_in_detail=False)
+    async def mark_refunded(self, request: Request):
+        return await _run_bulk(self, request, "Mark invoices refunded", bulk.change_invoice_status, InvoiceStatus.REFUNDED)
+
+    async def after_model_change(self, data, model, is_created, request):
+        async with SessionLocal() as db:
+            result = await db.execute(select(Order.created_by_user_id, Order.assigned_to_user_id).where(Order.id == model.order_id))
+            recipients = result.first()
+        if recipients is not None:
+            order_events.publish(tuple(recipients), invoice_status_event(model))
+
 class ConversationAdmin(ModelView, model=Conversation):
     column_list = [Conversation.id, Conversation.customer_id, Conversation.courier_id, Conversation.status, Conversation.created_at]
     column_searchable_list = [Conversation.customer_id, Conversation.courier_id]
-    column_filters = [Conversation.status]
+    column_filters = [StaticValuesFilter(Conversation.status, [('active', 'Active'), ('inactive', 'Inactive'), ('closed', 'Closed')])]
     form_columns = [Conversation.customer_id, Conversation.courier_id, Conversation.status]
 
     column_choices = {
@@ -88,10 +201,15 @@ class ConversationAdmin(ModelView, model=Conversation):
         }
     }
 
-class MessageAdmin(ModelView, model=Message):
+class MessageAdmin(LargeTableView, model=Message):
     column_list = [Message.id, Message.conversation_id, Message.sender_id, Message.content, Message.sent_at, Message.message_type]
     column_searchable_list = [Message.content]
-    column_filters = [Message.message_type, Message.conversation_id, Message.sender_id]
+    # Ids are typed in rather than listed, there are too many to offer as choices
+    column_filters = [
+        StaticValuesFilter(Message.message_type, [('text', 'Text'), ('invoice', 'Invoice')]),
+        OperationColumnFilter(Message.conversation_id),
+        OperationColumnFilter(Message.sender_id),
+    ]
     form_columns = [Message.conversation_id, Message.sender_id, Message.content, Message.message_type, Message.invoice_description, Message.invoice_gift_price, Message.invoice_service_fee, Message.invoice_delivery_fee, Message.invoice_total]
 
     column_choices = {
@@ -101,6 +219,10 @@ class MessageAdmin(ModelView, model=Message):
         }
     }
 
+    def search_query(self, stmt, term):
+        matches = message_index.match_ids(term)
+        return stmt.where(Message.id.in_(matches)) if matches is not None else stmt.where(false())
+
 def authenticate_admin_request(request: Request) -> bool:
     auth_header = request.headers.get("authorization")
     if not auth_header or not auth_header.startswith("Basic "):
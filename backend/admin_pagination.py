@@ -0,0 +1,142 @@
+from collections import OrderedDict
+from typing import Optional, Tuple
+import math
+import threading
+from sqladmin import ModelView
+from sqladmin.pagination import Pagination
+from sqlalchemy import func, select, text
+from sqlalchemy.orm import selectinload
+from config import settings
+from database import AsyncSessionLocal, engine
+
+# Query parameters that page through a listing without changing what is listed
+_PAGING_PARAMS = {"page", "pageSize", "sortBy", "sort", "exact_count"}
+
+
+class KeysetCursors:
+    """
+    Last primary key of recently served admin list pages. Clicking "next"
+    looks up where the previous page ended and continues with
+    `WHERE id < last_id` instead of an OFFSET that reads every skipped row.
+    Per process, like the other in-memory caches; a miss falls back to OFFSET.
+    """
+
+    def __init__(self, max_entries: int = 1000):
+        self.max_entries = max_entries
+        self._cursors: "OrderedDict[Tuple, int]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple) -> Optional[int]:
+        with self._lock:
+            value = self._cursors.get(key)
+            if value is not None:
+                self._cursors.move_to_end(key)
+            return value
+
+    def put(self, key: Tuple, value: int):
+        with self._lock:
+            self._cursors[key] = value
+            self._cursors.move_to_end(key)
+            while len(self._cursors) > self.max_entries:
+                self._cursors.popitem(last=False)
+
+
+cursors = KeysetCursors(settings.admin_keyset_cursors)
+
+
+async def estimated_rows(table_name: str) -> Optional[int]:
+    """Row count from catalog statistics, None when there are none"""
+    async with AsyncSessionLocal() as db:
+        if engine.dialect.name == "postgresql":
+            # Kept up to date by autovacuum/ANALYZE, -1 if never analyzed
+            result = await db.execute(text("SELECT reltuples::bigint FROM pg_class WHERE oid = CAST(:name AS regclass)"), {"name": table_name})
+            estimate = result.scalar()
+            return estimate if estimate is not None and estimate >= 0 else None
+        # SQLite keeps no row estimate; the largest rowid is read off the
+        # primary key and only overshoots by the rows deleted since
+        result = await db.execute(text(f"SELECT max(rowid) FROM {table_name}"))
+        return result.scalar() or 0
+
+
+class LargeTableView(ModelView):
+    """
+    List view for tables too large for COUNT(*) and OFFSET on every page load:
+
+    - the total is estimated from catalog statistics when the listing is not
+      narrowed, and counted up to `admin_count_cap` rows when it is searched
+      or filtered; add `exact_count=1` to the URL for an exact count
+    - rows are listed newest first and "next page" continues from the last
+      primary key of the page before (keyset pagination); jumping to a page
+      that was not just visited, or sorting by a column, uses OFFSET
+    """
+
+    column_default_sort = ("id", True)
+
+    def _narrowed(self, request) -> bool:
+        return any(name not in _PAGING_PARAMS and value for name, value in request.query_params.items())
+
+    async def count(self, request, stmt=None) -> int:
+        if stmt is None or request.query_params.get("exact_count"):
+            return await super().count(request, stmt)
+        if not self._narrowed(request):
+            estimate = await estimated_rows(self.model.__tablename__)
+            if estimate is not None:
+                return estimate
+        # stmt is SELECT count(*) FROM (listing), count the listing up to the cap instead
+        listing = stmt.get_final_froms()[0].element
+        capped = select(func.count()).select_from(listing.limit(settings.admin_count_cap).subquery())
+        return (await self._run_query(capped))[0]
+
+    async def _filtered(self, stmt, request):
+        # Same filter handling as ModelView.list
+        for filter_ in self.get_filters():
+            value = request.query_params.get(filter_.parameter_name)
+            if not value:
+                continue
+            if getattr(filter_, "has_operator", False):
+                operation = request.query_params.get(f"{filter_.parameter_name}_op")
+                if operation:
+                    stmt = await filter_.get_filtered_query(stmt, operation, value, self.model)
+            else:
+                stmt = await filter_.get_filtered_query(stmt, value, self.model)
+        return stmt
+
+    async def list(self, request) -> Pagination:
+        if request.query_params.get("sortBy"):
+            return await super().list(request)
+
+        page = self.validate_page_number(request.query_params.get("page"), 1)
+        page_size = self.validate_page_number(request.query_params.get("pageSize"), self.page_size)
+        page_size = max(1, min(page_size, max(self.page_size_options)))
+        search = request.query_params.get("search", None)
+
+        stmt = self.list_query(request)
+        for relation in self._list_relations:
+            stmt = stmt.options(selectinload(relation))
+        stmt = await self._filtered(stmt, request)
+        if search:
+            stmt = self.search_query(stmt=stmt, term=search)
+
+        count = await self.count(request, select(func.count()).select_from(stmt.subquery()))
+        page = max(page, 1)
+        # A capped count only says there are at least that many rows, so pages
+        # past the cap are still served; otherwise stay within the last page
+        capped = self._narrowed(request) and not request.query_params.get("exact_count") and count >= settings.admin_count_cap
+        if not capped:
+            page = min(page, max(1, math.ceil(count / page_size)))
+
+        pk = self.pk_columns[0]
+        listing = (self.identity,) + tuple(sorted(
+            (name, value) for name, value in request.query_params.items() if name != "page"
+        )) + (page_size,)
+        after = cursors.get(listing + (page - 1,)) if page > 1 else None
+        stmt = stmt.order_by(pk.desc())
+        if after is not None:
+            stmt = stmt.where(pk < after).limit(page_size)
+        else:
+            stmt = stmt.limit(page_size).offset((page - 1) * page_size)
+        rows = await self._run_query(stmt)
+        if rows:
+            cursors.put(listing + (page,), getattr(rows[-1], pk.key))
+
+        return Pagination(rows=rows, page=page, page_size=page_size, count=count)
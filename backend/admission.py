@@ -0,0 +1,170 @@
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+import asyncio
+import json
+import logging
+import re
+from config import settings
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Route class of each path, first match wins. Paths matching none of these
+# (health checks, /metrics, /cities, websockets) are never queued or shed.
+ROUTE_CLASSES = (
+    # Long-lived event streams would hold an orders slot for their lifetime;
+    # "streams" has no configured limit, so it is never gated
+    ("streams", re.compile(r"^/orders/events$")),
+    ("invoice_pdf", re.compile(r"^/invoices/.+/pdf$")),
+    ("auth", re.compile(r"^/auth/")),
+    ("orders", re.compile(r"^/(orders|invoices)/")),
+    ("chat", re.compile(r"^/chat/")),
+    # The dashboard's CSS and JS are static files, never shed with its pages
+    ("admin", re.compile(r"^/admin(?!/statics/)(/|$)")),
+)
+
+ADMISSION_SHED = metrics.Counter("giftly_admission_shed_total", "Requests rejected with 503 by admission control", ("route_class", "reason"))
+ADMISSION_WAIT_SECONDS = metrics.Histogram("giftly_admission_wait_seconds", "Time admitted requests spent queued", ("route_class",),
+                                           buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5))
+
+
+def route_class(path: str) -> Optional[str]:
+    for name, pattern in ROUTE_CLASSES:
+        if pattern.match(path):
+            return name
+    return None
+
+
+class AdmissionGate:
+    """
+    Concurrency limit with a bounded FIFO queue for one route class. A slot
+    freed by a finishing request is handed straight to the oldest waiter.
+    Only used from the event loop, so plain counters are enough.
+    """
+
+    def __init__(self, name: str, concurrency: int, queue: int, timeout: float):
+        self.name = name
+        self.concurrency = concurrency
+        self.max_queue = queue
+        self.timeout = timeout
+        self.in_flight = 0
+        self.shed = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self) -> Optional[str]:
+        """Take a slot, or return why the request was shed"""
+        if self.in_flight < self.concurrency and not self._waiters:
+            self.in_flight += 1
+            return None
+        if len(self._waiters) >= self.max_queue:
+            return "queue_full"
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        started = asyncio.get_running_loop().time()
+        try:
+            await asyncio.wait_for(waiter, self.timeout)
+        except asyncio.TimeoutError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as the timeout fired, keep it
+                return None
+            try:
+                self._waiters.remove(waiter)
+            except ValueError:
+                pass
+            return "queue_timeout"
+        except asyncio.CancelledError:
+            # The client went away while queued
+            if waiter.done() and not waiter.cancelled():
+                # A slot was handed over before this task resumed, pass it on
+                self.release()
+            else:
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    pass
+            raise
+        ADMISSION_WAIT_SECONDS.observe(asyncio.get_running_loop().time() - started, self.name)
+        return None
+
+    def release(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                # in_flight stays the same, the slot moves to the waiter
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+
+class AdmissionControlMiddleware:
+    """
+    Pure ASGI middleware limiting how many requests of each route class run at
+    once, so a burst on one class (say invoice PDFs) cannot occupy every
+    threadpool worker and starve auth refreshes. Excess requests wait in a
+    bounded queue; when it is full, or a request waited too long, they get an
+    immediate 503 with Retry-After instead of queueing until clients time out.
+    """
+
+    def __init__(self, app, limits: Dict[str, Dict[str, float]] = None):
+        self.app = app
+        limits = settings.admission_limits if limits is None else limits
+        self.gates = {
+            name: AdmissionGate(name, int(limit["concurrency"]), int(limit["queue"]), limit["timeout"])
+            for name, limit in limits.items()
+        }
+        _gates.update(self.gates)
+
+    async def __call__(self, scope, receive, send):
+        gate = None
+        if scope["type"] == "http" and settings.admission_control_enabled:
+            name = route_class(scope["path"])
+            gate = self.gates.get(name) if name is not None else None
+        if gate is None:
+            await self.app(scope, receive, send)
+            return
+
+        reason = await gate.acquire()
+        if reason is not None:
+            gate.shed += 1
+            ADMISSION_SHED.inc(gate.name, reason)
+            logger.warning("Shed %s request: %s", gate.name, reason, extra={"event": "admission.shed", "route_class": gate.name, "reason": reason})
+            body = json.dumps({"detail": "Server is busy, please retry shortly"}).encode()
+            await send({"type": "http.response.start", "status": 503, "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(settings.admission_retry_after_seconds).encode()),
+            ]})
+            await send({"type": "http.response.body", "body": body})
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            gate.release()
+
+
+_gates: Dict[str, AdmissionGate] = {}
+
+
+def _gate_state() -> Dict[Tuple, float]:
+    values = {}
+    for name, gate in _gates.items():
+        values[(name, "in_flight")] = gate.in_flight
+        values[(name, "queued")] = gate.queued
+        values[(name, "concurrency")] = gate.concurrency
+    return values
+
+
+metrics.GaugeCallback("giftly_admission", "Admission control slots and queues per route class", ("route_class", "state"), _gate_state)
+
+
+def stats() -> dict:
+    return {
+        name: {"in_flight": gate.in_flight, "queued": gate.queued, "concurrency": gate.concurrency,
+               "max_queue": gate.max_queue, "shed": gate.shed}
+        for name, gate in _gates.items()
+    }
@@ -0,0 +1,126 @@
+from datetime import datetime, timedelta, timezone
+from typing import List
+import asyncio
+import logging
+from sqlalchemy import delete, desc, func, insert, select
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from config import settings
+from database import SessionLocal, advisory_lock
+from executors import run_db
+from models import Message, MessageArchive
+from serialization import MESSAGE_FIELDS, MESSAGE_COLUMNS, MESSAGE_ARCHIVE_COLUMNS
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Chat history is split by age: `messages` holds the hot window, anything
+# older than message_archive_after_days lives in `messages_archive` with the
+# same ids. Archived messages are always older than every hot message of
+# their conversation, so a newest-first page continues in the archive exactly
+# where the hot table runs out.
+
+# Postgres advisory lock key held for a run, so only one worker archives at a time
+_ADVISORY_LOCK_KEY = 0x61726368
+
+MESSAGES_ARCHIVED = metrics.Counter("giftly_messages_archived_total", "Messages moved from messages to messages_archive")
+
+
+def archive_messages(db: Session, older_than: datetime, batch_size: int) -> int:
+    """
+    Move messages sent before `older_than` to the archive, one committed chunk
+    of `batch_size` at a time so locks and transactions stay short. Returns
+    how many were moved.
+    """
+    moved = 0
+    # The newest message always stays. SQLite tables without AUTOINCREMENT
+    # hand out max(id) + 1, so archiving it would let the next message reuse
+    # an archived id (and its search entry, and break id > last_seen replay)
+    newest = db.query(func.max(Message.id)).scalar()
+    while newest is not None:
+        # Walk from the oldest id over the primary key; ids grow with sent_at,
+        # so the first chunk with a recent message is the last one
+        rows = db.query(Message.id, Message.sent_at).filter(Message.id < newest).order_by(Message.id).limit(batch_size).all()
+        ids = [message_id for message_id, sent_at in rows if _as_utc(sent_at) < older_than]
+        if not ids:
+            break
+        db.execute(insert(MessageArchive).from_select(MESSAGE_FIELDS, select(*MESSAGE_COLUMNS).where(Message.id.in_(ids))))
+        # A Core DELETE, so the ORM events leave the search entries alone: the
+        # ids are kept and search reads messages_archive too
+        db.execute(delete(Message).where(Message.id.in_(ids)), execution_options={"synchronize_session": False})
+        db.commit()
+        moved += len(ids)
+        MESSAGES_ARCHIVED.inc(amount=len(ids))
+        if len(ids) < len(rows):
+            break
+    return moved
+
+
+def _as_utc(value: datetime) -> datetime:
+    # SQLite hands back naive datetimes, they are stored in UTC
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+
+def run_archive() -> int:
+    older_than = datetime.now(timezone.utc) - timedelta(days=settings.message_archive_after_days)
+    with advisory_lock(_ADVISORY_LOCK_KEY) as acquired:
+        if not acquired:
+            # Another worker is archiving, two runs would move the same chunks
+            return 0
+        with SessionLocal() as db:
+            moved = archive_messages(db, older_than, settings.message_archive_batch_size)
+    if moved:
+        logger.info("Archived %d messages sent before %s", moved, older_than.isoformat(),
+                    extra={"event": "messages.archived", "count": moved})
+    return moved
+
+
+async def message_archive_loop():
+    while True:
+        try:
+            await run_db(run_archive)
+        except Exception:
+            # The database is down, or (SQLite, several workers) another worker moved the chunk first; next round retries
+            logger.exception("Message archive run failed", extra={"event": "messages.archive_failed"})
+        await asyncio.sleep(settings.message_archive_interval_seconds)
+
+
+def message_page(db: Session, conversation_id: int, skip: int, limit: int) -> list:
+    """
+    Newest-first page of a conversation's messages, continuing into the
+    archive once the client scrolls past the hot window
+    """
+    rows = db.query(*MESSAGE_COLUMNS).filter(
+        Message.conversation_id == conversation_id
+    ).order_by(desc(Message.sent_at)).offset(skip).limit(limit).all()
+    if len(rows) == limit:
+        return rows
+
+    if rows:
+        hot_total = skip + len(rows)
+    else:
+        hot_total = db.query(func.count(Message.id)).filter(Message.conversation_id == conversation_id).scalar()
+    rows += db.query(*MESSAGE_ARCHIVE_COLUMNS).filter(
+        MessageArchive.conversation_id == conversation_id
+    ).order_by(desc(MessageArchive.sent_at)).offset(max(0, skip - hot_total)).limit(limit - len(rows)).all()
+    return rows
+
+
+async def messages_after(db: AsyncSession, conversation_id: int, after_id: int, limit: int) -> List:
+    """Messages with id > `after_id` in id order, archived ones first, at most `limit`"""
+    result = await db.execute(
+        select(MessageArchive).where(
+            MessageArchive.conversation_id == conversation_id,
+            MessageArchive.id > after_id
+        ).order_by(MessageArchive.id).limit(limit)
+    )
+    rows = list(result.scalars().all())
+    if len(rows) < limit:
+        result = await db.execute(
+            select(Message).where(
+                Message.conversation_id == conversation_id,
+                Message.id > after_id
+            ).order_by(Message.id).limit(limit - len(rows))
+        )
+        rows += result.scalars().all()
+    return rows
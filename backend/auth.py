@@ -6,15 +6,18 @@ from passlib.context import CryptContext
 from jose import JWTError, jwt
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
+from sqlalchemy import select
 from models import User, JWTToken
 from config import settings
 from database import get_db, get_db_sync
+from executors import cpu_executor
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import logging
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 security = HTTPBearer()
+logger = logging.getLogger(__name__)
 
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
@@ -26,7 +29,7 @@ async def authenticate_user(db: AsyncSession, phone_number: str, password: str):
     user = await get_user_by_phone(db, phone_number)
     if not user:
         return False
-    if not verify_password(password, user.admin_password_hash):
+    if not await cpu_executor.run(verify_password, password, user.admin_password_hash):
         return False
     return user
 
@@ -240,3 +243,62 @@ def get_user_from_refresh_token(token: str, db: Session):
         raise credentials_exception
     return user
 
+async def get_current_user_from_token(token: str, db: AsyncSession) -> User:
+    """Extract user from a JWT passed outside the Authorization header (WebSocket and SSE connects)"""
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+    )
+    try:
+        payload = jwt.decode(token, settings.secret_key, algorithms=["HS256"])
+        phone_number: str = payload.get("sub")
+        token_type: str = payload.get("type")
+        is_temp: bool = payload.get("temp", False)
+
+        if phone_number is None:
+            logger.info("Token auth: No phone number in token", extra={"event": "auth.token_rejected"})
+            raise credentials_exception
+        if token_type == "refresh":
+            logger.info("Token auth: Refresh token not allowed", extra={"event": "auth.token_rejected"})
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Refresh token not allowed",
+            )
+    except JWTError as e:
+        logger.info("Token auth: JWT decode error: %s", e, extra={"event": "auth.token_rejected"})
+        raise credentials_exception
+
+    # For temporary tokens (used during profile completion), skip database check
+    if not is_temp:
+        # Check if token exists in database and is not revoked
+        jwt_token = await db.execute(
+            select(JWTToken).where(
+                JWTToken.access_token == token,
+                JWTToken.is_revoked == False
+            )
+        )
+        jwt_token = jwt_token.scalar_one_or_none()
+
+        if not jwt_token:
+            logger.info("Token auth: Token not found in database or revoked", extra={"event": "auth.token_rejected"})
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Token has been revoked or does not exist",
+            )
+
+        # Check if access token is expired
+        if datetime.utcnow() > jwt_token.access_token_expires_at:
+            logger.info("Token auth: Token expired at %s", jwt_token.access_token_expires_at, extra={"event": "auth.token_rejected"})
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Access token expired",
+            )
+
+    user = await db.execute(select(User).where(User.phone_number == phone_number))
+    user = user.scalar_one_or_none()
+    if user is None:
+        logger.info("Token auth: User not found", extra={"event": "auth.token_rejected"})
+        raise credentials_exception
+
+    logger.debug("Token auth: Authenticated user %s (temp token: %s)", user.id, is_temp, extra={"event": "auth.token_accepted"})
+    return user
@@ -0,0 +1,403 @@
+"""
+End-to-end load test of the customer journey.
+
+Each virtual user signs up and then loops over the app flow:
+
+    send-otp -> verify-otp -> complete-profile          (once per user)
+    orders create/list -> invoice create/fetch/pdf
+    -> chat conversation/messages REST -> /ws/chat round trips
+
+A websocket round trip is timed from the customer sending a message to the
+seeded courier's socket on the same conversation receiving it (the sender
+does not get its own message back).
+
+Requests run in-process through the ASGI app by default, against whatever
+DATABASE_URL points at (local SQLite or Postgres). Pass --base-url to drive a
+running server instead (websocket steps then need the `websockets` package).
+The HTTP client is httpx, which is not in requirements.txt.
+
+    DATABASE_URL=sqlite+aiosqlite:///./load.db python benchmarks/load_test.py --users 20 --iterations 5
+    python benchmarks/load_test.py --save baseline.json
+    python benchmarks/load_test.py --compare baseline.json --threshold 20
+
+Reports throughput, p50/p95/p99 latency and error rate per step. With
+--compare the run fails when a step's p95 or error rate regresses past the
+threshold.
+"""
+import sys
+import os
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(backend_dir)
+os.chdir(backend_dir)
+# Every virtual user chats with the same seeded courier, lift the per-user socket cap
+os.environ.setdefault("WS_MAX_SOCKETS_PER_USER", "100000")
+# All virtual users share one client IP, which the auth rate limits would throttle
+os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+
+import argparse
+import asyncio
+import json
+import platform
+import random
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+import httpx
+from sqlalchemy import select
+from database import AsyncSessionLocal, engine, Base
+from models import User, City
+from auth import create_access_token
+
+STEPS = (
+    "send_otp", "verify_otp", "complete_profile",
+    "create_order", "list_orders", "create_invoice", "get_invoice", "invoice_pdf",
+    "open_conversation", "send_message", "list_messages", "ws_connect", "ws_round_trip",
+)
+
+
+class StepStats:
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.errors = 0
+        self.error_samples: Dict[str, int] = {}
+
+    def ok(self, elapsed: float):
+        self.latencies.append(elapsed)
+
+    def fail(self, elapsed: float, reason: str):
+        self.latencies.append(elapsed)
+        self.errors += 1
+        self.error_samples[reason] = self.error_samples.get(reason, 0) + 1
+
+    def summary(self, duration: float) -> dict:
+        ordered = sorted(self.latencies)
+        count = len(ordered)
+        return {
+            "count": count,
+            "errors": self.errors,
+            "error_rate": round(self.errors / count, 4) if count else 0.0,
+            "throughput_rps": round(count / duration, 2) if duration else 0.0,
+            "p50_ms": _percentile(ordered, 0.50),
+            "p95_ms": _percentile(ordered, 0.95),
+            "p99_ms": _percentile(ordered, 0.99),
+            "max_ms": round(ordered[-1] * 1000, 2) if ordered else None,
+            "error_samples": dict(sorted(self.error_samples.items(), key=lambda item: -item[1])[:5]),
+        }
+
+
+def _percentile(ordered: List[float], fraction: float) -> Optional[float]:
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return round(ordered[index] * 1000, 2)
+
+
+class Journey:
+    """One virtual user walking through the app, recording each step"""
+
+    def __init__(self, client: httpx.AsyncClient, stats: Dict[str, StepStats], courier_id: int, courier_token: str,
+                 city_id: int, phone: str, ws_factory, ws_messages: int):
+        self.client = client
+        self.stats = stats
+        self.courier_id = courier_id
+        self.courier_token = courier_token
+        self.city_id = city_id
+        self.phone = phone
+        self.ws_factory = ws_factory
+        self.ws_messages = ws_messages
+        self.headers: Dict[str, str] = {}
+
+    async def call(self, step: str, method: str, url: str, expect: int = 200, **kwargs) -> Optional[httpx.Response]:
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, headers=self.headers, **kwargs)
+        except Exception as exc:
+            self.stats[step].fail(time.perf_counter() - started, type(exc).__name__)
+            return None
+        elapsed = time.perf_counter() - started
+        if response.status_code != expect:
+            self.stats[step].fail(elapsed, f"HTTP {response.status_code}")
+            return None
+        self.stats[step].ok(elapsed)
+        return response
+
+    async def sign_up(self) -> bool:
+        response = await self.call("send_otp", "POST", "/auth/send-otp", json={"phone_number": self.phone})
+        if response is None:
+            return False
+        # Development mode returns the OTP in the response body
+        otp = response.json()["otp"]
+
+        response = await self.call("verify_otp", "POST", "/auth/verify-otp", json={"phone_number": self.phone, "otp": otp})
+        if response is None:
+            return False
+        self.headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+        response = await self.call("complete_profile", "POST", "/auth/complete-profile", json={
+            "phone_number": self.phone,
+            "name": f"Load {self.phone}",
+            "email": f"load{self.phone}@example.com",
+            "date_of_birth": "1995-01-01",
+        })
+        if response is None:
+            return False
+        self.headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        return True
+
+    async def iteration(self):
+        delivery = (datetime.utcnow() + timedelta(days=2)).isoformat()
+        response = await self.call("create_order", "POST", "/orders/", json={
+            "description": "Flowers and a card", "city_id": self.city_id, "delivery_date": delivery,
+        })
+        await self.call("list_orders", "GET", "/orders/")
+
+        if response is not None:
+            order_id = response.json()["id"]
+            created = await self.call("create_invoice", "POST", "/invoices/", json={
+                "order_id": order_id, "full_amount": 250, "order_only_price": 200,
+                "service_fee": 20, "courier_fee": 30, "description": "Flowers and a card",
+            })
+            if created is not None:
+                await self.call("get_invoice", "GET", f"/invoices/order/{order_id}")
+                await self.call("invoice_pdf", "GET", f"/invoices/order/{order_id}/pdf")
+
+        response = await self.call("open_conversation", "POST", "/chat/conversations", json={"other_user_id": self.courier_id})
+        if response is None:
+            return
+        conversation_id = response.json()["id"]
+        await self.call("send_message", "POST", f"/chat/conversations/{conversation_id}/messages", json={"content": "Is it on the way?"})
+        await self.call("list_messages", "GET", f"/chat/conversations/{conversation_id}/messages")
+        await self.chat(conversation_id)
+
+    async def connect(self, conversation_id: int, token: str):
+        started = time.perf_counter()
+        try:
+            socket = await self.ws_factory(conversation_id, token)
+        except Exception as exc:
+            self.stats["ws_connect"].fail(time.perf_counter() - started, type(exc).__name__)
+            return None
+        self.stats["ws_connect"].ok(time.perf_counter() - started)
+        return socket
+
+    async def chat(self, conversation_id: int):
+        socket = await self.connect(conversation_id, self.headers["Authorization"].split(" ", 1)[1])
+        if socket is None:
+            return
+        # The server does not echo a message to its sender, the courier's socket receives it
+        courier_socket = await self.connect(conversation_id, self.courier_token)
+        if courier_socket is None:
+            await socket.close()
+            return
+
+        try:
+            for i in range(self.ws_messages):
+                started = time.perf_counter()
+                content = f"load {self.phone} #{i}"
+                try:
+                    await socket.send(json.dumps({"content": content}))
+                    while True:
+                        frame = json.loads(await asyncio.wait_for(courier_socket.recv(), timeout=10))
+                        if frame.get("type") == "ping":
+                            await courier_socket.send(json.dumps({"type": "pong"}))
+                        elif frame.get("content") == content:
+                            break
+                except Exception as exc:
+                    self.stats["ws_round_trip"].fail(time.perf_counter() - started, type(exc).__name__)
+                    return
+                self.stats["ws_round_trip"].ok(time.perf_counter() - started)
+        finally:
+            await asyncio.gather(socket.close(), courier_socket.close())
+
+
+class InProcessSocket:
+    """ASGI websocket client for the in-process app with a websockets-like API"""
+
+    def __init__(self, app, conversation_id: int, token: str):
+        path = f"/ws/chat/{conversation_id}"
+        self.scope = {
+            "type": "websocket", "path": path, "raw_path": path.encode(),
+            "query_string": f"token={token}".encode(), "headers": [], "scheme": "ws",
+            "server": ("load", 80), "client": ("load", 0), "root_path": "", "subprotocols": [],
+        }
+        self.app = app
+        self.inbox: asyncio.Queue = asyncio.Queue()
+        self.outbox: asyncio.Queue = asyncio.Queue()
+        self.accepted = asyncio.Event()
+        self.closed = False
+        self.task: Optional[asyncio.Task] = None
+
+    async def open(self):
+        self.inbox.put_nowait({"type": "websocket.connect"})
+        self.task = asyncio.create_task(self.app(self.scope, self.inbox.get, self._send))
+        await asyncio.wait_for(self.accepted.wait(), timeout=10)
+        if self.closed:
+            raise ConnectionError("websocket rejected")
+        return self
+
+    async def _send(self, message):
+        if message["type"] == "websocket.accept":
+            self.accepted.set()
+        elif message["type"] == "websocket.close":
+            self.closed = True
+            self.accepted.set()
+            self.outbox.put_nowait(None)
+        elif message["type"] == "websocket.send":
+            self.outbox.put_nowait(message.get("text"))
+
+    async def send(self, text: str):
+        self.inbox.put_nowait({"type": "websocket.receive", "text": text})
+
+    async def recv(self) -> str:
+        text = await self.outbox.get()
+        if text is None:
+            raise ConnectionError("websocket closed")
+        return text
+
+    async def close(self):
+        self.inbox.put_nowait({"type": "websocket.disconnect", "code": 1000})
+        if self.task is not None:
+            await asyncio.gather(self.task, return_exceptions=True)
+
+
+async def seed() -> tuple:
+    """
+    Create tables, an active city and the courier every user chats with.
+    Returns (city_id, courier_id, courier_token); the token is signed with
+    this process's SECRET_KEY, which a --base-url server must share.
+    """
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    async with AsyncSessionLocal() as db:
+        city = (await db.execute(select(City).where(City.active == True).limit(1))).scalar_one_or_none()
+        if city is None:
+            city = City(name="Riyadh", active=True)
+            db.add(city)
+        courier = (await db.execute(select(User).where(User.phone_number == "500000990"))).scalar_one_or_none()
+        if courier is None:
+            courier = User(phone_number="500000990", name="Load Courier", role="Courier", is_verified=True)
+            db.add(courier)
+        await db.commit()
+        # Temporary tokens are accepted by /ws/chat without a token table row
+        courier_token = create_access_token(data={"sub": courier.phone_number, "temp": True}, expires_delta=timedelta(hours=6))
+        return city.id, courier.id, courier_token
+
+
+async def run(args) -> dict:
+    if args.base_url:
+        try:
+            import websockets
+        except ImportError:
+            websockets = None
+        client = httpx.AsyncClient(base_url=args.base_url, timeout=30)
+        ws_base = args.base_url.replace("http", "ws", 1)
+
+        async def ws_factory(conversation_id, token):
+            if websockets is None:
+                raise RuntimeError("websockets not installed")
+            return await websockets.connect(f"{ws_base}/ws/chat/{conversation_id}?token={token}")
+    else:
+        from main import app
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://load", timeout=30)
+
+        async def ws_factory(conversation_id, token):
+            return await InProcessSocket(app, conversation_id, token).open()
+
+    city_id, courier_id, courier_token = await seed()
+    stats = {step: StepStats() for step in STEPS}
+    # A run-specific prefix keeps phone numbers and emails unique across runs on the same database
+    prefix = random.randint(100, 999)
+    semaphore = asyncio.Semaphore(args.concurrency or args.users)
+
+    async def user(index: int):
+        journey = Journey(client, stats, courier_id, courier_token, city_id, f"5{prefix}{index:05d}", ws_factory, args.ws_messages)
+        async with semaphore:
+            if not await journey.sign_up():
+                return
+            for _ in range(args.iterations):
+                await journey.iteration()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user(i) for i in range(args.users)))
+    duration = time.perf_counter() - started
+    await client.aclose()
+    if not args.base_url:
+        await engine.dispose()
+
+    total = sum(len(step.latencies) for step in stats.values())
+    errors = sum(step.errors for step in stats.values())
+    return {
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat(),
+            "target": args.base_url or f"in-process ({engine.url.get_backend_name()})",
+            "python": platform.python_version(),
+            "users": args.users,
+            "iterations": args.iterations,
+            "ws_messages": args.ws_messages,
+        },
+        "duration_s": round(duration, 2),
+        "total": {
+            "requests": total,
+            "errors": errors,
+            "error_rate": round(errors / total, 4) if total else 0.0,
+            "throughput_rps": round(total / duration, 2),
+        },
+        "steps": {name: step.summary(duration) for name, step in stats.items()},
+    }
+
+
+def print_report(results: dict):
+    print(f"\n{results['meta']['target']}: {results['meta']['users']} users x {results['meta']['iterations']} iterations "
+          f"in {results['duration_s']}s")
+    print(f"{'step':<18}{'count':>7}{'err%':>7}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, step in results["steps"].items():
+        if not step["count"]:
+            continue
+        print(f"{name:<18}{step['count']:>7}{step['error_rate'] * 100:>6.1f}%{step['throughput_rps']:>9}"
+              f"{step['p50_ms']:>10}{step['p95_ms']:>10}{step['p99_ms']:>10}")
+        for reason, count in step["error_samples"].items():
+            print(f"{'':<18}  {count}x {reason}")
+    total = results["total"]
+    print(f"{'total':<18}{total['requests']:>7}{total['error_rate'] * 100:>6.1f}%{total['throughput_rps']:>9}")
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> bool:
+    """Print per-step changes against a saved run, return False on regression"""
+    print(f"\nCompared with baseline from {baseline['meta']['timestamp']} (threshold {threshold:.0f}%)")
+    ok = True
+    for name, step in results["steps"].items():
+        before = baseline["steps"].get(name)
+        if not before or not before["count"] or not step["count"]:
+            continue
+        change = (step["p95_ms"] - before["p95_ms"]) / before["p95_ms"] * 100 if before["p95_ms"] else 0.0
+        regressed = change > threshold or step["error_rate"] > before["error_rate"] + 0.01
+        ok = ok and not regressed
+        print(f"{name:<18} p95 {before['p95_ms']:>8} -> {step['p95_ms']:>8} ms ({change:+6.1f}%)  "
+              f"errors {before['error_rate'] * 100:.1f}% -> {step['error_rate'] * 100:.1f}%{'  REGRESSED' if regressed else ''}")
+    before, after = baseline["total"]["throughput_rps"], results["total"]["throughput_rps"]
+    print(f"{'throughput':<18} {before} -> {after} req/s")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--iterations", type=int, default=5, help="journeys per user after sign-up")
+    parser.add_argument("--concurrency", type=int, default=0, help="users active at once (default: all)")
+    parser.add_argument("--ws-messages", type=int, default=5, help="websocket round trips per journey")
+    parser.add_argument("--base-url", help="drive a running server instead of the in-process app")
+    parser.add_argument("--save", help="write results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON file to compare against")
+    parser.add_argument("--threshold", type=float, default=20, help="allowed p95 regression in percent")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    print_report(results)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nSaved results to {args.save}")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        sys.exit(0 if compare(results, baseline, args.threshold) else 1)
@@ -0,0 +1,141 @@
+"""
+Event-loop latency under chat load, to compare logging pipelines.
+
+Drives /ws/chat/{conversation_id} in-process with several customer/courier
+socket pairs that repeatedly connect, exchange messages and disconnect, while
+a probe task measures how late the event loop wakes up from a short sleep.
+
+    --log-mode queue   the app's pipeline: queue handler, INFO level, sampling
+    --log-mode sync    every record written synchronously to stdout at DEBUG,
+                       which is what the per-step print() calls used to cost
+
+Redirect stdout to a file to keep terminal speed out of the numbers:
+
+    DATABASE_URL=sqlite+aiosqlite:///./loop.db python benchmarks/loop_latency.py --log-mode sync > /tmp/sync.log
+"""
+import sys
+import os
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(backend_dir)
+os.chdir(backend_dir)
+# All pairs share one conversation, lift the per-user/per-conversation socket caps
+os.environ.setdefault("WS_MAX_SOCKETS_PER_USER", "100000")
+os.environ.setdefault("WS_MAX_SOCKETS_PER_CONVERSATION", "100000")
+
+import argparse
+import asyncio
+import logging
+import statistics
+import time
+from benchmarks.ws_soak import seed
+from logging_config import ContextFilter, JsonFormatter, shutdown_logging
+from main import app
+
+PROBE_INTERVAL = 0.005
+
+
+class ChatSocket:
+    """ASGI websocket client fed from a queue"""
+
+    def __init__(self, conversation_id: int, token: str):
+        self.scope = {
+            "type": "websocket",
+            "path": f"/ws/chat/{conversation_id}",
+            "raw_path": f"/ws/chat/{conversation_id}".encode(),
+            "query_string": f"token={token}".encode(),
+            "headers": [],
+            "scheme": "ws",
+            "server": ("bench", 80),
+            "client": ("bench", 0),
+            "root_path": "",
+            "subprotocols": [],
+        }
+        self.inbox: asyncio.Queue = asyncio.Queue()
+        self.outbox: asyncio.Queue = asyncio.Queue()
+        self.accepted = asyncio.Event()
+        self.inbox.put_nowait({"type": "websocket.connect"})
+
+    async def receive(self):
+        return await self.inbox.get()
+
+    async def send(self, message):
+        if message["type"] in ("websocket.accept", "websocket.close"):
+            self.accepted.set()
+        elif message["type"] == "websocket.send":
+            self.outbox.put_nowait(message)
+
+    def send_text(self, text: str):
+        self.inbox.put_nowait({"type": "websocket.receive", "text": text})
+
+    def close(self):
+        self.inbox.put_nowait({"type": "websocket.disconnect", "code": 1000})
+
+
+async def probe(lags: list, stop: asyncio.Event):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(PROBE_INTERVAL)
+        lags.append(time.perf_counter() - started - PROBE_INTERVAL)
+
+
+async def chat_round(conversation_id: int, tokens: list, messages: int):
+    sender, receiver = ChatSocket(conversation_id, tokens[0]), ChatSocket(conversation_id, tokens[1])
+    tasks = [asyncio.create_task(app(s.scope, s.receive, s.send)) for s in (sender, receiver)]
+    await asyncio.gather(sender.accepted.wait(), receiver.accepted.wait())
+    for i in range(messages):
+        sender.send_text('{"type": "message", "content": "load %d"}' % i)
+        await receiver.outbox.get()
+    sender.close()
+    receiver.close()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def run(pairs: int, rounds: int, messages: int):
+    conversation_id, tokens = await seed()
+
+    lags: list = []
+    stop = asyncio.Event()
+    probe_task = asyncio.create_task(probe(lags, stop))
+    started = time.perf_counter()
+    for _ in range(rounds):
+        await asyncio.gather(*(chat_round(conversation_id, tokens, messages) for _ in range(pairs)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await probe_task
+
+    lags_ms = sorted(lag * 1000 for lag in lags)
+    total = pairs * rounds * messages
+    report = (
+        f"{total} messages in {elapsed:.1f}s ({total / elapsed:.0f} msg/s), loop lag ms: "
+        f"p50={statistics.median(lags_ms):.2f} "
+        f"p99={lags_ms[int(len(lags_ms) * 0.99) - 1]:.2f} "
+        f"max={lags_ms[-1]:.2f}"
+    )
+    print(report, file=sys.stderr)
+
+
+def use_sync_logging():
+    """Replace the queue pipeline with a direct stdout handler, app loggers at DEBUG, no sampling"""
+    shutdown_logging()
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter())
+    handler.addFilter(ContextFilter())
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(logging.INFO)
+    # Only the application's own loggers go to DEBUG, like the old prints did
+    for name in ("main", "realtime", "routers"):
+        logging.getLogger(name).setLevel(logging.DEBUG)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--log-mode", choices=["queue", "sync"], default="queue")
+    parser.add_argument("--pairs", type=int, default=20)
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--messages", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.log_mode == "sync":
+        use_sync_logging()
+    asyncio.run(run(args.pairs, args.rounds, args.messages))
@@ -0,0 +1,209 @@
+"""
+Microbenchmarks for the CPU-bound hot spots.
+
+    serialize_orders_*   OrderResponse list with nested InvoiceResponse, validated
+                         from ORM-like objects and dumped to JSON the way the
+                         response_model path does it (10 / 1k / 10k orders)
+    fast_orders_*        the same payloads through the serialization fast path:
+                         column rows to dicts, encoded by FastJSONResponse
+    invoice_pdf_*        generate_invoice_pdf with a short and a long description
+    jwt_*                auth.create_access_token and decoding its result
+    validate_*           the regex validators on SendOTP and OTPVerify
+
+No database is touched. Each benchmark is calibrated to run for at least
+--min-time seconds per round, and the fastest and median time per call over
+--rounds rounds is reported.
+
+    python benchmarks/micro.py
+    python benchmarks/micro.py --save micro_baseline.json
+    python benchmarks/micro.py --compare micro_baseline.json --threshold 15
+    python benchmarks/micro.py --filter serialize
+
+With --compare the run exits non-zero when a benchmark's median time per call
+grew past the threshold, so it can gate a deploy.
+"""
+import sys
+import os
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(backend_dir)
+os.chdir(backend_dir)
+
+import argparse
+import json
+import platform
+import statistics
+import timeit
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from typing import Callable, Dict, List
+from jose import jwt
+from pydantic import TypeAdapter, ValidationError
+from auth import create_access_token
+from config import settings
+from routers.invoices import generate_invoice_pdf
+from schemas import OrderResponse, SendOTP, OTPVerify
+from serialization import FastJSONResponse, ORDER_FIELDS, INVOICE_FIELDS, order_rows_to_dicts
+
+ORDER_LIST = TypeAdapter(List[OrderResponse])
+
+
+def _invoice(index: int, description: str) -> SimpleNamespace:
+    now = datetime(2026, 1, 1, 12, 0)
+    return SimpleNamespace(
+        id=index, invoice_id=f"INV-{index:06d}", order_id=index, full_amount=250, service_fee=20,
+        order_only_price=200, courier_fee=30, status="new", description=description, comment=None,
+        sent_to_user_via_email=False, sent_at=None, due_date=now + timedelta(days=7), tax_amount=30,
+        discount_amount=0, created_at=now, updated_at=now,
+    )
+
+
+def _order(index: int) -> SimpleNamespace:
+    now = datetime(2026, 1, 1, 12, 0)
+    return SimpleNamespace(
+        id=index, order_id=f"ORD-{index:06d}", created_by_user_id=1, assigned_to_user_id=2,
+        description="Flowers and a card", creation_date=now, delivery_date=now + timedelta(days=2),
+        status="in progress to do", comments=None, updated_at=now, city_id=1, version=1,
+        # Every other order has an invoice, like a list mixing fresh and billed orders
+        invoice=_invoice(index, "Flowers and a card") if index % 2 == 0 else None,
+    )
+
+
+def serialize_orders(count: int) -> Callable[[], object]:
+    orders = [_order(i) for i in range(count)]
+
+    def run():
+        validated = ORDER_LIST.validate_python(orders, from_attributes=True)
+        return json.dumps(ORDER_LIST.dump_python(validated, mode="json"))
+    return run
+
+
+def fast_orders(count: int) -> Callable[[], object]:
+    # Rows shaped like ORDER_WITH_INVOICE_COLUMNS results (invoice columns null when not joined)
+    rows = []
+    for order in (_order(i) for i in range(count)):
+        invoice = order.invoice
+        rows.append(tuple(getattr(order, name) for name in ORDER_FIELDS)
+                    + tuple(getattr(invoice, name) if invoice else None for name in INVOICE_FIELDS))
+    return lambda: FastJSONResponse(order_rows_to_dicts(rows)).body
+
+
+def invoice_pdf(description: str) -> Callable[[], object]:
+    invoice = _invoice(1, description)
+    return lambda: generate_invoice_pdf(invoice)
+
+
+def jwt_encode() -> Callable[[], object]:
+    return lambda: create_access_token({"sub": "559644339"}, expires_delta=timedelta(minutes=30))
+
+
+def jwt_decode() -> Callable[[], object]:
+    token = create_access_token({"sub": "559644339"}, expires_delta=timedelta(minutes=30))
+    return lambda: jwt.decode(token, settings.secret_key, algorithms=["HS256"])
+
+
+def validate_send_otp() -> Callable[[], object]:
+    return lambda: SendOTP(phone_number="+966559644339")
+
+
+def validate_otp_verify() -> Callable[[], object]:
+    return lambda: OTPVerify(phone_number="0559644339", otp="123456", name="محمد Ali")
+
+
+def validate_otp_rejected() -> Callable[[], object]:
+    def run():
+        try:
+            OTPVerify(phone_number="12345", otp="12ab")
+        except ValidationError:
+            pass
+    return run
+
+
+LONG_DESCRIPTION = "Bouquet of red roses with a handwritten card, wrapped in gold paper. " * 30
+
+BENCHMARKS: Dict[str, Callable[[], Callable[[], object]]] = {
+    "serialize_orders_10": lambda: serialize_orders(10),
+    "serialize_orders_1k": lambda: serialize_orders(1_000),
+    "serialize_orders_10k": lambda: serialize_orders(10_000),
+    "fast_orders_10": lambda: fast_orders(10),
+    "fast_orders_1k": lambda: fast_orders(1_000),
+    "fast_orders_10k": lambda: fast_orders(10_000),
+    "invoice_pdf_short": lambda: invoice_pdf("Flowers and a card"),
+    "invoice_pdf_long": lambda: invoice_pdf(LONG_DESCRIPTION),
+    "jwt_encode": jwt_encode,
+    "jwt_decode": jwt_decode,
+    "validate_send_otp": validate_send_otp,
+    "validate_otp_verify": validate_otp_verify,
+    "validate_otp_rejected": validate_otp_rejected,
+}
+
+
+def measure(func: Callable[[], object], rounds: int, min_time: float) -> dict:
+    timer = timeit.Timer(func)
+    # Calibrate the loop count so one round takes at least min_time
+    number = 1
+    while timer.timeit(number) < min_time:
+        number *= 2
+    per_call = [elapsed / number for elapsed in timer.repeat(repeat=rounds, number=number)]
+    return {
+        "loops": number,
+        "min_us": round(min(per_call) * 1e6, 2),
+        "median_us": round(statistics.median(per_call) * 1e6, 2),
+        "stdev_us": round(statistics.stdev(per_call) * 1e6, 2) if len(per_call) > 1 else 0.0,
+    }
+
+
+def run(args) -> dict:
+    results = {}
+    for name, setup in BENCHMARKS.items():
+        if args.filter and args.filter not in name:
+            continue
+        results[name] = measure(setup(), args.rounds, args.min_time)
+        print(f"{name:<24}{results[name]['median_us']:>14} us{results[name]['min_us']:>14} us"
+              f"{results[name]['loops']:>8}", flush=True)
+    return {
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "rounds": args.rounds,
+        },
+        "benchmarks": results,
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> bool:
+    """Print per-benchmark changes against a saved run, return False on regression"""
+    print(f"\nCompared with baseline from {baseline['meta']['timestamp']} (threshold {threshold:.0f}%)")
+    ok = True
+    for name, current in results["benchmarks"].items():
+        before = baseline["benchmarks"].get(name)
+        if not before:
+            continue
+        change = (current["median_us"] - before["median_us"]) / before["median_us"] * 100
+        regressed = change > threshold
+        ok = ok and not regressed
+        print(f"{name:<24}{before['median_us']:>14} -> {current['median_us']:>14} us ({change:+6.1f}%)"
+              f"{'  REGRESSED' if regressed else ''}")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds per round")
+    parser.add_argument("--filter", help="only run benchmarks whose name contains this")
+    parser.add_argument("--save", help="write results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON file to compare against")
+    parser.add_argument("--threshold", type=float, default=15, help="allowed median slowdown in percent")
+    args = parser.parse_args()
+
+    print(f"{'benchmark':<24}{'median':>17}{'min':>17}{'loops':>8}")
+    results = run(args)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nSaved results to {args.save}")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        sys.exit(0 if compare(results, baseline, args.threshold) else 1)
@@ -0,0 +1,137 @@
+"""
+Overload test for admission control.
+
+Floods GET /orders/ (a sync route) in-process with far more concurrent
+clients than the threadpool has threads, while a probe calls GET /auth/me at
+a steady pace. The same load runs twice, with admission control off and on:
+
+    off   every request queues for a thread, latency grows with the backlog
+          and the auth probe waits behind the orders flood
+    on    orders run at most `concurrency` at a time with a bounded queue,
+          the rest get 503 + Retry-After straight away; admitted requests and
+          the auth probe keep a bounded p99
+
+    DATABASE_URL=sqlite+aiosqlite:///./overload.db python benchmarks/overload.py --clients 400 --seconds 10
+"""
+import sys
+import os
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(backend_dir)
+os.chdir(backend_dir)
+os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+
+import argparse
+import asyncio
+import time
+from datetime import datetime, timedelta
+from typing import List
+import httpx
+from sqlalchemy import select
+from database import AsyncSessionLocal, engine, Base
+from models import User, City, Order
+from auth import create_access_token
+from config import settings
+from main import app
+
+
+async def seed(orders: int) -> str:
+    """A customer with some orders, return a temporary access token for them"""
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    async with AsyncSessionLocal() as db:
+        city = (await db.execute(select(City).limit(1))).scalar_one_or_none()
+        if city is None:
+            city = City(name="Riyadh", active=True)
+            db.add(city)
+        user = (await db.execute(select(User).where(User.phone_number == "500000980"))).scalar_one_or_none()
+        if user is None:
+            user = User(phone_number="500000980", name="Overload Customer", is_verified=True)
+            db.add(user)
+            await db.flush()
+            for i in range(orders):
+                db.add(Order(order_id=f"OVLD-{i:06d}", created_by_user_id=user.id, city_id=city.id,
+                             description="Flowers", delivery_date=datetime.utcnow() + timedelta(days=2)))
+        await db.commit()
+        # Temporary tokens skip the token table lookup
+        return create_access_token(data={"sub": user.phone_number, "temp": True}, expires_delta=timedelta(hours=1))
+
+
+def _percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))] * 1000
+
+
+async def phase(client: httpx.AsyncClient, headers: dict, clients: int, seconds: float, probe_interval: float) -> dict:
+    admitted: List[float] = []
+    probe: List[float] = []
+    shed = errors = 0
+    deadline = time.perf_counter() + seconds
+
+    async def flood():
+        nonlocal shed, errors
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            response = await client.get("/orders/", headers=headers)
+            elapsed = time.perf_counter() - started
+            if response.status_code == 200:
+                admitted.append(elapsed)
+            elif response.status_code == 503:
+                shed += 1
+                # Honour Retry-After loosely so shed clients don't spin
+                await asyncio.sleep(min(float(response.headers.get("retry-after", 1)), 0.1))
+            else:
+                errors += 1
+
+    async def auth_probe():
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            response = await client.get("/auth/me", headers=headers)
+            if response.status_code == 200:
+                probe.append(time.perf_counter() - started)
+            await asyncio.sleep(probe_interval)
+
+    await asyncio.gather(auth_probe(), *(flood() for _ in range(clients)))
+    return {
+        "admitted": len(admitted),
+        "shed": shed,
+        "errors": errors,
+        "throughput": len(admitted) / seconds,
+        "p50": _percentile(admitted, 0.50),
+        "p99": _percentile(admitted, 0.99),
+        "max": max(admitted) * 1000 if admitted else float("nan"),
+        "probe_p50": _percentile(probe, 0.50),
+        "probe_p99": _percentile(probe, 0.99),
+    }
+
+
+async def main(args):
+    token = await seed(args.orders)
+    headers = {"Authorization": f"Bearer {token}"}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://overload", timeout=None) as client:
+        results = {}
+        for enabled in (False, True):
+            settings.admission_control_enabled = enabled
+            results["on" if enabled else "off"] = await phase(client, headers, args.clients, args.seconds, args.probe_interval)
+    await engine.dispose()
+
+    limits = settings.admission_limits["orders"]
+    print(f"\n{args.clients} clients on GET /orders/ for {args.seconds}s "
+          f"(orders class: concurrency {limits['concurrency']:.0f}, queue {limits['queue']:.0f})")
+    print(f"{'admission':<10}{'ok':>8}{'shed':>8}{'err':>6}{'ok/s':>9}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+          f"{'auth p50':>10}{'auth p99':>10}")
+    for name, r in results.items():
+        print(f"{name:<10}{r['admitted']:>8}{r['shed']:>8}{r['errors']:>6}{r['throughput']:>9.1f}{r['p50']:>10.1f}"
+              f"{r['p99']:>10.1f}{r['max']:>10.1f}{r['probe_p50']:>10.1f}{r['probe_p99']:>10.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=400)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--orders", type=int, default=50, help="orders seeded for the customer")
+    parser.add_argument("--probe-interval", type=float, default=0.1, help="seconds between /auth/me probes")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,297 @@
+"""
+Synthetic data generator for production-sized benchmark databases.
+
+Generates cities, customers and couriers, orders spread over time with a
+realistic status mix, invoices, and courier/customer conversations with
+messages, into whatever DATABASE_URL points at. Output is deterministic for a
+given --seed and sizes. Rows are streamed in batches: multi-row INSERTs on
+SQLite, COPY on Postgres. Ids are assigned here, after the current maximum, so
+seeding can be repeated on top of an existing dataset.
+
+    DATABASE_URL=sqlite+aiosqlite:///./bench.db python benchmarks/seed_data.py --users 10000 --orders 100000
+    python benchmarks/seed_data.py --users 1000000 --orders 10000000 --messages-per-conversation 30 --seed 7
+
+Distributions:
+    customers   a few place most orders (the order's customer is drawn with a
+                skew towards low ids), ~5% of users are couriers
+    cities      Zipf-like, the first cities get most orders
+    orders      spread over --days; older orders are mostly done or
+                cancelled, recent ones are still new or in progress
+    invoices    most orders past "new", paid once the order is paid
+    messages    geometric per conversation around the given mean
+
+Search indexes are not written row by row: the new orders and messages are
+indexed at the end, unless --no-search-index is passed (then run
+`python search.py` before searching).
+"""
+import sys
+import os
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(backend_dir)
+os.chdir(backend_dir)
+
+import argparse
+import csv
+import enum
+import io
+import math
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterator, List, Sequence, Tuple
+from sqlalchemy import func, insert, select, text
+from database import Base, sync_engine, SessionLocal
+from models import User, City, Order, Invoice, Conversation, Message, OrderStatus, InvoiceStatus
+
+FIRST_NAMES = ["Mohammed", "Abdullah", "Fahad", "Khalid", "Saad", "Faisal", "Omar", "Sara", "Noura", "Reem", "Lama", "Hessa",
+               "محمد", "عبدالله", "فهد", "خالد", "نورة", "سارة", "ريم", "لمى"]
+LAST_NAMES = ["Alotaibi", "Alqahtani", "Alghamdi", "Alharbi", "Alzahrani", "Aldosari", "العتيبي", "القحطاني", "الغامدي", "الحربي"]
+CITY_NAMES = ["Riyadh", "Jeddah", "Mecca", "Medina", "Dammam", "Khobar", "Taif", "Tabuk", "Abha", "Buraidah", "Hail", "Najran",
+              "Jazan", "Yanbu", "Al Ahsa", "Jubail", "Qatif", "Khamis Mushait", "Al Kharj", "Arar"]
+GIFTS = ["Flowers", "Chocolate box", "Perfume", "Watch", "Cake", "Dates gift box", "Oud", "Book", "Toy", "Balloons",
+         "ورد", "شوكولاتة", "عطر", "كيكة", "تمور", "بخور", "هدية تخرج", "هدية مولود"]
+PHRASES = ["Hi, I'm on my way", "Can you add a card?", "The shop is closed, any alternative?", "Delivered, thank you",
+           "What time will it arrive?", "Please call when you are outside", "السلام عليكم", "تم التوصيل", "متى يوصل الطلب؟",
+           "أبي أضيف بطاقة إهداء", "المحل مسكر، فيه بديل؟", "شكراً لك", "Total is updated in the invoice", "الحين في الطريق"]
+
+# Status mix by order age, as (status, weight)
+RECENT_STATUSES = [(OrderStatus.NEW, 30), (OrderStatus.RECEIVED_BY_COURIER, 20), (OrderStatus.PAID, 15),
+                   (OrderStatus.IN_PROGRESS_TO_DO, 12), (OrderStatus.IN_PROGRESS_TO_DELIVER, 8),
+                   (OrderStatus.DONE, 10), (OrderStatus.CANCELLED, 5)]
+SETTLED_STATUSES = [(OrderStatus.DONE, 82), (OrderStatus.CANCELLED, 15), (OrderStatus.PAID, 2), (OrderStatus.NEW, 1)]
+RECENT_DAYS = 7
+
+
+class Writer:
+    """Bulk writes batches of rows: COPY on Postgres, executemany INSERT elsewhere"""
+
+    def __init__(self, connection, batch_size: int):
+        self.connection = connection
+        self.batch_size = batch_size
+        self.copy = connection.dialect.name == "postgresql"
+        self.counts: Dict[str, int] = {}
+        self.seconds: Dict[str, float] = {}
+
+    def write(self, model, columns: Sequence[str], rows: Iterator[tuple]):
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                self._flush(model, columns, batch)
+                batch = []
+        if batch:
+            self._flush(model, columns, batch)
+
+    def _flush(self, model, columns: Sequence[str], batch: List[tuple]):
+        table = model.__table__
+        started = time.perf_counter()
+        if self.copy:
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            for row in batch:
+                # Enum columns store member names, None becomes NULL
+                writer.writerow([value.name if isinstance(value, enum.Enum) else value for value in row])
+            buffer.seek(0)
+            cursor = self.connection.connection.dbapi_connection.cursor()
+            cursor.copy_expert(f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+        else:
+            self.connection.execute(insert(table), [dict(zip(columns, row)) for row in batch])
+        self.connection.commit()
+        elapsed = time.perf_counter() - started
+        self.counts[table.name] = self.counts.get(table.name, 0) + len(batch)
+        self.seconds[table.name] = self.seconds.get(table.name, 0) + elapsed
+        print(f"\r{table.name:<15}{self.counts[table.name]:>14,} rows  {self.counts[table.name] / self.seconds[table.name]:>10,.0f} rows/s",
+              end="", flush=True)
+
+    def done(self, model):
+        if model.__table__.name in self.counts:
+            print()
+
+
+def next_id(connection, model) -> int:
+    return (connection.execute(select(func.max(model.id))).scalar() or 0) + 1
+
+
+def weighted(rng: random.Random, choices: List[Tuple]) -> object:
+    values, weights = zip(*choices)
+    return rng.choices(values, weights)[0]
+
+
+def skewed_index(rng: random.Random, size: int, skew: float) -> int:
+    # rng.random() ** skew leans towards 0: low indexes are drawn far more often
+    return min(size - 1, int(size * rng.random() ** skew))
+
+
+def geometric(rng: random.Random, mean: float) -> int:
+    if mean <= 1:
+        return 1
+    return 1 + int(math.log(1 - rng.random()) / math.log(1 - 1 / mean))
+
+
+def seed(args):
+    rng = random.Random(args.seed)
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    start = now - timedelta(days=args.days)
+
+    if args.create_schema:
+        Base.metadata.create_all(sync_engine)
+
+    started = time.perf_counter()
+    with sync_engine.connect() as connection:
+        writer = Writer(connection, args.batch_size)
+
+        city_start = next_id(connection, City)
+        city_ids = list(range(city_start, city_start + args.cities))
+        writer.write(City, ("id", "name", "icon", "active"), (
+            (city_id, CITY_NAMES[i % len(CITY_NAMES)] + (f" {i // len(CITY_NAMES) + 1}" if i >= len(CITY_NAMES) else ""), None, i < args.cities - 2)
+            for i, city_id in enumerate(city_ids)
+        ))
+        writer.done(City)
+
+        user_start = next_id(connection, User)
+        courier_count = max(1, int(args.users * args.courier_ratio))
+        customer_count = args.users - courier_count
+        # Couriers first, then customers
+        courier_ids = range(user_start, user_start + courier_count)
+        customer_ids = range(user_start + courier_count, user_start + args.users)
+
+        def users():
+            for user_id in range(user_start, user_start + args.users):
+                courier = user_id < user_start + courier_count
+                name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+                email = f"user{user_id}@example.com" if rng.random() < 0.6 else None
+                yield (user_id, f"5{user_id % 100_000_000:08d}", email, name, True, "Courier" if courier else "Customer",
+                       city_ids[skewed_index(rng, len(city_ids), 2.5)], start + timedelta(seconds=rng.random() * args.days * 86400))
+        writer.write(User, ("id", "phone_number", "email", "name", "is_verified", "role", "city_id", "otp_created_at"), users())
+        writer.done(User)
+
+        order_start = next_id(connection, Order)
+        invoice_start = next_id(connection, Invoice)
+        # (customer, courier) -> time of their first order, for conversations
+        pairs: Dict[Tuple[int, int], datetime] = {}
+        invoices: List[tuple] = []
+        invoice_id = invoice_start
+        seconds_per_order = args.days * 86400 / max(args.orders, 1)
+
+        def orders():
+            nonlocal invoice_id
+            for n in range(args.orders):
+                order_id = order_start + n
+                # Even spread over the window with jitter, ids grow with creation time
+                created = start + timedelta(seconds=(n + rng.random()) * seconds_per_order)
+                age_days = (now - created).days
+                status = weighted(rng, RECENT_STATUSES if age_days < RECENT_DAYS else SETTLED_STATUSES)
+                customer = customer_ids[skewed_index(rng, customer_count, args.customer_skew)]
+                courier = None
+                if status != OrderStatus.NEW or rng.random() < 0.1:
+                    courier = courier_ids[skewed_index(rng, courier_count, 1.5)]
+                    pairs.setdefault((customer, courier), created)
+                yield (order_id, f"ORD-{order_id:08d}", customer, courier, f"{rng.choice(GIFTS)} for {rng.choice(FIRST_NAMES)}",
+                       created, created + timedelta(days=rng.randint(1, 5)), status, None, created + timedelta(hours=rng.randint(0, 72)),
+                       city_ids[skewed_index(rng, len(city_ids), 2.5)], 1 if status == OrderStatus.NEW else rng.randint(2, 5))
+
+                invoiced = status not in (OrderStatus.NEW, OrderStatus.CANCELLED) and rng.random() < 0.9
+                if status == OrderStatus.CANCELLED and rng.random() < 0.2:
+                    invoiced = True
+                if invoiced:
+                    price = rng.randint(50, 2000) * 100
+                    service_fee, courier_fee = rng.choice((1000, 1500, 2000)), rng.choice((2000, 2500, 3500))
+                    tax = (price + service_fee + courier_fee) * 15 // 100
+                    if status == OrderStatus.CANCELLED:
+                        invoice_status = weighted(rng, [(InvoiceStatus.CANCELLED, 70), (InvoiceStatus.REFUNDED, 30)])
+                    elif status == OrderStatus.RECEIVED_BY_COURIER:
+                        invoice_status = InvoiceStatus.NEW
+                    else:
+                        invoice_status = InvoiceStatus.PAID
+                    invoice_created = created + timedelta(minutes=rng.randint(5, 240))
+                    invoices.append((invoice_id, f"INV-{invoice_id:08d}", order_id, price + service_fee + courier_fee + tax, service_fee,
+                                     price, courier_fee, invoice_status, invoice_created + timedelta(days=2), tax, 0, invoice_created,
+                                     invoice_created))
+                    invoice_id += 1
+
+        invoice_columns = ("id", "invoice_id", "order_id", "full_amount", "service_fee", "order_only_price", "courier_fee",
+                           "status", "due_date", "tax_amount", "discount_amount", "created_at", "updated_at")
+
+        # Orders and their invoices are generated together; a batch's invoices
+        # are written right after its orders, which they reference
+        order_columns = ("id", "order_id", "created_by_user_id", "assigned_to_user_id", "description", "creation_date",
+                         "delivery_date", "status", "comments", "updated_at", "city_id", "version")
+        generated = orders()
+        while True:
+            batch = [row for _, row in zip(range(args.batch_size), generated)]
+            if not batch:
+                break
+            writer.write(Order, order_columns, batch)
+            writer.write(Invoice, invoice_columns, invoices)
+            invoices.clear()
+        writer.done(Order)
+        writer.done(Invoice)
+
+        conversation_start = next_id(connection, Conversation)
+        # Skip pairs that already have a conversation from an earlier run
+        existing = set(connection.execute(select(Conversation.customer_id, Conversation.courier_id)).all()) if conversation_start > 1 else set()
+        conversations = [(pair, first_order) for pair, first_order in sorted(pairs.items(), key=lambda item: item[1]) if pair not in existing]
+        pairs.clear()
+        writer.write(Conversation, ("id", "customer_id", "courier_id", "status", "created_at"), (
+            (conversation_start + n, customer, courier, "closed" if (now - first_order).days > 30 else "active", first_order)
+            for n, ((customer, courier), first_order) in enumerate(conversations)
+        ))
+        writer.done(Conversation)
+
+        message_start = next_id(connection, Message)
+
+        def messages():
+            message_id = message_start
+            for n, ((customer, courier), first_order) in enumerate(conversations):
+                sent_at = first_order
+                for _ in range(geometric(rng, args.messages_per_conversation)):
+                    sent_at += timedelta(seconds=rng.randint(5, 3600))
+                    if sent_at > now:
+                        break
+                    sender = customer if rng.random() < 0.55 else courier
+                    if sender == courier and rng.random() < 0.03:
+                        price = rng.randint(50, 2000) * 100
+                        yield (message_id, conversation_start + n, sender, "Invoice", sent_at, "invoice", rng.choice(GIFTS),
+                               price, 1500, 2500, price + 4000)
+                    else:
+                        yield (message_id, conversation_start + n, sender, rng.choice(PHRASES), sent_at, "text", None, None, None, None, None)
+                    message_id += 1
+        writer.write(Message, ("id", "conversation_id", "sender_id", "content", "sent_at", "message_type", "invoice_description",
+                               "invoice_gift_price", "invoice_service_fee", "invoice_delivery_fee", "invoice_total"), messages())
+        writer.done(Message)
+
+        if connection.dialect.name == "postgresql":
+            # Ids were written explicitly, move the sequences past them
+            for model in (City, User, Order, Invoice, Conversation, Message):
+                table = model.__tablename__
+                connection.execute(text(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT coalesce(max(id), 1) FROM {table}))"))
+            connection.execute(text("ANALYZE"))
+            connection.commit()
+
+    elapsed = time.perf_counter() - started
+    total = sum(writer.counts.values())
+    print(f"\n{'table':<15}{'rows':>14}{'seconds':>10}{'rows/s':>12}")
+    for table, count in writer.counts.items():
+        print(f"{table:<15}{count:>14,}{writer.seconds[table]:>10.1f}{count / writer.seconds[table]:>12,.0f}")
+    print(f"{'total':<15}{total:>14,}{elapsed:>10.1f}{total / elapsed:>12,.0f}")
+
+    if args.search_index:
+        import search
+        with SessionLocal() as db:
+            print("search index:", search.index_rows_from(db, message_start, order_start))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--cities", type=int, default=20)
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--courier-ratio", type=float, default=0.05)
+    parser.add_argument("--orders", type=int, default=100_000)
+    parser.add_argument("--customer-skew", type=float, default=2.0, help="higher means fewer customers place more of the orders")
+    parser.add_argument("--messages-per-conversation", type=float, default=20)
+    parser.add_argument("--days", type=int, default=365, help="orders are spread over this many days up to now")
+    parser.add_argument("--batch-size", type=int, default=10_000)
+    parser.add_argument("--no-create-schema", dest="create_schema", action="store_false")
+    parser.add_argument("--no-search-index", dest="search_index", action="store_false", help="leave the new rows out of the full-text search indexes")
+    seed(parser.parse_args())
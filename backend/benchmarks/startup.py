@@ -0,0 +1,80 @@
+"""
+Process start-to-ready time.
+
+Starts `uvicorn main:app` as a fresh process several times and polls it,
+recording when /healthz first answers (live) and when /readyz first returns
+200 (warmup done). The server's own figure, measured from the OS process
+start time, is read back from /readyz.
+
+    DATABASE_URL=sqlite+aiosqlite:///./startup.db python benchmarks/startup.py --runs 5
+    CREATE_SCHEMA_ON_STARTUP=false python benchmarks/startup.py
+"""
+import sys
+import os
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(backend_dir)
+
+import argparse
+import json
+import statistics
+import subprocess
+import time
+import urllib.error
+import urllib.request
+
+
+def _get(url: str):
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, None
+    except (urllib.error.URLError, ConnectionError, OSError):
+        return None, None
+
+
+def measure(port: int, timeout: float) -> dict:
+    base = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    live = ready = None
+    body = None
+    try:
+        while time.perf_counter() - started < timeout:
+            if live is None and _get(f"{base}/healthz")[0] == 200:
+                live = time.perf_counter() - started
+            if live is not None:
+                status, body = _get(f"{base}/readyz")
+                if status == 200:
+                    ready = time.perf_counter() - started
+                    break
+            time.sleep(0.01)
+    finally:
+        process.terminate()
+        process.wait()
+    if ready is None:
+        raise RuntimeError(f"server was not ready within {timeout}s")
+    return {"live_s": live, "ready_s": ready, "server_startup_s": body["startup_seconds"], "steps": body["steps"]}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--timeout", type=float, default=60)
+    args = parser.parse_args()
+
+    runs = []
+    for i in range(args.runs):
+        result = measure(args.port, args.timeout)
+        runs.append(result)
+        steps = " ".join(f"{name}={seconds * 1000:.0f}ms" for name, seconds in result["steps"].items())
+        print(f"run {i + 1}: live {result['live_s']:.3f}s  ready {result['ready_s']:.3f}s  "
+              f"(server reports {result['server_startup_s']:.3f}s)  {steps}", flush=True)
+
+    for key in ("live_s", "ready_s", "server_startup_s"):
+        values = [run[key] for run in runs]
+        print(f"{key:<18} median {statistics.median(values):.3f}s  min {min(values):.3f}s  max {max(values):.3f}s")
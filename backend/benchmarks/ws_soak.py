@@ -0,0 +1,174 @@
+"""
+Soak test for idle chat sockets.
+
+Opens N websockets against /ws/chat/{conversation_id} in-process (ASGI calls,
+no network), keeps them idle and samples how many pooled DB connections are
+checked out. Pool usage should return to zero once the sockets are connected,
+no matter how many of them stay open. Fails if any socket is rejected.
+
+Run against a throwaway local database:
+
+    DATABASE_URL=sqlite+aiosqlite:///./soak.db python benchmarks/ws_soak.py --sockets 5000
+"""
+import sys
+import os
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(backend_dir)
+os.chdir(backend_dir)
+# Every socket shares one conversation and two users, lift the per-user and
+# per-conversation socket caps so none of them is turned away
+os.environ.setdefault("WS_MAX_SOCKETS_PER_USER", "100000")
+os.environ.setdefault("WS_MAX_SOCKETS_PER_CONVERSATION", "100000")
+
+import argparse
+import asyncio
+import time
+from datetime import timedelta
+from sqlalchemy import select, event
+from database import AsyncSessionLocal, engine, Base
+from models import User, Conversation
+from auth import create_access_token
+from main import app
+
+
+# Count checkouts through pool events so the numbers are comparable across
+# pool classes (SQLite uses NullPool, which has no checkedout() counter)
+_checked_out = 0
+_peak_checked_out = 0
+
+
+@event.listens_for(engine.sync_engine, "checkout")
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    global _checked_out, _peak_checked_out
+    _checked_out += 1
+    _peak_checked_out = max(_peak_checked_out, _checked_out)
+
+
+@event.listens_for(engine.sync_engine, "checkin")
+def _on_checkin(dbapi_connection, connection_record):
+    global _checked_out
+    _checked_out -= 1
+
+
+def checked_out() -> int:
+    return _checked_out
+
+
+async def seed() -> tuple:
+    """Create one customer/courier pair and their conversation, return (conversation_id, tokens)"""
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    async with AsyncSessionLocal() as db:
+        users = []
+        for phone, role in (("500000901", "Customer"), ("500000902", "Courier")):
+            result = await db.execute(select(User).where(User.phone_number == phone))
+            user = result.scalar_one_or_none()
+            if not user:
+                user = User(phone_number=phone, name=f"Soak {role}", role=role, is_verified=True)
+                db.add(user)
+                await db.flush()
+            users.append(user)
+
+        customer, courier = users
+        result = await db.execute(select(Conversation).where(
+            Conversation.customer_id == customer.id,
+            Conversation.courier_id == courier.id
+        ))
+        conversation = result.scalar_one_or_none()
+        if not conversation:
+            conversation = Conversation(customer_id=customer.id, courier_id=courier.id, status='active')
+            db.add(conversation)
+        await db.commit()
+
+        # Temporary tokens skip the token table lookup, only the user lookup remains
+        tokens = [
+            create_access_token(data={"sub": user.phone_number, "temp": True}, expires_delta=timedelta(hours=1))
+            for user in users
+        ]
+        return conversation.id, tokens
+
+
+class IdleSocket:
+    """Minimal ASGI websocket client that connects and then stays silent"""
+
+    def __init__(self, conversation_id: int, token: str):
+        self.scope = {
+            "type": "websocket",
+            "path": f"/ws/chat/{conversation_id}",
+            "raw_path": f"/ws/chat/{conversation_id}".encode(),
+            "query_string": f"token={token}".encode(),
+            "headers": [],
+            "scheme": "ws",
+            "server": ("soak", 80),
+            "client": ("soak", 0),
+            "root_path": "",
+            "subprotocols": [],
+        }
+        self.accepted = asyncio.Event()
+        self.closed = asyncio.Event()
+        self._connected = False
+        self._release = asyncio.Event()
+
+    async def receive(self):
+        if not self._connected:
+            self._connected = True
+            return {"type": "websocket.connect"}
+        await self._release.wait()
+        return {"type": "websocket.disconnect", "code": 1000}
+
+    async def send(self, message):
+        if message["type"] == "websocket.accept":
+            self.accepted.set()
+        elif message["type"] == "websocket.close":
+            self.closed.set()
+            self.accepted.set()
+
+    async def run(self):
+        await app(self.scope, self.receive, self.send)
+
+    def disconnect(self):
+        self._release.set()
+
+
+async def soak(sockets: int, idle_seconds: float, batch_size: int):
+    conversation_id, tokens = await seed()
+    print(f"Pool before connect: {checked_out()} checked out ({engine.pool.status()})")
+
+    clients, tasks = [], []
+    started = time.perf_counter()
+    for i in range(0, sockets, batch_size):
+        batch = [IdleSocket(conversation_id, tokens[j % 2]) for j in range(i, min(i + batch_size, sockets))]
+        clients.extend(batch)
+        tasks.extend(asyncio.create_task(client.run()) for client in batch)
+        await asyncio.gather(*(client.accepted.wait() for client in batch))
+    rejected = sum(1 for client in clients if client.closed.is_set())
+    print(f"Connected {sockets - rejected}/{sockets} sockets in {time.perf_counter() - started:.1f}s, "
+          f"peak checked out while connecting: {_peak_checked_out}")
+
+    samples = []
+    deadline = time.monotonic() + idle_seconds
+    while time.monotonic() < deadline:
+        samples.append(checked_out())
+        await asyncio.sleep(0.5)
+    print(f"Idle for {idle_seconds:.0f}s with {sockets - rejected} sockets open: "
+          f"checked out min={min(samples)} max={max(samples)}")
+
+    for client in clients:
+        client.disconnect()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    print(f"Pool after disconnect: {checked_out()} checked out ({engine.pool.status()})")
+
+    await engine.dispose()
+    return max(samples), rejected
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sockets", type=int, default=5000)
+    parser.add_argument("--idle-seconds", type=float, default=10)
+    parser.add_argument("--batch-size", type=int, default=250)
+    args = parser.parse_args()
+
+    idle_peak, rejected = asyncio.run(soak(args.sockets, args.idle_seconds, args.batch_size))
+    sys.exit(0 if idle_peak == 0 and rejected == 0 else 1)
@@ -0,0 +1,177 @@
+from typing import Dict, Iterable, List
+import logging
+from fastapi import HTTPException
+from sqlalchemy import exists, literal_column, select, update
+from sqlalchemy.orm import Session
+from config import settings
+from models import Order, Invoice, User, OrderStatus, InvoiceStatus, ORDER_TRANSITIONS, INVOICE_TRANSITIONS, order_statuses_leading_to, invoice_statuses_leading_to
+from realtime import order_events, order_status_event, invoice_status_event
+from search import order_index
+
+logger = logging.getLogger(__name__)
+
+# Bulk admin actions. Each one is a single UPDATE over the selected ids whose
+# WHERE clause carries the transition rules, so rows that may not make the
+# change are left alone instead of failing the whole batch. Rejected ids are
+# looked up afterwards, only to explain why.
+
+_ORDER_EVENT_COLUMNS = (Order.id, Order.order_id, Order.status, Order.version, Order.assigned_to_user_id, Order.created_by_user_id, Order.updated_at)
+_INVOICE_EVENT_COLUMNS = (Invoice.id, Invoice.invoice_id, Invoice.order_id, Invoice.status)
+
+
+def update_orders(key, *conditions, values: dict):
+    """
+    UPDATE of the orders matching `key` and `conditions`, and a
+    `previous_courier_id` column to add to its RETURNING: the courier each
+    order had before, so one it is taken from hears about it too. When
+    `values` reassign the orders, the old rows are locked and read in a
+    MATERIALIZED CTE of the same statement, since RETURNING only sees new
+    values. The subquery and the literal `orders.id` are for SQLite, which
+    only lets RETURNING reference the updated table and drops table names there.
+    """
+    if "assigned_to_user_id" not in values:
+        return update(Order).where(key, *conditions).values(**values), Order.assigned_to_user_id.label("previous_courier_id")
+    previous = select(Order.id, Order.assigned_to_user_id).where(key).with_for_update().cte("previous").prefix_with("MATERIALIZED")
+    previous_courier_id = select(previous.c.assigned_to_user_id).where(
+        previous.c.id == literal_column(f"{Order.__tablename__}.id")
+    ).scalar_subquery().label("previous_courier_id")
+    return update(Order).where(Order.id == previous.c.id, *conditions).values(**values), previous_courier_id
+
+
+def _validated_ids(ids: Iterable[int]) -> List[int]:
+    ids = sorted(set(ids))
+    if not ids:
+        raise HTTPException(status_code=400, detail="No rows selected")
+    if len(ids) > settings.admin_bulk_max_ids:
+        raise HTTPException(status_code=400, detail=f"At most {settings.admin_bulk_max_ids} rows can be changed at once")
+    return ids
+
+
+def _result(ids: List[int], affected: List[int], rejected: Dict[int, str]) -> dict:
+    for row_id in ids:
+        if row_id not in rejected and row_id not in affected:
+            # Matched the checks below but not the UPDATE, changed in between
+            rejected[row_id] = "Modified concurrently, retry"
+    return {"affected": affected, "rejected": rejected}
+
+
+def transition_orders(db: Session, ids: Iterable[int], target: OrderStatus, admin: User, conditions: list = (), values: dict = None, rejections=None) -> dict:
+    """
+    Move the orders in `ids` to `target` with one UPDATE, for those whose
+    current status may lead there and that satisfy `conditions`. `rejections`
+    can explain failed `conditions` as {id: reason} for the rejected orders.
+    """
+    ids = _validated_ids(ids)
+    stmt, previous_courier_id = update_orders(
+        Order.id.in_(ids),
+        Order.status.in_(order_statuses_leading_to(target)),
+        *conditions,
+        values={"status": target, "version": Order.version + 1, **(values or {})},
+    )
+    rows = db.execute(stmt.returning(*_ORDER_EVENT_COLUMNS, previous_courier_id), execution_options={"synchronize_session": False}).all()
+    if order_index.source.key in (values or {}):
+        # Not an ORM flush, the search index is updated here
+        order_index.refresh(db.connection(), [row.id for row in rows])
+    db.commit()
+
+    affected = [row.id for row in rows]
+    rejected: Dict[int, str] = {}
+    done = set(affected)
+    remaining = [row_id for row_id in ids if row_id not in done]
+    if remaining:
+        current = dict(db.query(Order.id, Order.status).filter(Order.id.in_(remaining)).all())
+        for row_id in remaining:
+            if row_id not in current:
+                rejected[row_id] = "Order not found"
+            elif target not in ORDER_TRANSITIONS[current[row_id]]:
+                rejected[row_id] = f"Cannot change from {current[row_id].value} to {target.value}"
+        if rejections is not None:
+            for row_id, reason in rejections(db, [row_id for row_id in remaining if row_id not in rejected]).items():
+                rejected[row_id] = reason
+
+    for row in rows:
+        order_events.publish((row.created_by_user_id, row.assigned_to_user_id, row.previous_courier_id), order_status_event(row))
+    logger.info("Bulk order change to %s by admin %s: %d affected, %d rejected", target.value, admin.id, len(affected), len(rejected),
+                extra={"event": "admin.bulk_orders", "status": target.value, "affected": len(affected), "rejected": len(rejected)})
+    return _result(ids, affected, rejected)
+
+
+# Statuses with their own rules, set through assign_orders and cancel_orders
+_GUARDED_ORDER_STATUSES = {
+    OrderStatus.RECEIVED_BY_COURIER: "Use the assign action to hand orders to a courier",
+    OrderStatus.CANCELLED: "Use the cancel action to cancel orders",
+}
+
+
+def change_order_status(db: Session, ids: Iterable[int], target: OrderStatus, admin: User) -> dict:
+    if target in _GUARDED_ORDER_STATUSES:
+        raise HTTPException(status_code=400, detail=_GUARDED_ORDER_STATUSES[target])
+    return transition_orders(db, ids, target, admin, values={"comments": f"Status set to {target.value} by admin ID:{admin.id}"})
+
+
+def assign_orders(db: Session, ids: Iterable[int], courier_id: int, admin: User) -> dict:
+    courier = db.query(User.id, User.role).filter(User.id == courier_id).first()
+    if courier is None:
+        raise HTTPException(status_code=404, detail="Assigned user not found")
+    if courier.role != "Courier":
+        raise HTTPException(status_code=400, detail="Assigned user must be a courier")
+    return transition_orders(
+        db, ids, OrderStatus.RECEIVED_BY_COURIER, admin,
+        # Re-checked in the UPDATE in case the role changes meanwhile
+        conditions=[exists().where(User.id == courier_id, User.role == "Courier")],
+        values={
+            "assigned_to_user_id": courier_id,
+            "comments": f"Assigned to courier ID:{courier_id} by admin ID:{admin.id}",
+        },
+    )
+
+
+def _paid_invoice_rejections(db: Session, ids: List[int]) -> Dict[int, str]:
+    paid = db.query(Invoice.order_id).filter(Invoice.order_id.in_(ids), Invoice.status == InvoiceStatus.PAID).all()
+    return {order_id: "Has a paid invoice, refund it first" for (order_id,) in paid}
+
+
+def cancel_orders(db: Session, ids: Iterable[int], reason: str, admin: User) -> dict:
+    return transition_orders(
+        db, ids, OrderStatus.CANCELLED, admin,
+        conditions=[~exists().where(Invoice.order_id == Order.id, Invoice.status == InvoiceStatus.PAID)],
+        values={"comments": f"{reason} by admin ID:{admin.id} and name:{admin.name}"},
+        rejections=_paid_invoice_rejections,
+    )
+
+
+def change_invoice_status(db: Session, ids: Iterable[int], target: InvoiceStatus, admin: User) -> dict:
+    """Move the invoices in `ids` to `target` with one UPDATE, where INVOICE_TRANSITIONS allows it"""
+    ids = _validated_ids(ids)
+    if not invoice_statuses_leading_to(target):
+        raise HTTPException(status_code=400, detail=f"Invoices cannot be set to {target.value}")
+    stmt = update(Invoice).where(
+        Invoice.id.in_(ids),
+        Invoice.status.in_(invoice_statuses_leading_to(target)),
+    ).values(status=target).returning(*_INVOICE_EVENT_COLUMNS)
+    rows = db.execute(stmt, execution_options={"synchronize_session": False}).all()
+    db.commit()
+
+    affected = [row.id for row in rows]
+    rejected: Dict[int, str] = {}
+    done = set(affected)
+    remaining = [row_id for row_id in ids if row_id not in done]
+    if remaining:
+        current = dict(db.query(Invoice.id, Invoice.status).filter(Invoice.id.in_(remaining)).all())
+        for row_id in remaining:
+            if row_id not in current:
+                rejected[row_id] = "Invoice not found"
+            elif target not in INVOICE_TRANSITIONS[current[row_id]]:
+                rejected[row_id] = f"Cannot change from {current[row_id].value} to {target.value}"
+
+    if rows:
+        recipients = {
+            order_id: (created_by, assigned_to)
+            for order_id, created_by, assigned_to in db.query(Order.id, Order.created_by_user_id, Order.assigned_to_user_id)
+            .filter(Order.id.in_({row.order_id for row in rows})).all()
+        }
+        for row in rows:
+            order_events.publish(recipients.get(row.order_id, ()), invoice_status_event(row))
+    logger.info("Bulk invoice change to %s by admin %s: %d affected, %d rejected", target.value, admin.id, len(affected), len(rejected),
+                extra={"event": "admin.bulk_invoices", "status": target.value, "affected": len(affected), "rejected": len(rejected)})
+    return _result(ids, affected, rejected)
@@ -1,9 +1,143 @@
 from pydantic_settings import BaseSettings
+from typing import Dict, List
 
 class Settings(BaseSettings):
     secret_key: str
     database_url: str
     access_token_expire_minutes: int
+    # Read replicas for read-only handlers (same URL format as database_url)
+    database_replica_urls: List[str] = []
+    # A replica that fails a connection or lags more than replica_max_lag_seconds
+    # (Postgres) is left out for replica_eject_seconds, then probed again
+    replica_eject_seconds: float = 30
+    replica_max_lag_seconds: float = 10
+    replica_health_check_seconds: float = 5
+    # After writing, a caller's reads stay on the primary for this long
+    replica_sticky_seconds: float = 5
+    # Adds per-request SQL profiling headers (X-DB-*) to every response
+    debug: bool = False
+    # Bearer token the Prometheus scraper sends for /metrics. Empty turns the
+    # endpoint off (404)
+    metrics_token: str = ""
+    # Minimum seconds between typing/presence events from one user in a chat
+    ws_ephemeral_interval_seconds: float = 0.5
+    # How long a conversation's participants are cached for socket authorization
+    ws_participant_cache_ttl_seconds: int = 300
+    # Server pings sockets that were quiet for this long, and evicts the ones
+    # that stay silent past the idle timeout
+    ws_heartbeat_interval_seconds: float = 25
+    ws_idle_timeout_seconds: float = 75
+    ws_max_sockets_per_user: int = 5
+    ws_max_sockets_per_conversation: int = 10
+    # Worker processes serving the app, read from the WEB_CONCURRENCY variable
+    # uvicorn and gunicorn take their default worker count from. Reconnect
+    # replay is served from memory only with a single worker; set it when
+    # starting several workers with --workers
+    web_concurrency: int = 1
+    # Recent messages kept in memory per conversation for reconnect replay
+    ws_replay_buffer_size: int = 100
+    ws_replay_buffer_conversations: int = 5000
+    # Upper bound on messages replayed from the database after a long gap
+    ws_replay_max_messages: int = 200
+    # Messages older than this move to messages_archive, batch_size at a time,
+    # checked every interval. 0 turns archiving off. On Postgres an advisory
+    # lock keeps it to one worker at a time; on SQLite, several workers may
+    # race for a chunk, the loser rolls back and logs an error
+    message_archive_after_days: int = 90
+    message_archive_batch_size: int = 1000
+    message_archive_interval_seconds: float = 3600
+    # Admin list views of large tables count filtered listings only up to this
+    # many rows, and remember where this many recently served pages ended
+    admin_count_cap: int = 10000
+    admin_keyset_cursors: int = 1000
+    # Most rows one bulk admin action may change
+    admin_bulk_max_ids: int = 1000
+    # Retention job: deletes rows matching each policy once they are older than
+    # `days` (0 keeps them forever). Off by default; when on it runs every
+    # interval, batch_size rows per transaction, sleeping at least
+    # pause_seconds (and as long as the last batch took) between batches. The
+    # first run starts a minute after boot. Every worker runs the loop; on
+    # Postgres an advisory lock lets one of them purge at a time, on SQLite
+    # enable it in a single worker only
+    retention_enabled: bool = False
+    retention_dry_run: bool = False
+    retention_policies: Dict[str, Dict[str, float]] = {
+        "cancelled_orders": {"days": 365},
+        "closed_conversations": {"days": 180},
+        "revoked_tokens": {"days": 30},
+        "otp_placeholder_users": {"days": 7},
+    }
+    retention_batch_size: int = 500
+    retention_pause_seconds: float = 0.2
+    retention_interval_seconds: float = 86400
+    # Run Base.metadata.create_all on boot. Turn off in production, where the
+    # schema is migrated once per deploy (python migrate.py) instead of by every worker
+    create_schema_on_startup: bool = True
+    # Connections opened per engine while warming up, and the delay between
+    # warmup attempts while the database is unreachable
+    warmup_db_connections: int = 5
+    warmup_retry_seconds: float = 2
+    # How long the active city list is served from memory
+    city_catalog_ttl_seconds: int = 300
+    # Idempotency-Key responses are replayed for this long; at most this many
+    # keys are kept per process, oldest evicted first
+    idempotency_ttl_seconds: int = 86400
+    idempotency_max_entries: int = 10000
+    # How long a retry waits for the in-flight request with the same key
+    idempotency_wait_seconds: float = 30
+    rate_limit_enabled: bool = True
+    # "memory" keeps buckets per worker; a redis:// URL shares them across workers
+    rate_limit_backend: str = "memory"
+    # Use the first X-Forwarded-For address as the client IP (only behind a trusted proxy)
+    rate_limit_trust_forwarded_for: bool = False
+    # Token buckets per route and scope as "<capacity>/<seconds>": a bucket holds
+    # up to `capacity` requests and refills completely over `seconds`
+    rate_limits: Dict[str, Dict[str, str]] = {
+        "send_otp": {"phone": "3/300", "ip": "20/60", "global": "200/1"},
+        "verify_otp": {"phone": "10/300", "ip": "30/60", "global": "300/1"},
+        "refresh": {"ip": "60/60"},
+        "complete_profile": {"ip": "10/60"},
+    }
+    admission_control_enabled: bool = True
+    # Per route class: requests running at once, requests allowed to wait for
+    # a slot, and seconds one may wait before being shed. Concurrency adds up
+    # to less than db_executor_threads so no class can take every thread
+    admission_limits: Dict[str, Dict[str, float]] = {
+        "auth": {"concurrency": 8, "queue": 32, "timeout": 2},
+        "orders": {"concurrency": 12, "queue": 48, "timeout": 2},
+        "invoice_pdf": {"concurrency": 4, "queue": 8, "timeout": 5},
+        "chat": {"concurrency": 8, "queue": 32, "timeout": 2},
+        "admin": {"concurrency": 4, "queue": 8, "timeout": 5},
+    }
+    admission_retry_after_seconds: int = 1
+    # Processes rendering invoice PDFs and hashing passwords. "spawn" starts
+    # them clean instead of forking a process that already runs threads
+    cpu_executor_workers: int = 2
+    cpu_executor_start_method: str = "spawn"
+    # Threads running sync route handlers and blocking DB calls
+    db_executor_threads: int = 40
+    # Order/invoice event streams (GET /orders/events): keep-alive comment
+    # interval, events buffered per stream, and open streams allowed per user
+    sse_heartbeat_seconds: float = 25
+    sse_queue_size: int = 100
+    sse_max_streams_per_user: int = 5
+    log_level: str = "INFO"
+    log_json: bool = True
+    # Records beyond this many waiting to be written are dropped, never blocking the caller
+    log_queue_size: int = 10000
+    # Fraction of records kept per event for hot paths (warnings and errors are always kept)
+    log_sample_rates: Dict[str, float] = {
+        "auth.otp_sent": 0.1,
+        "ws.connect": 0.1,
+        "ws.disconnect": 0.1,
+        "ws.message": 0.01,
+    }
+    # Statements slower than this are counted as slow and kept in the admin slow query table
+    sql_slow_query_ms: float = 100
+    sql_slow_query_window_seconds: int = 3600
+    sql_slow_query_table_size: int = 500
+    # A statement shape repeated this many times in one request is reported as a likely N+1
+    sql_n_plus_one_threshold: int = 5
 
     class Config:
         env_file = ".env"
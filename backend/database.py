@@ -1,17 +1,35 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Optional
+import asyncio
+import functools
+import itertools
+import logging
+import time
+from fastapi import Depends
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.sql.dml import UpdateBase
 from config import settings
 
+logger = logging.getLogger(__name__)
+
 # Async engine and session
 engine = create_async_engine(settings.database_url, echo=False)
 AsyncSessionLocal = sessionmaker(
     bind=engine, class_=AsyncSession, expire_on_commit=False
 )
 
+def to_sync_url(url: str) -> str:
+    """Map an async driver URL to its sync equivalent (asyncpg -> psycopg2, aiosqlite -> sqlite3)"""
+    return url.replace("postgresql+asyncpg://", "postgresql://").replace("sqlite+aiosqlite://", "sqlite://")
+
 # Sync engine and session for synchronous functions
-sync_engine = create_engine(settings.database_url.replace("postgresql+asyncpg://", "postgresql://"), echo=False)
+sync_engine = create_engine(to_sync_url(settings.database_url), echo=False)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=sync_engine)
 
 Base = declarative_base()
@@ -29,3 +47,224 @@ def get_db_sync():
         yield db
     finally:
         db.close()
+
+@contextmanager
+def advisory_lock(key: int):
+    """
+    Hold a Postgres advisory lock for the block, so a background job runs in
+    one worker at a time. Yields False, without waiting, when another session
+    holds it. SQLite has no such lock and always yields True.
+    """
+    if sync_engine.dialect.name != "postgresql":
+        yield True
+        return
+    with sync_engine.connect() as connection:
+        if not connection.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": key}).scalar():
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": key})
+
+
+# Read replicas
+#
+# Read-only dependencies (get_db_read) get a RoutingSession that sends SELECTs
+# to a healthy replica and everything else to the primary. Reads go to the
+# primary instead once the session, or anything else in the same request, has
+# written, and for `replica_sticky_seconds` after a caller's last write, so a
+# client always sees its own changes despite replication lag.
+#
+# To try it locally with SQLite, copy the database file and point
+# DATABASE_REPLICA_URLS='["sqlite+aiosqlite:///./replica.db"]' at the copy.
+
+class Replica:
+    def __init__(self, url: str):
+        self.url = url
+        self.engine = create_engine(to_sync_url(url), echo=False)
+        self.ejected_until = 0.0
+        self.ejected_reason: Optional[str] = None
+        self.ejections = 0
+
+    @property
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.ejected_until
+
+    @property
+    def name(self) -> str:
+        return self.engine.url.render_as_string(hide_password=True)
+
+
+class ReplicaSet:
+    """Round-robin over the replicas that are not currently ejected"""
+
+    def __init__(self, urls: List[str], eject_seconds: float, max_lag_seconds: float):
+        self.replicas = [Replica(url) for url in urls]
+        self.eject_seconds = eject_seconds
+        self.max_lag_seconds = max_lag_seconds
+        self._counter = itertools.count()
+        for replica in self.replicas:
+            event.listen(replica.engine, "handle_error", functools.partial(self._on_error, replica))
+
+    def __bool__(self) -> bool:
+        return bool(self.replicas)
+
+    def engines(self) -> List[Engine]:
+        return [replica.engine for replica in self.replicas]
+
+    def pick(self) -> Optional[Engine]:
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            return None
+        return healthy[next(self._counter) % len(healthy)].engine
+
+    def eject(self, replica: Replica, reason: str):
+        if replica.healthy:
+            replica.ejections += 1
+            logger.warning("Ejecting read replica %s: %s", replica.name, reason, extra={"event": "db.replica_ejected"})
+        replica.ejected_until = time.monotonic() + self.eject_seconds
+        replica.ejected_reason = reason
+
+    def _on_error(self, replica: Replica, context):
+        # Connection failures, not query errors, take a replica out of rotation
+        if context.is_disconnect or context.connection is None:
+            self.eject(replica, type(context.original_exception).__name__)
+
+    def check(self):
+        """Probe every replica, ejecting unreachable or lagging ones and readmitting recovered ones"""
+        for replica in self.replicas:
+            try:
+                with replica.engine.connect() as conn:
+                    lag = None
+                    if replica.engine.dialect.name == "postgresql":
+                        lag = conn.execute(text(
+                            "SELECT COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)"
+                        )).scalar()
+                    else:
+                        conn.execute(text("SELECT 1"))
+            except Exception as e:
+                self.eject(replica, f"health check failed: {type(e).__name__}")
+                continue
+            if lag is not None and lag > self.max_lag_seconds:
+                self.eject(replica, f"replication lag {lag:.1f}s")
+            elif not replica.healthy:
+                logger.info("Readmitting read replica %s", replica.name, extra={"event": "db.replica_readmitted"})
+                replica.ejected_until = 0.0
+                replica.ejected_reason = None
+
+    def stats(self) -> List[dict]:
+        return [
+            {"replica": replica.name, "healthy": replica.healthy, "ejections": replica.ejections, "reason": replica.ejected_reason}
+            for replica in self.replicas
+        ]
+
+
+replica_set = ReplicaSet(settings.database_replica_urls, settings.replica_eject_seconds, settings.replica_max_lag_seconds)
+
+
+class RequestDBState:
+    """Shared by every session in one request, including ones in worker threads"""
+    __slots__ = ("primary_only", "wrote")
+
+    def __init__(self, primary_only: bool = False):
+        self.primary_only = primary_only
+        self.wrote = False
+
+
+request_db_state: ContextVar[Optional[RequestDBState]] = ContextVar("request_db_state", default=None)
+
+
+@event.listens_for(Session, "after_flush")
+def _mark_write(session, flush_context):
+    session.info["wrote"] = True
+    state = request_db_state.get()
+    if state is not None:
+        state.wrote = True
+
+
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, **kw):
+        state = request_db_state.get()
+        if (
+            self.info.get("wrote")
+            or self._flushing
+            or isinstance(clause, UpdateBase)
+            or (state is not None and (state.primary_only or state.wrote))
+        ):
+            return sync_engine
+        # Stay on one replica for the whole session so its reads are consistent
+        replica = self.info.get("replica")
+        if replica is None:
+            replica = self.info["replica"] = replica_set.pick() or sync_engine
+        return replica
+
+
+ReadSessionLocal = sessionmaker(class_=RoutingSession, autocommit=False, autoflush=False, bind=sync_engine)
+
+
+def get_db_read(db: Session = Depends(get_db_sync)):
+    """Session for read-only handlers. Without replicas it is the request's primary session."""
+    if not replica_set:
+        yield db
+        return
+    read_db = ReadSessionLocal()
+    try:
+        yield read_db
+    finally:
+        read_db.close()
+
+
+class RecentWriters:
+    """Callers (by Authorization header) that wrote within the last `ttl` seconds"""
+
+    def __init__(self, ttl: float, max_size: int = 100000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries: "OrderedDict[bytes, float]" = OrderedDict()
+
+    def active(self, key: bytes) -> bool:
+        expires_at = self._entries.get(key)
+        if expires_at is None:
+            return False
+        if time.monotonic() > expires_at:
+            del self._entries[key]
+            return False
+        return True
+
+    def mark(self, key: bytes):
+        self._entries[key] = time.monotonic() + self.ttl
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+
+recent_writers = RecentWriters(settings.replica_sticky_seconds)
+
+
+class ReadYourWritesMiddleware:
+    """Pure ASGI middleware giving each request a RequestDBState, pinned to the
+    primary when the caller wrote recently"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not replica_set:
+            await self.app(scope, receive, send)
+            return
+        key = dict(scope["headers"]).get(b"authorization")
+        state = RequestDBState(primary_only=key is not None and recent_writers.active(key))
+        token = request_db_state.set(state)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            request_db_state.reset(token)
+            if state.wrote and key is not None:
+                recent_writers.mark(key)
+
+
+async def replica_health_loop():
+    while True:
+        await asyncio.to_thread(replica_set.check)
+        await asyncio.sleep(settings.replica_health_check_seconds)
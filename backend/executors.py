@@ -0,0 +1,177 @@
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict, Optional, Tuple
+import asyncio
+import logging
+import multiprocessing
+import threading
+import time
+import anyio.to_thread
+from config import settings
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Work is routed explicitly to one of two named executors:
+#
+#   cpu  process pool for CPU-bound work that would otherwise hold the GIL
+#        (invoice PDF rendering, bcrypt), so it cannot slow request handling
+#   db   AnyIO's default thread pool, which runs sync route handlers and
+#        blocking DB calls; sized at startup by `db_executor_threads`
+#
+# Functions sent to the cpu pool must be importable module-level functions
+# and take picklable arguments (plain values, dicts, pydantic models).
+
+EXECUTOR_TASK_SECONDS = metrics.Histogram("giftly_executor_task_seconds", "Time from submission to completion per executor", ("executor",),
+                                          buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5))
+
+
+class ProcessExecutor:
+    """Named process pool, started on first use or by warm_up()"""
+
+    def __init__(self, name: str, workers: int, start_method: str = "spawn"):
+        self.name = name
+        self.workers = workers
+        self.start_method = start_method
+        self.in_flight = 0
+        self.completed = 0
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context(self.start_method),
+                    )
+        return self._pool
+
+    def _discard(self, pool: ProcessPoolExecutor):
+        # A worker died (crashed, OOM-killed) and broke the whole pool; the
+        # next submission starts a fresh one
+        with self._lock:
+            if self._pool is not pool:
+                return
+            self._pool = None
+        logger.warning("Process pool %s broken, restarting it", self.name, extra={"event": "executor.pool_broken", "executor": self.name})
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def _submit(self, fn: Callable, *args) -> Tuple[ProcessPoolExecutor, Future]:
+        started = time.perf_counter()
+        pool = self._get_pool()
+        try:
+            future = pool.submit(fn, *args)
+        except BrokenProcessPool:
+            self._discard(pool)
+            pool = self._get_pool()
+            future = pool.submit(fn, *args)
+        with self._lock:
+            self.in_flight += 1
+
+        def finished(_):
+            EXECUTOR_TASK_SECONDS.observe(time.perf_counter() - started, self.name)
+            with self._lock:
+                self.in_flight -= 1
+                self.completed += 1
+
+        future.add_done_callback(finished)
+        return pool, future
+
+    def submit(self, fn: Callable, *args) -> Future:
+        return self._submit(fn, *args)[1]
+
+    async def run(self, fn: Callable, *args):
+        """Run in the pool from async code, once more on a fresh pool if a worker died"""
+        pool, future = self._submit(fn, *args)
+        try:
+            return await asyncio.wrap_future(future)
+        except BrokenProcessPool:
+            self._discard(pool)
+            return await asyncio.wrap_future(self.submit(fn, *args))
+
+    def run_sync(self, fn: Callable, *args):
+        """Run in the pool from a sync handler, blocking the calling thread until it is done"""
+        pool, future = self._submit(fn, *args)
+        try:
+            return future.result()
+        except BrokenProcessPool:
+            self._discard(pool)
+            return self.submit(fn, *args).result()
+
+    def warm_up(self):
+        # Start every worker and have it import its modules before real work arrives
+        for future in [self.submit(_noop) for _ in range(self.workers)]:
+            future.result()
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def stats(self) -> dict:
+        return {
+            "capacity": self.workers,
+            "busy": min(self.in_flight, self.workers),
+            "queued": max(0, self.in_flight - self.workers),
+            "completed": self.completed,
+        }
+
+
+def _noop():
+    # Importing these in the worker up front keeps the first PDF and hash fast
+    import auth
+    import routers.invoices
+    return None
+
+
+cpu_executor = ProcessExecutor("cpu", settings.cpu_executor_workers, settings.cpu_executor_start_method)
+
+
+def configure_db_executor():
+    """Size AnyIO's default thread pool, must be called from the event loop"""
+    anyio.to_thread.current_default_thread_limiter().total_tokens = settings.db_executor_threads
+
+
+async def run_db(fn: Callable, *args):
+    """Run blocking DB work on the db executor from async code"""
+    started = time.perf_counter()
+    try:
+        return await anyio.to_thread.run_sync(fn, *args)
+    finally:
+        EXECUTOR_TASK_SECONDS.observe(time.perf_counter() - started, "db")
+
+
+def _db_stats() -> dict:
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    statistics = limiter.statistics()
+    return {
+        "capacity": limiter.total_tokens,
+        "busy": statistics.borrowed_tokens,
+        "queued": statistics.tasks_waiting,
+    }
+
+
+def stats() -> Dict[str, dict]:
+    values = {"cpu": cpu_executor.stats()}
+    try:
+        values["db"] = _db_stats()
+    except RuntimeError:
+        # No running event loop (called from a worker thread)
+        pass
+    return values
+
+
+def _executor_state() -> Dict[Tuple, float]:
+    return {
+        (name, state): value
+        for name, executor_stats in stats().items()
+        for state, value in executor_stats.items()
+        if state != "completed"
+    }
+
+
+metrics.GaugeCallback("giftly_executor", "Capacity, busy and queued work per named executor", ("executor", "state"), _executor_state)
+metrics.CounterCallback("giftly_executor_completed_total", "Tasks completed by the cpu process pool", ("executor",),
+                        lambda: {("cpu",): cpu_executor.completed})
@@ -0,0 +1,240 @@
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+import asyncio
+import hashlib
+import json
+import logging
+import re
+import time
+from fastapi import HTTPException
+from auth import get_current_user_from_token
+from config import settings
+from database import AsyncSessionLocal
+from logging_config import new_correlation_id
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Write endpoints mobile clients retry. Only POSTs to these paths honour the
+# Idempotency-Key header, everything else passes straight through.
+IDEMPOTENT_PATHS = (
+    re.compile(r"^/orders/$"),
+    re.compile(r"^/invoices/$"),
+    re.compile(r"^/chat/conversations/\d+/messages$"),
+)
+
+MAX_KEY_LENGTH = 255
+
+# Set per request by inner middleware, never stored with a response. A replay
+# gets its own X-Request-ID instead of the first execution's
+PER_REQUEST_HEADERS = (b"x-request-id", b"x-db-")
+
+IDEMPOTENCY_REQUESTS = metrics.Counter("giftly_idempotency_requests_total", "Requests carrying an Idempotency-Key by outcome", ("outcome",))
+
+
+class StoredResponse:
+    __slots__ = ("status", "headers", "body")
+
+    def __init__(self, status: int, headers: List[Tuple[bytes, bytes]], body: bytes):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+
+class IdempotencyEntry:
+    __slots__ = ("fingerprint", "expires_at", "done", "response")
+
+    def __init__(self, fingerprint: str, expires_at: float):
+        self.fingerprint = fingerprint
+        self.expires_at = expires_at
+        # Set once the first execution finished, stored or not
+        self.done = asyncio.Event()
+        self.response: Optional[StoredResponse] = None
+
+
+class IdempotencyStore:
+    """
+    Bounded map of (user id, Idempotency-Key) to the first execution of that
+    request. Entries live for `ttl` seconds; the oldest are evicted past
+    `max_entries`. Like ConnectionManager it is per process and only touched
+    from the event loop, so a retry routed to another worker is not deduplicated.
+    """
+
+    def __init__(self, ttl: float = 86400, max_entries: int = 10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[int, str], IdempotencyEntry]" = OrderedDict()
+
+    def get(self, key: Tuple[int, str]) -> Optional[IdempotencyEntry]:
+        entry = self._entries.get(key)
+        if entry is not None and time.monotonic() > entry.expires_at and entry.done.is_set():
+            del self._entries[key]
+            return None
+        return entry
+
+    def begin(self, key: Tuple[int, str], fingerprint: str) -> IdempotencyEntry:
+        entry = IdempotencyEntry(fingerprint, time.monotonic() + self.ttl)
+        self._entries[key] = entry
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return entry
+
+    def finish(self, key: Tuple[int, str], entry: IdempotencyEntry, response: Optional[StoredResponse]):
+        """Store the response, or forget the key so the next retry runs again"""
+        if response is not None:
+            entry.response = response
+        elif self._entries.get(key) is entry:
+            del self._entries[key]
+        entry.done.set()
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries)}
+
+
+idempotency_store = IdempotencyStore(
+    ttl=settings.idempotency_ttl_seconds,
+    max_entries=settings.idempotency_max_entries,
+)
+
+metrics.GaugeCallback("giftly_idempotency_store_entries", "Idempotency keys currently remembered", (),
+                      lambda: {(): idempotency_store.stats()["entries"]})
+
+
+def _header(scope, name: bytes) -> Optional[bytes]:
+    for key, value in scope["headers"]:
+        if key == name:
+            return value
+    return None
+
+
+async def _send_json(send, status: int, detail: str):
+    body = json.dumps({"detail": detail}).encode()
+    await send({"type": "http.response.start", "status": status, "headers": [
+        (b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+    ]})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _authenticated_user_id(scope) -> Optional[int]:
+    authorization = _header(scope, b"authorization")
+    if authorization is None:
+        return None
+    scheme, _, token = authorization.decode("latin-1").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    async with AsyncSessionLocal() as db:
+        try:
+            user = await get_current_user_from_token(token, db)
+        except HTTPException:
+            return None
+    return user.id
+
+
+class IdempotencyMiddleware:
+    """
+    Pure ASGI middleware for the Idempotency-Key header on IDEMPOTENT_PATHS.
+
+    The first request with a key runs the handler and its response is kept
+    (unless it was a 5xx). Retries with the same key and body get that
+    response back with `Idempotent-Replayed: true` and never reach the
+    handler; retries arriving while the first is still running wait for it.
+    Reusing a key with a different body is rejected with 422. Only requests
+    with a valid bearer token take part, keyed by the user behind it.
+    """
+
+    def __init__(self, app, store: IdempotencyStore = idempotency_store):
+        self.app = app
+        self.store = store
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or not any(p.match(scope["path"]) for p in IDEMPOTENT_PATHS):
+            await self.app(scope, receive, send)
+            return
+        raw_key = _header(scope, b"idempotency-key")
+        if raw_key is None:
+            await self.app(scope, receive, send)
+            return
+        if not raw_key or len(raw_key) > MAX_KEY_LENGTH:
+            await _send_json(send, 400, f"Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters")
+            return
+
+        # Keys are scoped to the user, so a token refresh keeps them and one
+        # user can never replay another's response. Anonymous callers (and
+        # invalid tokens, which the handler rejects) are never deduplicated
+        user_id = await _authenticated_user_id(scope)
+        if user_id is None:
+            IDEMPOTENCY_REQUESTS.inc("anonymous")
+            await self.app(scope, receive, send)
+            return
+
+        # Read the whole body up front, it is part of the fingerprint
+        chunks = []
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            chunks.append(message.get("body", b""))
+            more_body = message.get("more_body", False)
+        body = b"".join(chunks)
+
+        key = (user_id, raw_key.decode("latin-1"))
+        fingerprint = hashlib.sha256(scope["path"].encode() + b"\n" + body).hexdigest()
+
+        while True:
+            entry = self.store.get(key)
+            if entry is None:
+                break
+            if entry.fingerprint != fingerprint:
+                IDEMPOTENCY_REQUESTS.inc("mismatch")
+                await _send_json(send, 422, "Idempotency-Key was already used with a different request")
+                return
+            if not entry.done.is_set():
+                IDEMPOTENCY_REQUESTS.inc("waited")
+                try:
+                    await asyncio.wait_for(entry.done.wait(), timeout=settings.idempotency_wait_seconds)
+                except asyncio.TimeoutError:
+                    await _send_json(send, 409, "A request with this Idempotency-Key is still in progress")
+                    return
+            if entry.response is not None:
+                IDEMPOTENCY_REQUESTS.inc("replayed")
+                stored = entry.response
+                request_id = _header(scope, b"x-request-id") or new_correlation_id().encode()
+                await send({"type": "http.response.start", "status": stored.status,
+                            "headers": stored.headers + [(b"x-request-id", request_id), (b"idempotent-replayed", b"true")]})
+                await send({"type": "http.response.body", "body": stored.body})
+                return
+            # The first execution failed and released the key, try to take it over
+
+        IDEMPOTENCY_REQUESTS.inc("executed")
+        entry = self.store.begin(key, fingerprint)
+        body_sent = False
+
+        async def replay_receive():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        status = None
+        headers: List[Tuple[bytes, bytes]] = []
+        response_chunks = []
+
+        async def capture_send(message):
+            nonlocal status, headers
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", []))
+            elif message["type"] == "http.response.body":
+                response_chunks.append(message.get("body", b""))
+            await send(message)
+
+        response = None
+        try:
+            await self.app(scope, replay_receive, capture_send)
+            if status is not None and status < 500:
+                kept = [(name, value) for name, value in headers if not name.lower().startswith(PER_REQUEST_HEADERS)]
+                response = StoredResponse(status, kept, b"".join(response_chunks))
+        finally:
+            self.store.finish(key, entry, response)
@@ -1,30 +1,68 @@
-from fastapi import FastAPI, Request, HTTPException, status, WebSocket, WebSocketDisconnect, Depends
-from database import engine, Base, AsyncSessionLocal
+from fastapi import FastAPI, Header, HTTPException, Request, status, WebSocket, WebSocketDisconnect
+from database import engine, Base, AsyncSessionLocal, replica_set, replica_health_loop, ReadYourWritesMiddleware
 from routers import auth, admin, orders, cities, invoices, chat
 from sqladmin import Admin
 from admin import UserAdmin, CityAdmin, OrderAdmin, InvoiceAdmin, ConversationAdmin, MessageAdmin
 import base64
 import bcrypt
-from sqlalchemy.ext.asyncio import AsyncSession
+from executors import cpu_executor, configure_db_executor
 from sqlalchemy import select
-from models import User, Conversation, Message, JWTToken
-from fastapi.responses import JSONResponse
+from models import User, Conversation, Message
+from fastapi.responses import JSONResponse, PlainTextResponse
 import os
 import asyncio
 import json
-from typing import Dict, Set
-from jose import JWTError, jwt
+import logging
+import secrets
+from typing import Optional
 from config import settings
-
-print(f"Current working directory: {os.getcwd()}")
-print(f"Database URL: {engine.url}")
+from auth import get_current_user_from_token
+from logging_config import setup_logging, correlation_id, new_correlation_id
+import metrics
+import sql_profiler
+import warmup
+from idempotency import IdempotencyMiddleware
+from admission import AdmissionControlMiddleware
+from archive import message_archive_loop, messages_after
+from retention import retention_loop
+from realtime import manager, participant_cache, message_buffer, order_events, serialize_message, parse_event_type, EPHEMERAL_EVENTS
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+logger.info("Starting API", extra={"event": "app.boot", "cwd": os.getcwd(), "database": engine.url.render_as_string(hide_password=True)})
 
 app = FastAPI()
 
+_warmup_task: Optional[asyncio.Task] = None
+_replica_health_task: Optional[asyncio.Task] = None
+_message_archive_task: Optional[asyncio.Task] = None
+_retention_task: Optional[asyncio.Task] = None
+
 @app.on_event("startup")
 async def startup_event():
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+    global _warmup_task, _replica_health_task, _message_archive_task, _retention_task
+    configure_db_executor()
+    if settings.create_schema_on_startup:
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+    manager.start_sweeper()
+    # Warm up in the background so /healthz answers while the caches fill
+    _warmup_task = asyncio.create_task(warmup.warm_up())
+    if replica_set:
+        _replica_health_task = asyncio.create_task(replica_health_loop())
+    if settings.message_archive_after_days > 0:
+        _message_archive_task = asyncio.create_task(message_archive_loop())
+    if settings.retention_enabled:
+        _retention_task = asyncio.create_task(retention_loop())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    for task in (_warmup_task, _replica_health_task, _message_archive_task, _retention_task):
+        if task is not None:
+            task.cancel()
+    await manager.stop_sweeper()
+    cpu_executor.shutdown()
 
 app.include_router(auth.router, prefix="/auth", tags=["auth"])
 app.include_router(admin.router, prefix="/admin", tags=["admin"])
@@ -59,7 +97,7 @@ async def admin_auth_middleware(request: Request, call_next):
                     )
                 )
                 user = user.scalar_one_or_none()
-                if not user or not bcrypt.checkpw(password.encode('utf-8'), user.admin_password_hash.encode('utf-8')):
+                if not user or not await cpu_executor.run(bcrypt.checkpw, password.encode('utf-8'), user.admin_password_hash.encode('utf-8')):
                     return JSONResponse(
                         status_code=status.HTTP_401_UNAUTHORIZED,
                         content={"detail": "Invalid credentials"},
@@ -75,6 +113,26 @@ async def admin_auth_middleware(request: Request, call_next):
     response = await call_next(request)
     return response
 
+# Tag every request with a correlation id (client supplied or generated) for log lines
+@app.middleware("http")
+async def request_context_middleware(request: Request, call_next):
+    request_id = request.headers.get("x-request-id") or new_correlation_id()
+    correlation_id.set(request_id)
+    response = await call_next(request)
+    response.headers["X-Request-ID"] = request_id
+    return response
+
+app.add_middleware(ReadYourWritesMiddleware)
+app.add_middleware(sql_profiler.ProfilerMiddleware)
+# Outside the profiler so replayed responses don't count as zero-query requests
+app.add_middleware(IdempotencyMiddleware)
+# Before anything else runs for the request, so shed requests cost almost nothing
+app.add_middleware(AdmissionControlMiddleware)
+# Registered last so it is the outermost middleware and times the whole request
+app.add_middleware(metrics.MetricsMiddleware)
+metrics.register_connection_manager(manager, message_buffer)
+metrics.register_user_event_hub(order_events)
+
 # Metadata reflection removed for async engine compatibility
 
 # Create and mount SQLAdmin
@@ -90,157 +148,132 @@ sqladmin.add_view(MessageAdmin)
 def read_root():
     return {"message": "Welcome to the API"}
 
-
-class ConnectionManager:
-    def __init__(self):
-        # conversation_id -> set of websockets
-        self.active_connections: Dict[int, Set[WebSocket]] = {}
-
-    async def connect(self, websocket: WebSocket, conversation_id: int, user_id: int):
-        await websocket.accept()
-        if conversation_id not in self.active_connections:
-            self.active_connections[conversation_id] = set()
-        self.active_connections[conversation_id].add(websocket)
-
-    def disconnect(self, websocket: WebSocket, conversation_id: int):
-        if conversation_id in self.active_connections:
-            self.active_connections[conversation_id].discard(websocket)
-            if not self.active_connections[conversation_id]:
-                del self.active_connections[conversation_id]
-
-    async def broadcast_to_conversation(self, message: dict, conversation_id: int, exclude_websocket: WebSocket = None):
-        if conversation_id in self.active_connections:
-            for connection in self.active_connections[conversation_id]:
-                if connection != exclude_websocket:
-                    try:
-                        await connection.send_json(message)
-                    except:
-                        # Connection might be closed, remove it
-                        self.active_connections[conversation_id].discard(connection)
-
-
-manager = ConnectionManager()
-
-
-async def get_current_user_from_token(token: str, db: AsyncSession) -> User:
-    """Extract user from JWT token for WebSocket authentication"""
-    print(f"WebSocket auth: Validating token (length: {len(token)})")
-
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-    )
-    try:
-        payload = jwt.decode(token, settings.secret_key, algorithms=["HS256"])
-        phone_number: str = payload.get("sub")
-        token_type: str = payload.get("type")
-        is_temp: bool = payload.get("temp", False)
-
-        print(f"WebSocket auth: Token payload - phone: {phone_number}, type: {token_type}, temp: {is_temp}")
-
-        if phone_number is None:
-            print("WebSocket auth: No phone number in token")
-            raise credentials_exception
-        if token_type == "refresh":
-            print("WebSocket auth: Refresh token not allowed")
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Refresh token not allowed",
-            )
-    except JWTError as e:
-        print(f"WebSocket auth: JWT decode error: {e}")
-        raise credentials_exception
-
-    # For temporary tokens (used during profile completion), skip database check
-    if not is_temp:
-        print("WebSocket auth: Checking permanent token in database")
-        # Check if token exists in database and is not revoked
-        jwt_token = await db.execute(
-            select(JWTToken).where(
-                JWTToken.access_token == token,
-                JWTToken.is_revoked == False
-            )
-        )
-        jwt_token = jwt_token.scalar_one_or_none()
-
-        if not jwt_token:
-            print("WebSocket auth: Token not found in database or revoked")
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Token has been revoked or does not exist",
-            )
-
-        # Check if access token is expired
-        from datetime import datetime
-        if datetime.utcnow() > jwt_token.access_token_expires_at:
-            print(f"WebSocket auth: Token expired. Now: {datetime.utcnow()}, Expires: {jwt_token.access_token_expires_at}")
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Access token expired",
-            )
-        print("WebSocket auth: Token validated successfully")
-    else:
-        print("WebSocket auth: Temporary token - skipping database check")
-
-    user = await db.execute(select(User).where(User.phone_number == phone_number))
-    user = user.scalar_one_or_none()
-    if user is None:
-        print(f"WebSocket auth: User not found for phone: {phone_number}")
-        raise credentials_exception
-
-    print(f"WebSocket auth: Authentication successful for user: {user.id} ({user.name})")
-    return user
+@app.get("/healthz", include_in_schema=False)
+async def healthz():
+    """Liveness: the process is up and its event loop is serving requests"""
+    return {"status": "ok"}
+
+@app.get("/readyz", include_in_schema=False)
+async def readyz():
+    """Readiness: startup warmup finished, the worker can take traffic"""
+    return JSONResponse(status_code=200 if warmup.readiness.ready else 503, content=warmup.readiness.status())
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics(authorization: Optional[str] = Header(None)):
+    """Prometheus text format scrape endpoint, for the bearer token in settings.metrics_token"""
+    if not settings.metrics_token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    expected = f"Bearer {settings.metrics_token}".encode()
+    if not secrets.compare_digest((authorization or "").encode(), expected):
+        raise HTTPException(status_code=401, detail="Invalid metrics token", headers={"WWW-Authenticate": "Bearer"})
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+async def replay_missed_messages(websocket: WebSocket, conversation_id: int, last_seen_message_id: int):
+    """Send messages newer than `last_seen_message_id`, from memory when possible"""
+    missed = message_buffer.since(conversation_id, last_seen_message_id)
+    truncated = False
+    if missed is None:
+        # Gap is older than the ring buffer, fall back to an indexed range query
+        async with AsyncSessionLocal() as db:
+            rows = await messages_after(db, conversation_id, last_seen_message_id, settings.ws_replay_max_messages + 1)
+        truncated = len(rows) > settings.ws_replay_max_messages
+        missed = [serialize_message(message) for message in rows[:settings.ws_replay_max_messages]]
+        if not truncated:
+            # These rows are the whole tail of the conversation, later reconnects can use memory
+            message_buffer.prime(conversation_id, missed)
+
+    for message_data in missed:
+        await websocket.send_json(message_data)
+    # Clients that get truncated=true should page the rest through the REST endpoint
+    await websocket.send_json({"type": "replay_complete", "count": len(missed), "truncated": truncated})
 
 
 @app.websocket("/ws/chat/{conversation_id}")
 async def websocket_chat(
     websocket: WebSocket,
     conversation_id: int,
-    token: str
+    token: str,
+    last_seen_message_id: Optional[int] = None
 ):
     """
     WebSocket endpoint for real-time chat.
     Authenticates user with JWT token and ensures they are a participant in the conversation.
+    Frames with "type" "message" or "invoice" are persisted; "typing_started",
+    "typing_stopped" and "courier_on_the_way" are only relayed to the other participant.
+    Clients reconnecting with `last_seen_message_id` get the messages they missed
+    replayed before live traffic.
     """
-    print(f"WebSocket: New connection attempt for conversation {conversation_id}")
+    correlation_id.set(new_correlation_id())
 
-    db = AsyncSessionLocal()
     user = None
     try:
-        # Authenticate user
-        print(f"WebSocket: Starting authentication for token length: {len(token)}")
-        user = await get_current_user_from_token(token, db)
-
-        # Get conversation and check authorization
-        conversation = await db.execute(
-            select(Conversation).where(Conversation.id == conversation_id)
-        )
-        conversation = conversation.scalar_one_or_none()
-
-        if not conversation:
-            print(f"WebSocket: Conversation {conversation_id} not found")
-            await websocket.close(code=1008, reason="Conversation not found")
-            return
+        # Authenticate and authorize with a short-lived session; no connection
+        # is held while the socket sits idle
+        participants = participant_cache.get(conversation_id)
+        async with AsyncSessionLocal() as db:
+            user = await get_current_user_from_token(token, db)
+
+            if participants is None:
+                # Get conversation and check authorization
+                conversation = await db.execute(
+                    select(Conversation).where(Conversation.id == conversation_id)
+                )
+                conversation = conversation.scalar_one_or_none()
+
+                if not conversation:
+                    logger.info("WebSocket: Conversation %s not found", conversation_id, extra={"event": "ws.rejected"})
+                    await websocket.close(code=1008, reason="Conversation not found")
+                    return
+
+                participants = (conversation.customer_id, conversation.courier_id)
+                participant_cache.set(conversation_id, *participants)
 
         # Check if user is a participant
-        if user.id not in [conversation.customer_id, conversation.courier_id]:
-            print(f"WebSocket: User {user.id} not authorized for conversation {conversation_id}")
+        if user.id not in participants:
+            logger.info("WebSocket: User %s not authorized for conversation %s", user.id, conversation_id, extra={"event": "ws.rejected"})
             await websocket.close(code=1008, reason="Not authorized for this conversation")
             return
 
-        print(f"WebSocket: Authentication successful, connecting user {user.id} to conversation {conversation_id}")
+        logger.info("WebSocket: User %s connected to conversation %s", user.id, conversation_id, extra={"event": "ws.connect", "user_id": user.id, "conversation_id": conversation_id})
         # Connect to WebSocket
-        await manager.connect(websocket, conversation_id, user.id)
+        if not await manager.connect(websocket, conversation_id, user.id):
+            logger.warning("WebSocket: Conversation %s is at its connection limit", conversation_id, extra={"event": "ws.rejected"})
+            return
+
+        if last_seen_message_id is not None:
+            await replay_missed_messages(websocket, conversation_id, last_seen_message_id)
 
         while True:
-            # Receive message from client
+            # Receive event from client
             data = await websocket.receive_json()
+            manager.touch(websocket)
+
+            # Validate event structure
+            if not isinstance(data, dict):
+                continue
+            event_type = parse_event_type(data)
+            if event_type is None:
+                continue
+
+            # Heartbeats only refresh liveness
+            if event_type == "ping":
+                await websocket.send_json({"type": "pong"})
+                continue
+            if event_type == "pong":
+                continue
 
-            # Validate message structure
-            if not isinstance(data, dict) or "content" not in data:
+            # Typing/presence signals are fanned out without touching the database
+            if event_type in EPHEMERAL_EVENTS:
+                await manager.broadcast_ephemeral(
+                    {"type": event_type, "conversation_id": conversation_id, "user_id": user.id},
+                    conversation_id,
+                    user.id,
+                    websocket
+                )
                 continue
 
-            message_type = data.get("message_type", "text")
+            message_type = "invoice" if event_type == "invoice" else data.get("message_type", "text")
 
             # Create message in database
             new_message = Message(
@@ -255,39 +288,27 @@ async def websocket_chat(
                 invoice_total=data.get("invoice_total")
             )
 
-            db.add(new_message)
-            await db.commit()
-            await db.refresh(new_message)
-
-            # Prepare message to broadcast
-            message_data = {
-                "id": new_message.id,
-                "conversation_id": new_message.conversation_id,
-                "sender_id": new_message.sender_id,
-                "content": new_message.content,
-                "message_type": new_message.message_type,
-                "sent_at": new_message.sent_at.isoformat(),
-                "invoice_description": new_message.invoice_description,
-                "invoice_gift_price": new_message.invoice_gift_price,
-                "invoice_service_fee": new_message.invoice_service_fee,
-                "invoice_delivery_fee": new_message.invoice_delivery_fee,
-                "invoice_total": new_message.invoice_total
-            }
+            # Check out a connection only for the duration of the write
+            async with AsyncSessionLocal() as db:
+                db.add(new_message)
+                await db.commit()
+                await db.refresh(new_message)
+
+            manager.counters["messages_persisted"] += 1
+            logger.debug("WebSocket: Message %s persisted", new_message.id, extra={"event": "ws.message", "conversation_id": conversation_id})
+            message_data = serialize_message(new_message)
+            message_buffer.append(conversation_id, message_data)
 
             # Broadcast to other participants in the conversation
             await manager.broadcast_to_conversation(message_data, conversation_id, websocket)
 
     except WebSocketDisconnect:
-        print(f"WebSocket: Client disconnected from conversation {conversation_id}")
+        logger.info("WebSocket: Client disconnected from conversation %s", conversation_id, extra={"event": "ws.disconnect"})
         manager.disconnect(websocket, conversation_id)
     except Exception as e:
-        print(f"WebSocket error: {e}")
+        logger.exception("WebSocket error: %s", e, extra={"event": "ws.error"})
         manager.disconnect(websocket, conversation_id)
         try:
             await websocket.close(code=1011, reason="Internal server error")
         except:
             pass
-    finally:
-        # Always close the database session
-        await db.close()
-        print(f"WebSocket: Database session closed for conversation {conversation_id}")
@@ -0,0 +1,266 @@
+import bisect
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+from database import engine, sync_engine, replica_set
+
+# Metrics are recorded into per-thread shards: the event loop and each
+# threadpool worker only ever write to their own dicts, so the hot path takes
+# no lock. A scrape copies and sums the shards.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards: List[dict] = []
+        self._shards_lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _shard(self) -> dict:
+        shard = getattr(self._local, "values", None)
+        if shard is None:
+            shard = self._local.values = {}
+            # Only taken the first time a thread touches this metric
+            with self._shards_lock:
+                self._shards.append(shard)
+        return shard
+
+    def _snapshot(self) -> Iterable[dict]:
+        with self._shards_lock:
+            shards = list(self._shards)
+        # dict.copy() is atomic under the GIL, writers never see a lock
+        return [shard.copy() for shard in shards]
+
+    def _labels(self, key: Tuple, extra: str = "") -> str:
+        pairs = [f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, key)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def values(self) -> Dict[Tuple, float]:
+        totals: Dict[Tuple, float] = {}
+        for shard in self._snapshot():
+            for key, value in shard.items():
+                totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        for key, value in sorted(self.values().items()):
+            lines.append(f"{self.name}{self._labels(key)} {value}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels):
+        shard = self._shard()
+        state = shard.get(labels)
+        if state is None:
+            # One slot per bucket plus +Inf, then sum
+            state = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        state[bisect.bisect_left(self.buckets, value)] += 1
+        state[-1] += value
+
+    def render(self) -> List[str]:
+        totals: Dict[Tuple, list] = {}
+        for shard in self._snapshot():
+            for key, state in shard.items():
+                merged = totals.setdefault(key, [0] * len(state))
+                for i, value in enumerate(list(state)):
+                    merged[i] += value
+
+        lines = super().render()
+        for key, state in sorted(totals.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{self._labels(key, le)} {cumulative}")
+            cumulative += state[len(self.buckets)]
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{self._labels(key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{self._labels(key)} {state[-1]}")
+            lines.append(f"{self.name}_count{self._labels(key)} {cumulative}")
+        return lines
+
+
+class GaugeCallback(_Metric):
+    """Gauge read at scrape time from a callback returning {label values: value}"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str], callback: Callable[[], Dict[Tuple, float]]):
+        super().__init__(name, help, labelnames)
+        self.callback = callback
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        try:
+            values = self.callback()
+        except Exception:
+            return lines
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{self._labels(key)} {value}")
+        return lines
+
+
+class CounterCallback(GaugeCallback):
+    """Counter whose running total is owned elsewhere and read at scrape time"""
+
+    kind = "counter"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+REGISTRY: List[_Metric] = []
+
+
+def render() -> str:
+    """All registered metrics in Prometheus text exposition format"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# HTTP
+REQUEST_LATENCY = Histogram("giftly_http_request_duration_seconds", "HTTP request latency by route template and status", ("method", "route", "status"))
+REQUEST_DB_QUERIES = Histogram("giftly_http_request_db_queries", "SQL statements executed per HTTP request", ("route",), buckets=QUERY_COUNT_BUCKETS)
+REQUEST_DB_SECONDS = Histogram("giftly_http_request_db_seconds", "Time spent in SQL statements per HTTP request", ("route",))
+# Invoices
+PDF_RENDER_SECONDS = Histogram("giftly_invoice_pdf_render_seconds", "Time spent rendering invoice PDFs", buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5))
+
+_in_flight = 0
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware recording latency per route template. Register it
+    last so it wraps every other middleware and sees the full request time.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        global _in_flight
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        _in_flight += 1
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            _in_flight -= 1
+            route = scope.get("route")
+            # Mounted apps (SQLAdmin) and 404s have no route template, keep label cardinality bounded
+            template = route.path if route is not None else "unmatched"
+            REQUEST_LATENCY.observe(elapsed, scope["method"], template, str(status_code))
+
+
+def _in_flight_requests() -> Dict[Tuple, float]:
+    return {(): _in_flight}
+
+
+def _threadpool() -> Dict[Tuple, float]:
+    import anyio.to_thread
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    statistics = limiter.statistics()
+    return {
+        ("capacity",): limiter.total_tokens,
+        ("busy",): statistics.borrowed_tokens,
+        ("queued",): statistics.tasks_waiting,
+    }
+
+
+GaugeCallback("giftly_http_requests_in_flight", "HTTP requests currently being served", (), _in_flight_requests)
+GaugeCallback("giftly_threadpool", "AnyIO default threadpool used by sync handlers", ("state",), _threadpool)
+
+
+def _db_pool() -> Dict[Tuple, float]:
+    values = {}
+    pools = [("async", engine.pool), ("sync", sync_engine.pool)]
+    pools += [(f"replica{i}", replica.pool) for i, replica in enumerate(replica_set.engines())]
+    for name, pool in pools:
+        if hasattr(pool, "checkedout"):
+            values[(name, "checked_out")] = pool.checkedout()
+            values[(name, "size")] = pool.size()
+            values[(name, "overflow")] = pool.overflow()
+    return values
+
+
+GaugeCallback("giftly_db_pool_connections", "SQLAlchemy connection pool usage", ("engine", "state"), _db_pool)
+GaugeCallback("giftly_db_replica_healthy", "1 while a read replica is in rotation, 0 while ejected", ("replica",),
+              lambda: {(f"replica{i}",): 1.0 if entry["healthy"] else 0.0 for i, entry in enumerate(replica_set.stats())})
+
+
+def register_connection_manager(manager, message_buffer):
+    """Expose chat socket gauges and event counters from realtime"""
+    gauges = ("connections", "conversations", "users", "pending_ephemeral")
+
+    def live() -> Dict[Tuple, float]:
+        stats = manager.stats()
+        return {(name,): stats[name] for name in gauges}
+
+    def events() -> Dict[Tuple, float]:
+        return {(name,): value for name, value in manager.counters.items()}
+
+    def buffer() -> Dict[Tuple, float]:
+        return {(name,): value for name, value in message_buffer.stats().items()}
+
+    GaugeCallback("giftly_ws_live", "Live chat socket gauges", ("kind",), live)
+    CounterCallback("giftly_ws_events_total", "Chat socket events since start", ("event",), events)
+    GaugeCallback("giftly_ws_replay_buffer", "Reconnect replay buffer usage and hit counts", ("kind",), buffer)
+
+
+def register_user_event_hub(hub):
+    """Expose order/invoice event stream gauges and counters from realtime"""
+    gauges = ("event_streams", "event_stream_users")
+
+    def live() -> Dict[Tuple, float]:
+        stats = hub.stats()
+        return {(name,): stats[name] for name in gauges}
+
+    def events() -> Dict[Tuple, float]:
+        return {(name,): value for name, value in hub.counters.items()}
+
+    GaugeCallback("giftly_sse_live", "Open order event streams", ("kind",), live)
+    CounterCallback("giftly_sse_events_total", "Order event stream activity since start", ("event",), events)
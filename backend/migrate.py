@@ -0,0 +1,60 @@
+from typing import List
+import logging
+from sqlalchemy import inspect, text
+from database import Base, sync_engine
+# Imported for their side effects: the tables, and the full-text side tables
+# created along with them
+import models
+import search
+
+logger = logging.getLogger(__name__)
+
+# Brings a database created by an older version up to the current models, for
+# deployments running with create_schema_on_startup off. Only what is missing
+# is added, so it is safe to run on every deploy:
+#
+#   python migrate.py
+#
+# create_all only creates missing tables, so the columns and indexes added to
+# existing tables are applied here:
+#
+#   orders.version                 optimistic concurrency of order transitions
+#   indexes on filter columns      orders, jwt_tokens, cities, messages
+#   unique ix_invoices_order_id    one invoice per order
+#
+# The full-text tables of a database that had data before search was added
+# are filled with `python search.py`.
+
+
+def _duplicate_invoice_orders(connection) -> List[int]:
+    return connection.execute(text("SELECT order_id FROM invoices GROUP BY order_id HAVING count(*) > 1")).scalars().all()
+
+
+def migrate() -> List[str]:
+    applied = []
+    # New tables (messages_archive, the search tables) come with their indexes
+    Base.metadata.create_all(sync_engine)
+    with sync_engine.begin() as connection:
+        inspector = inspect(connection)
+        if "version" not in {column["name"] for column in inspector.get_columns("orders")}:
+            connection.execute(text("ALTER TABLE orders ADD COLUMN version INTEGER NOT NULL DEFAULT 1"))
+            applied.append("orders.version")
+
+        for table in Base.metadata.sorted_tables:
+            existing = {index["name"] for index in inspector.get_indexes(table.name)}
+            for index in sorted(table.indexes, key=lambda index: index.name):
+                if index.name in existing:
+                    continue
+                if index.name == "ix_invoices_order_id":
+                    duplicates = _duplicate_invoice_orders(connection)
+                    if duplicates:
+                        raise RuntimeError(f"Orders with more than one invoice, resolve them before migrating: {duplicates}")
+                index.create(connection)
+                applied.append(index.name)
+    logger.info("Schema migrated: %s", applied or "nothing to do", extra={"event": "schema.migrated"})
+    return applied
+
+
+if __name__ == "__main__":
+    applied = migrate()
+    print("Applied: " + ", ".join(applied) if applied else "Schema is up to date")
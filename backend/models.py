@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Date, ForeignKey, Text, Enum, UniqueConstraint
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, Date, ForeignKey, Text, Enum, UniqueConstraint, Index
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from database import Base
@@ -13,6 +13,22 @@ class OrderStatus(enum.Enum):
     DONE = "done"
     IN_PROGRESS_TO_DELIVER = "in progress to deliver"
 
+# Allowed order status changes. Every transition is applied as one conditional
+# UPDATE matching the allowed source statuses (and the version, if the client
+# sent one), so concurrent changes to an order cannot both succeed.
+ORDER_TRANSITIONS = {
+    OrderStatus.NEW: {OrderStatus.RECEIVED_BY_COURIER, OrderStatus.CANCELLED},
+    OrderStatus.RECEIVED_BY_COURIER: {OrderStatus.RECEIVED_BY_COURIER, OrderStatus.PAID, OrderStatus.IN_PROGRESS_TO_DO, OrderStatus.CANCELLED},
+    OrderStatus.PAID: {OrderStatus.RECEIVED_BY_COURIER, OrderStatus.IN_PROGRESS_TO_DO, OrderStatus.CANCELLED},
+    OrderStatus.IN_PROGRESS_TO_DO: {OrderStatus.RECEIVED_BY_COURIER, OrderStatus.IN_PROGRESS_TO_DELIVER, OrderStatus.CANCELLED},
+    OrderStatus.IN_PROGRESS_TO_DELIVER: {OrderStatus.RECEIVED_BY_COURIER, OrderStatus.DONE, OrderStatus.CANCELLED},
+    OrderStatus.DONE: set(),
+    OrderStatus.CANCELLED: set(),
+}
+
+def order_statuses_leading_to(target: OrderStatus) -> list:
+    return [source for source, targets in ORDER_TRANSITIONS.items() if target in targets]
+
 class InvoiceStatus(enum.Enum):
     NEW = "new"
     PAID = "paid"
@@ -20,6 +36,18 @@ class InvoiceStatus(enum.Enum):
     REFUNDED = "refunded"
     OTHER = "other"
 
+# Allowed invoice status changes for bulk admin actions
+INVOICE_TRANSITIONS = {
+    InvoiceStatus.NEW: {InvoiceStatus.PAID, InvoiceStatus.CANCELLED, InvoiceStatus.OTHER},
+    InvoiceStatus.OTHER: {InvoiceStatus.PAID, InvoiceStatus.CANCELLED},
+    InvoiceStatus.PAID: {InvoiceStatus.REFUNDED},
+    InvoiceStatus.CANCELLED: set(),
+    InvoiceStatus.REFUNDED: set(),
+}
+
+def invoice_statuses_leading_to(target: InvoiceStatus) -> list:
+    return [source for source, targets in INVOICE_TRANSITIONS.items() if target in targets]
+
 class User(Base):
     __tablename__ = "users"
 
@@ -58,7 +86,7 @@ class City(Base):
     def __str__(self):
         return self.name
     icon = Column(String, nullable=True)
-    active = Column(Boolean, default=True)
+    active = Column(Boolean, default=True, index=True)
 
     # Relationship to users
     users = relationship("User", back_populates="city")
@@ -73,15 +101,17 @@ class Order(Base):
 
     def __str__(self):
         return f"Order {self.order_id}"
-    created_by_user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    assigned_to_user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    created_by_user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    assigned_to_user_id = Column(Integer, ForeignKey("users.id"), nullable=True, index=True)
     description = Column(Text, nullable=True)
     creation_date = Column(DateTime, default=func.now(), nullable=False)
     delivery_date = Column(DateTime, nullable=True)
-    status = Column(Enum(OrderStatus), nullable=False, default=OrderStatus.NEW)
+    status = Column(Enum(OrderStatus), nullable=False, default=OrderStatus.NEW, index=True)
     comments = Column(Text, nullable=True)
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
-    city_id = Column(Integer, ForeignKey("cities.id"), nullable=False)
+    city_id = Column(Integer, ForeignKey("cities.id"), nullable=False, index=True)
+    # Bumped by every status transition, for optimistic concurrency
+    version = Column(Integer, nullable=False, default=1, server_default="1")
 
     # Relationships
     created_by_user = relationship("User", back_populates="created_orders", foreign_keys=[created_by_user_id])
@@ -98,7 +128,8 @@ class Invoice(Base):
 
     def __str__(self):
         return f"Invoice {self.invoice_id}"
-    order_id = Column(Integer, ForeignKey("orders.id"), nullable=False)
+    # One invoice per order, also enforced for concurrent creates
+    order_id = Column(Integer, ForeignKey("orders.id"), nullable=False, unique=True, index=True)
     full_amount = Column(Integer, nullable=False)  # Amount in cents/halaym
     service_fee = Column(Integer, nullable=False, default=0)
     order_only_price = Column(Integer, nullable=False)
@@ -121,7 +152,7 @@ class JWTToken(Base):
     __tablename__ = "jwt_tokens"
 
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
     access_token = Column(String, unique=True, nullable=False, index=True)
     refresh_token = Column(String, unique=True, nullable=False, index=True)
     access_token_expires_at = Column(DateTime, nullable=False)
@@ -169,3 +200,37 @@ class Message(Base):
     # Relationships
     conversation = relationship("Conversation", back_populates="messages")
     sender = relationship("User")
+
+    __table_args__ = (
+        # Range scans for reconnect replay: WHERE conversation_id = ? AND id > ?
+        Index('ix_messages_conversation_id_id', 'conversation_id', 'id'),
+        # Message history pages: WHERE conversation_id = ? ORDER BY sent_at DESC
+        Index('ix_messages_conversation_id_sent_at', 'conversation_id', 'sent_at'),
+        # Never reuse the id of a deleted or archived message on SQLite
+        {"sqlite_autoincrement": True},
+    )
+
+class MessageArchive(Base):
+    """
+    Messages older than `message_archive_after_days`, moved here in chunks by
+    archive.archive_messages so the hot `messages` table and its indexes stay
+    small. Same columns and ids as Message; read only past the hot window.
+    """
+    __tablename__ = "messages_archive"
+
+    id = Column(Integer, primary_key=True)
+    conversation_id = Column(Integer, ForeignKey("conversations.id"), nullable=False)
+    sender_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    content = Column(Text, nullable=False)
+    sent_at = Column(DateTime(timezone=True), nullable=False)
+    message_type = Column(String(20), nullable=False, default='text')
+    invoice_description = Column(Text, nullable=True)
+    invoice_gift_price = Column(Integer, nullable=True)
+    invoice_service_fee = Column(Integer, nullable=True)
+    invoice_delivery_fee = Column(Integer, nullable=True)
+    invoice_total = Column(Integer, nullable=True)
+
+    __table_args__ = (
+        Index('ix_messages_archive_conversation_id_sent_at', 'conversation_id', 'sent_at'),
+        Index('ix_messages_archive_conversation_id_id', 'conversation_id', 'id'),
+    )
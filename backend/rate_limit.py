@@ -0,0 +1,215 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+import logging
+import math
+import threading
+import time
+import zlib
+from fastapi import HTTPException, Request, status
+from config import settings
+import metrics
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMITED = metrics.Counter("giftly_rate_limited_total", "Requests rejected by a rate limit bucket", ("route", "scope"))
+
+
+def parse_limit(spec: str) -> Tuple[float, float]:
+    """"<capacity>/<seconds>" -> (capacity, refill rate in tokens per second)"""
+    capacity, period = spec.split("/", 1)
+    capacity, period = float(capacity), float(period)
+    if capacity <= 0 or period <= 0:
+        raise ValueError(f"Invalid rate limit {spec!r}")
+    return capacity, capacity / period
+
+
+# (key, capacity, refill rate) of one bucket
+Bucket = Tuple[str, float, float]
+
+
+class RateLimitBackend(ABC):
+    """Storage for token buckets. `take` removes one token from each of the
+    `buckets` only if every one of them has a token, and returns for each the
+    seconds until it will have one (all 0 when the tokens were taken)."""
+
+    @abstractmethod
+    async def take(self, buckets: Sequence[Bucket]) -> List[float]:
+        ...
+
+
+class MemoryBackend(RateLimitBackend):
+    """
+    Per-process buckets split over shards, each with its own lock, so callers
+    limiting different keys rarely contend. A shard keeps its most recently
+    used `max_keys_per_shard` buckets; an evicted bucket starts over full.
+    """
+
+    def __init__(self, shards: int = 16, max_keys_per_shard: int = 10000):
+        self.max_keys_per_shard = max_keys_per_shard
+        self._shards: List[Tuple[threading.Lock, "OrderedDict[str, List[float]]"]] = [
+            (threading.Lock(), OrderedDict()) for _ in range(shards)
+        ]
+
+    def _refilled(self, shard: int, key: str, capacity: float, rate: float, now: float) -> List[float]:
+        buckets = self._shards[shard][1]
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = [capacity, now]
+            if len(buckets) > self.max_keys_per_shard:
+                buckets.popitem(last=False)
+        else:
+            buckets.move_to_end(key)
+            bucket[0] = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+        return bucket
+
+    def take_nowait(self, buckets: Sequence[Bucket]) -> List[float]:
+        shards = [zlib.crc32(key.encode()) % len(self._shards) for key, _, _ in buckets]
+        # Locks taken in shard order, so callers sharing shards cannot deadlock
+        locks = [self._shards[shard][0] for shard in sorted(set(shards))]
+        for lock in locks:
+            lock.acquire()
+        try:
+            now = time.monotonic()
+            states = [self._refilled(shard, key, capacity, rate, now) for shard, (key, capacity, rate) in zip(shards, buckets)]
+            retries = [0.0 if state[0] >= 1 else (1 - state[0]) / rate for state, (_, _, rate) in zip(states, buckets)]
+            if not any(retries):
+                for state in states:
+                    state[0] -= 1
+            return retries
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+    async def take(self, buckets: Sequence[Bucket]) -> List[float]:
+        return self.take_nowait(buckets)
+
+    def stats(self) -> dict:
+        return {"buckets": sum(len(buckets) for _, buckets in self._shards)}
+
+
+# Refill every bucket and take from all or none in one round trip, timed by
+# the Redis clock so every worker agrees. ARGV holds capacity, rate per key
+_REDIS_TAKE = """
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local tokens, retries, allowed = {}, {}, true
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[2 * i - 1])
+    local rate = tonumber(ARGV[2 * i])
+    local bucket = redis.call('HMGET', key, 'tokens', 'ts')
+    local ts = tonumber(bucket[2]) or now
+    tokens[i] = math.min(capacity, (tonumber(bucket[1]) or capacity) + (now - ts) * rate)
+    if tokens[i] >= 1 then
+        retries[i] = '0'
+    else
+        retries[i] = tostring((1 - tokens[i]) / rate)
+        allowed = false
+    end
+end
+if allowed then
+    for i, key in ipairs(KEYS) do
+        local capacity = tonumber(ARGV[2 * i - 1])
+        local rate = tonumber(ARGV[2 * i])
+        redis.call('HSET', key, 'tokens', tokens[i] - 1, 'ts', now)
+        redis.call('PEXPIRE', key, math.ceil(capacity / rate * 1000))
+    end
+end
+return retries
+"""
+
+
+class RedisBackend(RateLimitBackend):
+    """
+    Buckets shared by every worker through Redis (needs the `redis` package).
+    If Redis is unreachable requests are let through rather than failing
+    the auth flow.
+    """
+
+    def __init__(self, url: str):
+        import redis.asyncio
+        self.client = redis.asyncio.from_url(url)
+        self.script = self.client.register_script(_REDIS_TAKE)
+
+    async def take(self, buckets: Sequence[Bucket]) -> List[float]:
+        keys = [f"ratelimit:{key}" for key, _, _ in buckets]
+        args = [value for _, capacity, rate in buckets for value in (capacity, rate)]
+        try:
+            return [float(retry) for retry in await self.script(keys=keys, args=args)]
+        except Exception as e:
+            logger.warning("Rate limit backend unavailable: %s", e, extra={"event": "rate_limit.backend_error"})
+            return [0.0] * len(buckets)
+
+
+def create_backend(name: str) -> RateLimitBackend:
+    if name == "memory":
+        return MemoryBackend()
+    if name.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBackend(name)
+    raise ValueError(f"Unknown rate limit backend {name!r}")
+
+
+class RateLimiter:
+    """
+    Token buckets per route, keyed by phone number, client IP and globally, as
+    configured in `settings.rate_limits`. A token is taken from every bucket
+    only when all of them have one; otherwise the request is rejected with
+    429 before the handler touches the database, and spends nothing, so a
+    flood that trips the IP or global limit does not drain phone buckets.
+    """
+
+    SCOPES = ("phone", "ip", "global")
+
+    def __init__(self, limits: Dict[str, Dict[str, str]], backend: RateLimitBackend, enabled: bool = True):
+        self.backend = backend
+        self.enabled = enabled
+        self.limits = {
+            route: {scope: parse_limit(spec) for scope, spec in scopes.items()}
+            for route, scopes in limits.items()
+        }
+
+    async def check(self, route: str, request: Request, phone_number: Optional[str] = None):
+        limits = self.limits.get(route)
+        if not self.enabled or not limits:
+            return
+        keys = {"phone": phone_number, "ip": client_ip(request), "global": ""}
+        scopes = [scope for scope in self.SCOPES if scope in limits and keys[scope] is not None]
+        if not scopes:
+            return
+        retries = await self.backend.take([(f"{route}:{scope}:{keys[scope]}",) + limits[scope] for scope in scopes])
+        rejected = [(scope, retry) for scope, retry in zip(scopes, retries) if retry > 0]
+        if rejected:
+            for scope, _ in rejected:
+                RATE_LIMITED.inc(route, scope)
+            scope = rejected[0][0]
+            logger.info("Rate limited %s by %s", route, scope, extra={"event": "rate_limit.rejected", "route": route, "scope": scope})
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many requests, please try again later",
+                headers={"Retry-After": str(math.ceil(max(retry for _, retry in rejected)))},
+            )
+
+
+def client_ip(request: Request) -> Optional[str]:
+    if settings.rate_limit_trust_forwarded_for:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",", 1)[0].strip()
+    return request.client.host if request.client else None
+
+
+rate_limiter = RateLimiter(settings.rate_limits, create_backend(settings.rate_limit_backend), settings.rate_limit_enabled)
+
+
+def rate_limit(route: str):
+    """Dependency applying the IP and global limits of `route`, for handlers
+    without a phone number in the request"""
+    async def dependency(request: Request):
+        await rate_limiter.check(route, request)
+    return dependency
+
+
+if isinstance(rate_limiter.backend, MemoryBackend):
+    metrics.GaugeCallback("giftly_rate_limit_buckets", "Token buckets held in memory", (),
+                          lambda: {(): rate_limiter.backend.stats()["buckets"]})
@@ -0,0 +1,503 @@
+from fastapi import WebSocket
+from typing import Dict, Set, Tuple, Optional
+from collections import OrderedDict, deque
+import asyncio
+import enum
+import logging
+import threading
+import time
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# Event types accepted on /ws/chat/{conversation_id}.
+# Persisted events are written to the messages table; ephemeral events are
+# only fanned out to the other participants and never touch the database.
+PERSISTED_EVENTS = {"message", "invoice"}
+
+# Ephemeral event type -> coalescing group. Events in the same group replace
+# each other while waiting for the rate limit window (latest state wins).
+EPHEMERAL_EVENTS = {
+    "typing_started": "typing",
+    "typing_stopped": "typing",
+    "courier_on_the_way": "courier_on_the_way",
+}
+
+# Liveness frames. The server sends "ping" on every heartbeat and expects a
+# "pong" back; clients may also send "ping" and get a "pong" reply.
+CONTROL_EVENTS = {"ping", "pong"}
+
+# Groups that describe a state rather than a ping; repeating the state that
+# was last sent is dropped instead of being broadcast again.
+STATEFUL_EPHEMERAL_GROUPS = {"typing"}
+
+
+def parse_event_type(data: dict) -> Optional[str]:
+    """Return the event type of an inbound frame, or None if it should be ignored.
+
+    Frames without a "type" key are treated as chat messages so older clients
+    that only send {"content": ...} keep working.
+    """
+    event_type = data.get("type")
+    if event_type is None:
+        if "content" not in data:
+            return None
+        return "invoice" if data.get("message_type") == "invoice" else "message"
+    if event_type in PERSISTED_EVENTS:
+        if "content" not in data:
+            return None
+        return event_type
+    if event_type in EPHEMERAL_EVENTS or event_type in CONTROL_EVENTS:
+        return event_type
+    return None
+
+
+def serialize_message(message) -> dict:
+    """Wire format of a persisted chat message, shared by broadcast and replay"""
+    return {
+        "type": "message",
+        "id": message.id,
+        "conversation_id": message.conversation_id,
+        "sender_id": message.sender_id,
+        "content": message.content,
+        "message_type": message.message_type,
+        "sent_at": message.sent_at.isoformat(),
+        "invoice_description": message.invoice_description,
+        "invoice_gift_price": message.invoice_gift_price,
+        "invoice_service_fee": message.invoice_service_fee,
+        "invoice_delivery_fee": message.invoice_delivery_fee,
+        "invoice_total": message.invoice_total
+    }
+
+
+class SocketState:
+    __slots__ = ("conversation_id", "user_id", "connected_at", "last_seen")
+
+    def __init__(self, conversation_id: int, user_id: int):
+        self.conversation_id = conversation_id
+        self.user_id = user_id
+        self.connected_at = time.monotonic()
+        self.last_seen = self.connected_at
+
+
+class ConnectionManager:
+    def __init__(
+        self,
+        ephemeral_interval: float = 0.5,
+        heartbeat_interval: float = 25,
+        idle_timeout: float = 75,
+        max_sockets_per_user: int = 5,
+        max_sockets_per_conversation: int = 10
+    ):
+        # conversation_id -> set of websockets
+        self.active_connections: Dict[int, Set[WebSocket]] = {}
+        # websocket -> owner and liveness bookkeeping
+        self.sockets: Dict[WebSocket, SocketState] = {}
+        # user_id -> websockets in connection order (oldest first)
+        self.user_connections: Dict[int, Dict[WebSocket, None]] = {}
+        self.heartbeat_interval = heartbeat_interval
+        self.idle_timeout = idle_timeout
+        self.max_sockets_per_user = max_sockets_per_user
+        self.max_sockets_per_conversation = max_sockets_per_conversation
+        self.counters = {
+            "connections_opened": 0,
+            "frames_received": 0,
+            "frames_sent": 0,
+            "messages_persisted": 0,
+            "ephemeral_sent": 0,
+            "heartbeats_sent": 0,
+            "evicted_idle": 0,
+            "evicted_user_limit": 0,
+            "rejected_conversation_limit": 0,
+        }
+        self._sweeper: Optional[asyncio.Task] = None
+        # Minimum seconds between two ephemeral events of the same group from the same user
+        self.ephemeral_interval = ephemeral_interval
+        # (conversation_id, user_id, group) -> monotonic time of the last event sent
+        self._ephemeral_sent_at: Dict[Tuple[int, int, str], float] = {}
+        # (conversation_id, user_id, group) -> last event sent, used to drop repeats
+        self._ephemeral_last: Dict[Tuple[int, int, str], dict] = {}
+        # (conversation_id, user_id, group) -> (event, exclude_websocket) waiting for the window to close
+        self._ephemeral_pending: Dict[Tuple[int, int, str], Tuple[dict, Optional[WebSocket]]] = {}
+        # Running flushes, referenced until done so they aren't garbage collected
+        self._ephemeral_tasks: Set[asyncio.Task] = set()
+
+    async def connect(self, websocket: WebSocket, conversation_id: int, user_id: int) -> bool:
+        """
+        Accept and register a socket. Returns False if the conversation is
+        already at its socket limit. When the user is at their limit, their
+        oldest socket (most likely a half-open one left by a reconnect) is
+        closed to make room.
+        """
+        if len(self.active_connections.get(conversation_id, ())) >= self.max_sockets_per_conversation:
+            self.counters["rejected_conversation_limit"] += 1
+            await websocket.close(code=1008, reason="Too many connections to this conversation")
+            return False
+
+        user_sockets = self.user_connections.get(user_id, {})
+        while len(user_sockets) >= self.max_sockets_per_user:
+            oldest = next(iter(user_sockets))
+            self.counters["evicted_user_limit"] += 1
+            await self._evict(oldest, code=1008, reason="Replaced by a newer connection")
+
+        await websocket.accept()
+        if conversation_id not in self.active_connections:
+            self.active_connections[conversation_id] = set()
+        self.active_connections[conversation_id].add(websocket)
+        self.sockets[websocket] = SocketState(conversation_id, user_id)
+        self.user_connections.setdefault(user_id, {})[websocket] = None
+        self.counters["connections_opened"] += 1
+        return True
+
+    def disconnect(self, websocket: WebSocket, conversation_id: int):
+        state = self.sockets.pop(websocket, None)
+        if state is not None:
+            user_sockets = self.user_connections.get(state.user_id)
+            if user_sockets is not None:
+                user_sockets.pop(websocket, None)
+                if not user_sockets:
+                    del self.user_connections[state.user_id]
+        if conversation_id in self.active_connections:
+            self.active_connections[conversation_id].discard(websocket)
+            if not self.active_connections[conversation_id]:
+                del self.active_connections[conversation_id]
+                self._forget_ephemeral(conversation_id)
+
+    def touch(self, websocket: WebSocket):
+        """Record that a frame was received on the socket"""
+        self.counters["frames_received"] += 1
+        state = self.sockets.get(websocket)
+        if state is not None:
+            state.last_seen = time.monotonic()
+
+    async def broadcast_to_conversation(self, message: dict, conversation_id: int, exclude_websocket: WebSocket = None):
+        if conversation_id in self.active_connections:
+            # Iterate over a copy, failed sockets are removed while sending
+            for connection in list(self.active_connections[conversation_id]):
+                if connection != exclude_websocket:
+                    try:
+                        await connection.send_json(message)
+                        self.counters["frames_sent"] += 1
+                    except:
+                        # Connection might be closed, remove it
+                        self.disconnect(connection, conversation_id)
+
+    async def _evict(self, websocket: WebSocket, code: int, reason: str):
+        state = self.sockets.get(websocket)
+        if state is None:
+            return
+        self.disconnect(websocket, state.conversation_id)
+        try:
+            await websocket.close(code=code, reason=reason)
+        except:
+            pass
+
+    async def sweep(self):
+        """Ping quiet sockets and evict the ones that missed heartbeats past the idle timeout"""
+        now = time.monotonic()
+        for websocket, state in list(self.sockets.items()):
+            idle = now - state.last_seen
+            if idle > self.idle_timeout:
+                self.counters["evicted_idle"] += 1
+                await self._evict(websocket, code=1001, reason="Idle timeout")
+            elif idle >= self.heartbeat_interval:
+                try:
+                    await websocket.send_json({"type": "ping"})
+                    self.counters["heartbeats_sent"] += 1
+                except:
+                    self.disconnect(websocket, state.conversation_id)
+
+    async def _sweep_forever(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.exception("WebSocket sweeper error: %s", e)
+
+    def start_sweeper(self):
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.get_running_loop().create_task(self._sweep_forever())
+
+    async def stop_sweeper(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            try:
+                await self._sweeper
+            except asyncio.CancelledError:
+                pass
+            self._sweeper = None
+
+    def stats(self) -> dict:
+        """Live connection gauges plus eviction counters"""
+        return {
+            "connections": len(self.sockets),
+            "conversations": len(self.active_connections),
+            "users": len(self.user_connections),
+            "pending_ephemeral": len(self._ephemeral_pending),
+            **self.counters,
+        }
+
+    async def broadcast_ephemeral(self, event: dict, conversation_id: int, user_id: int, exclude_websocket: WebSocket = None):
+        """
+        Fan out an ephemeral event (typing, presence) without persisting it.
+        Each user gets at most one event per group every `ephemeral_interval`
+        seconds; events arriving inside the window are coalesced into the
+        latest one, which is sent when the window closes.
+        """
+        key = (conversation_id, user_id, EPHEMERAL_EVENTS[event["type"]])
+
+        if key in self._ephemeral_pending:
+            # A flush is already scheduled for this window, newest event wins
+            self._ephemeral_pending[key] = (event, exclude_websocket)
+            return
+
+        wait = self._ephemeral_sent_at.get(key, float("-inf")) + self.ephemeral_interval - time.monotonic()
+        if wait <= 0:
+            await self._send_ephemeral(key, event, exclude_websocket)
+            return
+
+        self._ephemeral_pending[key] = (event, exclude_websocket)
+        asyncio.get_running_loop().call_later(wait, self._start_flush, key)
+
+    def _start_flush(self, key: Tuple[int, int, str]):
+        task = asyncio.get_running_loop().create_task(self._flush_ephemeral(key))
+        self._ephemeral_tasks.add(task)
+        task.add_done_callback(self._ephemeral_tasks.discard)
+
+    async def _flush_ephemeral(self, key: Tuple[int, int, str]):
+        pending = self._ephemeral_pending.pop(key, None)
+        if pending is None:
+            return
+        event, exclude_websocket = pending
+        await self._send_ephemeral(key, event, exclude_websocket)
+
+    async def _send_ephemeral(self, key: Tuple[int, int, str], event: dict, exclude_websocket: Optional[WebSocket]):
+        # Coalesced windows often end on the same state that was already sent
+        # (e.g. typing_started -> typing_stopped -> typing_started)
+        if key[2] in STATEFUL_EPHEMERAL_GROUPS and self._ephemeral_last.get(key) == event:
+            return
+        self._ephemeral_sent_at[key] = time.monotonic()
+        self._ephemeral_last[key] = event
+        self.counters["ephemeral_sent"] += 1
+        await self.broadcast_to_conversation(event, key[0], exclude_websocket)
+
+    def _forget_ephemeral(self, conversation_id: int):
+        for state in (self._ephemeral_sent_at, self._ephemeral_last, self._ephemeral_pending):
+            for key in [key for key in state if key[0] == conversation_id]:
+                del state[key]
+
+
+class ParticipantCache:
+    """
+    Caches (customer_id, courier_id) per conversation so socket connects and
+    reconnects can authorize without a database round trip. Participants of a
+    conversation never change, the TTL only bounds staleness after admin edits.
+    """
+
+    def __init__(self, ttl: float = 300, max_size: int = 10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries: "OrderedDict[int, Tuple[float, Tuple[int, int]]]" = OrderedDict()
+
+    def get(self, conversation_id: int) -> Optional[Tuple[int, int]]:
+        entry = self._entries.get(conversation_id)
+        if entry is None:
+            return None
+        expires_at, participants = entry
+        if time.monotonic() > expires_at:
+            del self._entries[conversation_id]
+            return None
+        self._entries.move_to_end(conversation_id)
+        return participants
+
+    def set(self, conversation_id: int, customer_id: int, courier_id: int):
+        self._entries[conversation_id] = (time.monotonic() + self.ttl, (customer_id, courier_id))
+        self._entries.move_to_end(conversation_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+
+class MessageBuffer:
+    """
+    Bounded in-memory ring buffer of the most recent messages per conversation,
+    used to replay what a reconnecting client missed without a database query.
+
+    A conversation's buffer holds every message written through this process
+    since the buffer was created. That is every message of the conversation
+    only when this is the sole worker: other workers' messages never reach it,
+    and message ids are shared by all conversations, so a missing one can't be
+    told from a gap in the ids. With `complete` off (several workers) the
+    buffer stays empty and every replay reads the database.
+    Like ConnectionManager, it is per process. Also written to from sync
+    handlers running in the threadpool, hence the lock.
+    """
+
+    def __init__(self, size: int = 100, max_conversations: int = 5000, complete: bool = True):
+        self.size = size
+        self.max_conversations = max_conversations
+        self.complete = complete
+        self._buffers: "OrderedDict[int, deque]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {"replays_from_buffer": 0, "replays_from_db": 0}
+
+    def append(self, conversation_id: int, message: dict):
+        if not self.complete:
+            return
+        with self._lock:
+            buffer = self._buffers.get(conversation_id)
+            if buffer is None:
+                buffer = self._buffers[conversation_id] = deque(maxlen=self.size)
+                while len(self._buffers) > self.max_conversations:
+                    self._buffers.popitem(last=False)
+            else:
+                self._buffers.move_to_end(conversation_id)
+            buffer.append(message)
+
+    def prime(self, conversation_id: int, messages: list):
+        """Seed an absent buffer with the complete tail of a conversation (e.g. read after a restart)"""
+        if not messages or not self.complete:
+            return
+        with self._lock:
+            if conversation_id in self._buffers:
+                return
+            self._buffers[conversation_id] = deque(messages, maxlen=self.size)
+            while len(self._buffers) > self.max_conversations:
+                self._buffers.popitem(last=False)
+
+    def since(self, conversation_id: int, last_seen_message_id: int) -> Optional[list]:
+        """Messages after `last_seen_message_id`, or None if the buffer can't cover the gap"""
+        with self._lock:
+            buffer = self._buffers.get(conversation_id)
+            if not buffer or buffer[0]["id"] > last_seen_message_id:
+                self.counters["replays_from_db"] += 1
+                return None
+            self.counters["replays_from_buffer"] += 1
+            return [message for message in buffer if message["id"] > last_seen_message_id]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "buffered_conversations": len(self._buffers),
+                "buffered_messages": sum(len(buffer) for buffer in self._buffers.values()),
+                **self.counters,
+            }
+
+
+class UserEventHub:
+    """
+    Per-user push channel for order and invoice status changes, read by the
+    GET /orders/events Server-Sent Events stream. `publish` may be called from
+    sync handlers in the threadpool; delivery always happens on the event loop.
+
+    Like ConnectionManager it is per process, so clients fetch GET /orders/
+    once whenever their stream (re)connects to pick up anything published on
+    another worker or while they were away. A stream that falls more than
+    `queue_size` events behind gets a single "resync" event instead.
+    """
+
+    def __init__(self, queue_size: int = 100, max_streams_per_user: int = 5):
+        self.queue_size = queue_size
+        self.max_streams_per_user = max_streams_per_user
+        self._streams: Dict[int, Set[asyncio.Queue]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.counters = {"published": 0, "delivered": 0, "resyncs": 0, "rejected_streams": 0}
+
+    def subscribe(self, user_id: int) -> Optional[asyncio.Queue]:
+        """Open a stream for `user_id`, or None if the user is at the stream limit"""
+        self._loop = asyncio.get_running_loop()
+        streams = self._streams.setdefault(user_id, set())
+        if len(streams) >= self.max_streams_per_user:
+            self.counters["rejected_streams"] += 1
+            return None
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        streams.add(queue)
+        return queue
+
+    def unsubscribe(self, user_id: int, queue: asyncio.Queue):
+        streams = self._streams.get(user_id)
+        if streams is None:
+            return
+        streams.discard(queue)
+        if not streams:
+            del self._streams[user_id]
+
+    def publish(self, user_ids, event: dict):
+        loop = self._loop
+        if loop is None:
+            # Nobody ever subscribed in this process
+            return
+        self.counters["published"] += 1
+        try:
+            on_loop = asyncio.get_running_loop() is loop
+        except RuntimeError:
+            on_loop = False
+        if on_loop:
+            self._deliver(user_ids, event)
+        else:
+            loop.call_soon_threadsafe(self._deliver, user_ids, event)
+
+    def _deliver(self, user_ids, event: dict):
+        for user_id in set(user_id for user_id in user_ids if user_id is not None):
+            for queue in self._streams.get(user_id, ()):
+                try:
+                    queue.put_nowait(event)
+                    self.counters["delivered"] += 1
+                except asyncio.QueueFull:
+                    # The client missed events, have it re-fetch instead
+                    while not queue.empty():
+                        queue.get_nowait()
+                    queue.put_nowait({"type": "resync"})
+                    self.counters["resyncs"] += 1
+
+    def stats(self) -> dict:
+        return {
+            "event_streams": sum(len(streams) for streams in self._streams.values()),
+            "event_stream_users": len(self._streams),
+            **self.counters,
+        }
+
+
+def _value(value):
+    return value.value if isinstance(value, enum.Enum) else value
+
+
+def order_status_event(order) -> dict:
+    """Event for an order (ORM object or response dict) whose status changed"""
+    get = order.get if isinstance(order, dict) else lambda name: getattr(order, name)
+    updated_at = get("updated_at")
+    return {
+        "type": "order_status",
+        "id": get("id"),
+        "order_id": get("order_id"),
+        "status": _value(get("status")),
+        "version": get("version"),
+        "assigned_to_user_id": get("assigned_to_user_id"),
+        "updated_at": updated_at.isoformat() if updated_at else None,
+    }
+
+
+def invoice_status_event(invoice) -> dict:
+    return {
+        "type": "invoice_status",
+        "id": invoice.id,
+        "invoice_id": invoice.invoice_id,
+        "order_id": invoice.order_id,
+        "status": _value(invoice.status),
+    }
+
+
+manager = ConnectionManager(
+    ephemeral_interval=settings.ws_ephemeral_interval_seconds,
+    heartbeat_interval=settings.ws_heartbeat_interval_seconds,
+    idle_timeout=settings.ws_idle_timeout_seconds,
+    max_sockets_per_user=settings.ws_max_sockets_per_user,
+    max_sockets_per_conversation=settings.ws_max_sockets_per_conversation
+)
+participant_cache = ParticipantCache(ttl=settings.ws_participant_cache_ttl_seconds)
+message_buffer = MessageBuffer(
+    size=settings.ws_replay_buffer_size,
+    max_conversations=settings.ws_replay_buffer_conversations,
+    complete=settings.web_concurrency == 1,
+)
+order_events = UserEventHub(queue_size=settings.sse_queue_size, max_streams_per_user=settings.sse_max_streams_per_user)
@@ -0,0 +1,221 @@
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+import asyncio
+import logging
+import threading
+import time
+from sqlalchemy import Select, and_, delete, exists, or_, select
+from sqlalchemy.orm import Session
+from config import settings
+from database import SessionLocal, advisory_lock
+from executors import run_db
+from models import User, Order, Invoice, JWTToken, Conversation, Message, MessageArchive, OrderStatus
+from search import message_index, order_index
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Retention: rows matching a policy and older than its `days` are deleted a
+# batch at a time, children before parents (invoices before their order,
+# messages before their conversation), each batch in its own short
+# transaction. Between batches the job sleeps at least as long as the batch
+# took, so it never holds the database more than half the time. A run that
+# stops halfway leaves consistent data and the next run picks up the rest.
+
+RETENTION_DELETED = metrics.Counter("giftly_retention_deleted_total", "Rows deleted by retention policies", ("policy", "table"))
+# Postgres advisory lock key held for a run, so only one worker purges at a time
+_ADVISORY_LOCK_KEY = 0x67696674
+# Seconds between startup and the first run, leaving the boot to warm-up
+_FIRST_RUN_DELAY_SECONDS = 60
+
+RETENTION_BATCH_SECONDS = metrics.Histogram("giftly_retention_batch_seconds", "Time per retention delete batch", ("policy",),
+                                            buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5))
+
+
+def _delete_invoices(db: Session, order_ids: List[int]) -> Dict[str, int]:
+    order_index.remove(db.connection(), order_ids)
+    result = db.execute(delete(Invoice).where(Invoice.order_id.in_(order_ids)))
+    return {"invoices": result.rowcount}
+
+
+def _delete_messages(db: Session, conversations: Select, pace: Callable) -> Dict[str, int]:
+    """
+    Messages of the conversations, hot and archived, in committed chunks.
+    `conversations` is re-run for every chunk, so a conversation that stops
+    matching its policy halfway keeps the rest of its messages.
+    """
+    counts = {"messages": 0, "messages_archive": 0}
+    for model, name in ((Message, "messages"), (MessageArchive, "messages_archive")):
+        while True:
+            ids = db.execute(
+                select(model.id).where(model.conversation_id.in_(conversations)).limit(settings.retention_batch_size)
+            ).scalars().all()
+            if not ids:
+                break
+            message_index.remove(db.connection(), ids)
+            counts[name] += db.execute(delete(model).where(model.id.in_(ids))).rowcount
+            db.commit()
+            pace()
+    return counts
+
+
+class RetentionPolicy:
+    """
+    Rows of `model` matching `condition(cutoff)`. `children` deletes what
+    references a batch before the batch itself. It gets the batch's ids,
+    locked until the batch is deleted, or when `paced_children` is set, a
+    select of the batch rows still matching, as it commits and paces itself
+    between chunks of its many children.
+    """
+
+    def __init__(self, name: str, model, condition: Callable, children: Optional[Callable] = None, paced_children: bool = False):
+        self.name = name
+        self.model = model
+        self.condition = condition
+        self.children = children
+        self.paced_children = paced_children
+
+
+POLICIES = {
+    policy.name: policy for policy in (
+        RetentionPolicy(
+            "cancelled_orders", Order,
+            lambda cutoff: and_(Order.status == OrderStatus.CANCELLED, Order.updated_at < cutoff),
+            children=_delete_invoices,
+        ),
+        RetentionPolicy(
+            "closed_conversations", Conversation,
+            # Closed, and nothing was said in it since the cutoff
+            lambda cutoff: and_(
+                Conversation.status == "closed",
+                Conversation.created_at < cutoff,
+                ~exists().where(Message.conversation_id == Conversation.id, Message.sent_at >= cutoff),
+            ),
+            children=_delete_messages, paced_children=True,
+        ),
+        RetentionPolicy(
+            "revoked_tokens", JWTToken,
+            lambda cutoff: and_(
+                JWTToken.created_at < cutoff,
+                or_(JWTToken.is_revoked == True, JWTToken.refresh_token_expires_at < cutoff),
+            ),
+        ),
+        RetentionPolicy(
+            "otp_placeholder_users", User,
+            # Created by /auth/send-otp for a number that never completed verification
+            lambda cutoff: and_(
+                User.is_verified == False,
+                User.is_admin == False,
+                User.name.is_(None),
+                User.otp_created_at < cutoff,
+                ~exists().where(Order.created_by_user_id == User.id),
+                ~exists().where(Order.assigned_to_user_id == User.id),
+                ~exists().where(or_(Conversation.customer_id == User.id, Conversation.courier_id == User.id)),
+                ~exists().where(JWTToken.user_id == User.id),
+            ),
+        ),
+    )
+}
+
+
+class RetentionJob:
+    """Runs the configured policies and keeps per-policy progress for /admin/retention"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.progress: Dict[str, dict] = {}
+
+    def _pace(self, elapsed: float):
+        time.sleep(max(settings.retention_pause_seconds, elapsed))
+
+    def run_policy(self, policy: RetentionPolicy, days: float, dry_run: bool = False) -> dict:
+        cutoff = datetime.utcnow() - timedelta(days=days)
+        state = {"running": True, "dry_run": dry_run, "cutoff": cutoff.isoformat(), "started_at": datetime.utcnow().isoformat(),
+                 "batches": 0, "matched": 0, "deleted": {}}
+        with self._lock:
+            self.progress[policy.name] = state
+        key = policy.model.id
+        last_id = 0
+        try:
+            with SessionLocal() as db:
+                while True:
+                    started = time.perf_counter()
+                    # Walk the primary key so a dry run, which deletes nothing, still moves forward
+                    ids = db.execute(
+                        select(key).where(key > last_id, policy.condition(cutoff)).order_by(key).limit(settings.retention_batch_size)
+                    ).scalars().all()
+                    if not ids:
+                        break
+                    last_id = ids[-1]
+                    state["matched"] += len(ids)
+                    state["batches"] += 1
+                    if not dry_run:
+                        counts = {}
+                        parents = select(key).where(key.in_(ids), policy.condition(cutoff))
+                        if policy.children is not None:
+                            if policy.paced_children:
+                                counts = policy.children(db, parents, lambda: self._pace(0))
+                            else:
+                                # Only rows that still match, locked so the delete below removes exactly these
+                                counts = policy.children(db, db.execute(parents.with_for_update()).scalars().all())
+                        # Re-check the condition, rows may have changed since they were selected
+                        counts[policy.model.__tablename__] = db.execute(
+                            delete(policy.model).where(key.in_(ids), policy.condition(cutoff)),
+                            execution_options={"synchronize_session": False},
+                        ).rowcount
+                        db.commit()
+                        for table, count in counts.items():
+                            state["deleted"][table] = state["deleted"].get(table, 0) + count
+                            RETENTION_DELETED.inc(policy.name, table, amount=count)
+                    elapsed = time.perf_counter() - started
+                    RETENTION_BATCH_SECONDS.observe(elapsed, policy.name)
+                    self._pace(elapsed)
+        finally:
+            state["running"] = False
+            state["finished_at"] = datetime.utcnow().isoformat()
+        logger.info("Retention %s%s: %d matched, deleted %s", policy.name, " (dry run)" if dry_run else "", state["matched"], state["deleted"],
+                    extra={"event": "retention.run", "policy": policy.name, "dry_run": dry_run, "matched": state["matched"]})
+        return state
+
+    def run(self, names: Optional[List[str]] = None, dry_run: bool = False) -> Dict[str, dict]:
+        with advisory_lock(_ADVISORY_LOCK_KEY) as acquired:
+            if not acquired:
+                logger.info("Retention already running in another worker", extra={"event": "retention.skipped"})
+                return {}
+            results = {}
+            for name, policy_settings in settings.retention_policies.items():
+                if names and name not in names:
+                    continue
+                policy = POLICIES.get(name)
+                days = policy_settings.get("days", 0)
+                if policy is None or days <= 0:
+                    continue
+                results[name] = self.run_policy(policy, days, dry_run)
+            return results
+
+    def stats(self) -> Dict[str, dict]:
+        with self._lock:
+            return {name: dict(state) for name, state in self.progress.items()}
+
+
+retention_job = RetentionJob()
+
+
+async def retention_loop():
+    await asyncio.sleep(_FIRST_RUN_DELAY_SECONDS)
+    while True:
+        try:
+            await run_db(retention_job.run, None, settings.retention_dry_run)
+        except Exception:
+            logger.exception("Retention run failed", extra={"event": "retention.failed"})
+        await asyncio.sleep(settings.retention_interval_seconds)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Apply the retention policies from settings.retention_policies once")
+    parser.add_argument("--policy", action="append", choices=sorted(POLICIES), help="only this policy, repeatable")
+    parser.add_argument("--dry-run", action="store_true", help="count what would be deleted, delete nothing")
+    args = parser.parse_args()
+    for name, result in retention_job.run(args.policy, args.dry_run).items():
+        print(f"{name}: matched {result['matched']}, deleted {result['deleted']}")
@@ -1,9 +1,20 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Form
+from fastapi import APIRouter, Depends, HTTPException, status, Form, Query
 from sqlalchemy.orm import Session
-from database import get_db, get_db_sync
-from models import User
+from database import get_db, get_db_sync, get_db_read
+from models import User, OrderStatus, InvoiceStatus
+from schemas import BulkOrderStatusRequest, BulkOrderAssignRequest, BulkOrderCancelRequest, BulkInvoiceStatusRequest, BulkActionResult
 from auth import get_password_hash, verify_password
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
+from realtime import manager, message_buffer
+from sql_profiler import slow_queries
+from executors import cpu_executor
+import executors
+import admission
+import search
+import bulk
+from retention import retention_job
+from serialization import FastJSONResponse
+from config import settings
 import secrets
 
 router = APIRouter()
@@ -18,7 +29,7 @@ def authenticate_admin(credentials: HTTPBasicCredentials = Depends(security), db
             detail="Invalid credentials",
             headers={"WWW-Authenticate": "Basic"},
         )
-    if not verify_password(credentials.password, user.admin_password_hash):
+    if not cpu_executor.run_sync(verify_password, credentials.password, user.admin_password_hash):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid credentials",
@@ -34,7 +45,7 @@ def create_admin_user(username: str = Form(...), password: str = Form(...), db:
         raise HTTPException(status_code=400, detail="Admin user already exists")
 
     # Create admin user
-    hashed_password = get_password_hash(password)
+    hashed_password = cpu_executor.run_sync(get_password_hash, password)
     admin_user = User(
         phone_number=f"admin_{username}",  # dummy phone number
         name=f"Admin {username}",
@@ -55,4 +66,66 @@ def get_admin_info(current_admin: User = Depends(authenticate_admin)):
         "username": current_admin.admin_username,
         "name": current_admin.name,
         "is_admin": current_admin.is_admin
-    }
\ No newline at end of file
+    }
+
+@router.get("/ws-stats")
+def get_websocket_stats(current_admin: User = Depends(authenticate_admin)):
+    """Live chat socket gauges, eviction counters and replay buffer usage for this worker"""
+    return {**manager.stats(), **message_buffer.stats()}
+
+@router.get("/slow-queries")
+def get_slow_queries(limit: int = 20, current_admin: User = Depends(authenticate_admin)):
+    """Slowest statement shapes seen by this worker within the rolling window"""
+    return {
+        "threshold_ms": settings.sql_slow_query_ms,
+        "window_seconds": settings.sql_slow_query_window_seconds,
+        "queries": slow_queries.top(min(max(limit, 1), 100)),
+    }
+
+@router.get("/admission")
+def get_admission_stats(current_admin: User = Depends(authenticate_admin)):
+    """In-flight, queued and shed request counts per route class for this worker"""
+    return admission.stats()
+
+@router.get("/executors")
+async def get_executor_stats(current_admin: User = Depends(authenticate_admin)):
+    """Capacity, busy and queued work of the cpu process pool and the db thread pool"""
+    return executors.stats()
+
+@router.get("/search/messages")
+def search_messages(q: str = Query(..., min_length=1, max_length=200), limit: int = Query(20, ge=1, le=100), offset: int = Query(0, ge=0),
+                    current_admin: User = Depends(authenticate_admin), db: Session = Depends(get_db_read)):
+    """Chat messages (archived ones included) matching every word of `q`, best match first"""
+    return FastJSONResponse({"query": q, "results": search.search_messages(db, q, limit, offset)})
+
+@router.get("/search/orders")
+def search_orders(q: str = Query(..., min_length=1, max_length=200), limit: int = Query(20, ge=1, le=100), offset: int = Query(0, ge=0),
+                  current_admin: User = Depends(authenticate_admin), db: Session = Depends(get_db_read)):
+    """Orders whose description matches every word of `q`, best match first"""
+    return FastJSONResponse({"query": q, "results": search.search_orders(db, q, limit, offset)})
+
+@router.post("/bulk/orders/status", response_model=BulkActionResult)
+def bulk_order_status(request: BulkOrderStatusRequest, current_admin: User = Depends(authenticate_admin), db: Session = Depends(get_db_sync)):
+    """Move many orders to one status in a single UPDATE, where the transition is allowed. Use /assign and /cancel for those statuses"""
+    return bulk.change_order_status(db, request.ids, OrderStatus(request.status.value), current_admin)
+
+@router.post("/bulk/orders/assign", response_model=BulkActionResult)
+def bulk_order_assign(request: BulkOrderAssignRequest, current_admin: User = Depends(authenticate_admin), db: Session = Depends(get_db_sync)):
+    """Assign many orders to one courier in a single UPDATE"""
+    return bulk.assign_orders(db, request.ids, request.assigned_to_user_id, current_admin)
+
+@router.post("/bulk/orders/cancel", response_model=BulkActionResult)
+def bulk_order_cancel(request: BulkOrderCancelRequest, current_admin: User = Depends(authenticate_admin), db: Session = Depends(get_db_sync)):
+    """Cancel many orders in a single UPDATE, skipping those with a paid invoice"""
+    return bulk.cancel_orders(db, request.ids, request.reason, current_admin)
+
+@router.post("/bulk/invoices/status", response_model=BulkActionResult)
+def bulk_invoice_status(request: BulkInvoiceStatusRequest, current_admin: User = Depends(authenticate_admin), db: Session = Depends(get_db_sync)):
+    """Mark many invoices paid or refunded (or another allowed status) in a single UPDATE"""
+    return bulk.change_invoice_status(db, request.ids, InvoiceStatus(request.status.value), current_admin)
+
+@router.get("/retention")
+def get_retention_progress(current_admin: User = Depends(authenticate_admin)):
+    """Progress of the latest retention run per policy in this worker"""
+    return {"enabled": settings.retention_enabled, "dry_run": settings.retention_dry_run,
+            "policies": settings.retention_policies, "runs": retention_job.stats()}
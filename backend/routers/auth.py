@@ -1,23 +1,28 @@
 import re
 from datetime import datetime, timedelta, date
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from database import get_db, get_db_sync
 from models import User, City
 from schemas import SendOTP, OTPVerify, Token, UpdateUserProfile, RefreshTokenRequest
-from auth import authenticate_user, create_access_token, create_refresh_token, create_jwt_tokens, create_jwt_tokens_async, revoke_user_tokens, generate_otp, get_user_by_phone, get_current_user, get_user_from_refresh_token
+from auth import authenticate_user, create_access_token, create_refresh_token, create_jwt_tokens, create_jwt_tokens_async, revoke_user_tokens, generate_otp, get_user_by_phone, get_user_by_phone_sync, get_current_user, get_user_from_refresh_token
 from config import settings
+from rate_limit import rate_limiter, rate_limit
+import logging
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
 @router.post("/send-otp", response_model=dict)
-async def send_otp(otp_request: SendOTP, db: AsyncSession = Depends(get_db)):
+async def send_otp(otp_request: SendOTP, request: Request, db: AsyncSession = Depends(get_db)):
     phone_number = otp_request.phone_number
+    await rate_limiter.check("send_otp", request, phone_number=phone_number)
     user = await get_user_by_phone(db, phone_number)
 
     otp = generate_otp()
-    print(f"OTP for {phone_number}: {otp}")  # Log the OTP
+    logger.info("OTP sent", extra={"event": "auth.otp_sent", "phone_number": phone_number})
 
     if user:
         # Invalidate previous OTP
@@ -37,25 +42,26 @@ async def send_otp(otp_request: SendOTP, db: AsyncSession = Depends(get_db)):
     return {"message": "OTP sent successfully", "otp": otp}
 
 @router.post("/verify-otp", response_model=Token)
-async def verify_otp(otp_data: OTPVerify, db: AsyncSession = Depends(get_db)):
+async def verify_otp(otp_data: OTPVerify, request: Request, db: AsyncSession = Depends(get_db)):
     from datetime import datetime, timedelta
+    await rate_limiter.check("verify_otp", request, phone_number=otp_data.phone_number)
 
     user = await get_user_by_phone(db, otp_data.phone_number)
     if not user:
-        print(f"Error: User not found for phone {otp_data.phone_number}")
+        logger.info("OTP rejected: user not found", extra={"event": "auth.otp_rejected", "phone_number": otp_data.phone_number})
         raise HTTPException(status_code=400, detail="User not found")
 
     if not user.otp:
-        print(f"Error: No OTP found for user {otp_data.phone_number}")
+        logger.info("OTP rejected: no OTP issued", extra={"event": "auth.otp_rejected", "phone_number": otp_data.phone_number})
         raise HTTPException(status_code=400, detail="No OTP found")
 
     # Check if OTP is expired (90 seconds)
     if user.otp_created_at and datetime.utcnow() - user.otp_created_at > timedelta(seconds=90):
-        print(f"Error: OTP expired for user {otp_data.phone_number}. Expected {user.otp}, got {otp_data.otp}")
+        logger.info("OTP rejected: expired", extra={"event": "auth.otp_rejected", "phone_number": otp_data.phone_number})
         raise HTTPException(status_code=400, detail=f"OTP expired. Expected {user.otp}, got {otp_data.otp}")
 
     if user.otp != otp_data.otp:
-        print(f"Error: Invalid OTP for user {otp_data.phone_number}. Expected {user.otp}, got {otp_data.otp}")
+        logger.info("OTP rejected: mismatch", extra={"event": "auth.otp_rejected", "phone_number": otp_data.phone_number})
         raise HTTPException(status_code=400, detail=f"Invalid OTP. Expected {user.otp}, got {otp_data.otp}")
 
     user.otp = None  # Clear OTP
@@ -149,7 +155,7 @@ def update_current_user(user_update: UpdateUserProfile, current_user: User = Dep
         "is_verified": current_user.is_verified
     }
 
-@router.post("/refresh", response_model=Token)
+@router.post("/refresh", response_model=Token, dependencies=[Depends(rate_limit("refresh"))])
 def refresh_access_token(refresh_request: RefreshTokenRequest, db: Session = Depends(get_db_sync)):
     user = get_user_from_refresh_token(refresh_request.refresh_token, db)
 
@@ -162,7 +168,7 @@ def refresh_access_token(refresh_request: RefreshTokenRequest, db: Session = Dep
 
     return {"access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer"}
 
-@router.post("/complete-profile", response_model=Token)
+@router.post("/complete-profile", response_model=Token, dependencies=[Depends(rate_limit("complete_profile"))])
 def complete_profile(profile_data: dict, db: Session = Depends(get_db_sync)):
     """Complete profile for new users after OTP verification"""
     # Extract data from request
@@ -1,10 +1,13 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Query
 from sqlalchemy.orm import Session
 from sqlalchemy import desc
-from database import get_db, get_db_sync
+from database import get_db, get_db_sync, get_db_read
 from models import Conversation, Message, User
 from schemas import CreateConversationRequest, ConversationResponse, SendMessageRequest, MessageResponse
 from auth import get_current_user
+from realtime import message_buffer, serialize_message
+from archive import message_page
+from serialization import FastJSONResponse, CONVERSATION_COLUMNS, CONVERSATION_FIELDS, MESSAGE_FIELDS, rows_to_dicts
 from typing import List
 
 router = APIRouter()
@@ -68,7 +71,7 @@ def get_messages(
     skip: int = Query(0, ge=0),
     limit: int = Query(50, ge=1, le=100),
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db_sync)
+    db: Session = Depends(get_db_read)
 ):
     """
     Get paginated messages for a conversation.
@@ -83,15 +86,14 @@ def get_messages(
     if current_user.id not in [conversation.customer_id, conversation.courier_id]:
         raise HTTPException(status_code=403, detail="Not authorized to access this conversation")
 
-    # Get messages with pagination, ordered by sent_at desc (newest first)
-    messages = db.query(Message).filter(
-        Message.conversation_id == conversation_id
-    ).order_by(desc(Message.sent_at)).offset(skip).limit(limit).all()
+    # Get messages with pagination, ordered by sent_at desc (newest first),
+    # older pages come from the archive
+    rows = message_page(db, conversation_id, skip, limit)
 
     # Reverse to get chronological order (oldest first)
-    messages.reverse()
+    rows.reverse()
 
-    return messages
+    return FastJSONResponse(rows_to_dicts(MESSAGE_FIELDS, rows))
 
 @router.post("/conversations/{conversation_id}/messages", response_model=MessageResponse)
 def send_message(
@@ -141,18 +143,21 @@ def send_message(
     db.commit()
     db.refresh(new_message)
 
+    # Keep the reconnect replay buffer complete for this conversation
+    message_buffer.append(conversation_id, serialize_message(new_message))
+
     return new_message
 
 @router.get("/conversations", response_model=List[ConversationResponse])
 def get_user_conversations(
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db_sync)
+    db: Session = Depends(get_db_read)
 ):
     """
     Get all conversations for the current user.
     """
-    conversations = db.query(Conversation).filter(
+    rows = db.query(*CONVERSATION_COLUMNS).filter(
         (Conversation.customer_id == current_user.id) | (Conversation.courier_id == current_user.id)
     ).order_by(desc(Conversation.created_at)).all()
 
-    return conversations
\ No newline at end of file
+    return FastJSONResponse(rows_to_dicts(CONVERSATION_FIELDS, rows))
\ No newline at end of file
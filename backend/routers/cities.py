@@ -1,13 +1,45 @@
 from fastapi import APIRouter, Depends
 from sqlalchemy.orm import Session
-from database import get_db, get_db_sync
+from typing import List, Optional
+import time
+from database import get_db, get_db_sync, get_db_read
 from models import City
 from schemas import CityResponse
+from config import settings
+from serialization import FastJSONResponse
 
 router = APIRouter()
 
+CITY_FIELDS = ("id", "name", "icon", "active")
+
+
+class CityCatalog:
+    """
+    Active cities held in memory. The list is small, read on every app launch
+    and only changed through the admin dashboard, so it is reloaded after the
+    TTL instead of being queried per request.
+    """
+
+    def __init__(self, ttl: float = 300):
+        self.ttl = ttl
+        self._cities: Optional[List[dict]] = None
+        self._expires_at = 0.0
+
+    def get(self, db: Session) -> List[dict]:
+        if self._cities is None or time.monotonic() > self._expires_at:
+            self.load(db)
+        return self._cities
+
+    def load(self, db: Session):
+        rows = db.query(City.id, City.name, City.icon, City.active).filter(City.active == True).all()
+        self._cities = [dict(zip(CITY_FIELDS, row)) for row in rows]
+        self._expires_at = time.monotonic() + self.ttl
+
+
+city_catalog = CityCatalog(ttl=settings.city_catalog_ttl_seconds)
+
+
 @router.get("/", response_model=list[CityResponse])
-def get_active_cities(db: Session = Depends(get_db_sync)):
+def get_active_cities(db: Session = Depends(get_db_read)):
     """Get all active cities. Public endpoint."""
-    cities = db.query(City).filter(City.active == True).all()
-    return cities
\ No newline at end of file
+    return FastJSONResponse(city_catalog.get(db))
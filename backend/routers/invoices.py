@@ -1,6 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks
 from sqlalchemy.orm import Session
-from database import get_db, get_db_sync
+from sqlalchemy.exc import IntegrityError
+from database import get_db, get_db_sync, get_db_read
 from models import Invoice, Order, InvoiceStatus
 from schemas import CreateInvoice, InvoiceResponse
 from auth import get_current_user
@@ -9,15 +10,14 @@ import os
 import tempfile
 import time
 from threading import Timer
-from reportlab.lib.pagesizes import letter
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
-from reportlab.lib import colors
-from reportlab.lib.units import inch
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
 from io import BytesIO
 from fastapi.responses import FileResponse
+from metrics import PDF_RENDER_SECONDS
+from executors import cpu_executor, run_db
+from realtime import order_events, invoice_status_event
+import logging
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
@@ -56,13 +56,20 @@ def create_invoice(invoice_data: CreateInvoice, db: Session = Depends(get_db_syn
     )
 
     db.add(new_invoice)
-    db.commit()
+    try:
+        db.commit()
+    except IntegrityError:
+        # Lost a race with a concurrent create for the same order
+        db.rollback()
+        raise HTTPException(status_code=400, detail="Invoice already exists for this order")
     db.refresh(new_invoice)
 
+    order_events.publish((order.created_by_user_id, order.assigned_to_user_id), invoice_status_event(new_invoice))
+
     return new_invoice
 
 @router.get("/{invoice_id}", response_model=InvoiceResponse)
-def get_invoice(invoice_id: str, db: Session = Depends(get_db_sync)):
+def get_invoice(invoice_id: str, db: Session = Depends(get_db_read)):
     """
     Get invoice by invoice_id. Public endpoint for viewing invoices.
     """
@@ -73,7 +80,7 @@ def get_invoice(invoice_id: str, db: Session = Depends(get_db_sync)):
     return invoice
 
 @router.get("/id/{invoice_db_id}", response_model=InvoiceResponse)
-def get_invoice_by_id(invoice_db_id: int, current_user=Depends(get_current_user), db: Session = Depends(get_db_sync)):
+def get_invoice_by_id(invoice_db_id: int, current_user=Depends(get_current_user), db: Session = Depends(get_db_read)):
     """
     Get invoice by database ID. Authenticated users can view their own invoices.
     """
@@ -95,13 +102,23 @@ def delete_file_after_delay(file_path: str, delay_seconds: int = 600):  # 10 min
             if os.path.exists(file_path):
                 os.remove(file_path)
         except Exception as e:
-            print(f"Error deleting file {file_path}: {e}")
+            logger.warning("Error deleting file %s: %s", file_path, e)
 
     timer = Timer(delay_seconds, delete_file)
+    # Must not keep the process alive on shutdown, tempdir cleanup catches leftovers
+    timer.daemon = True
     timer.start()
 
 def generate_invoice_pdf(invoice: InvoiceResponse, order: Order = None) -> BytesIO:
     """Generate PDF invoice with proper Arabic text"""
+    # reportlab is imported on first use, keeping it off the worker boot path.
+    # Runs in the cpu process pool, see render_invoice_pdf
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+    from reportlab.lib import colors
+    from reportlab.lib.units import inch
+
     buffer = BytesIO()
 
     # Create the PDF document
@@ -204,29 +221,14 @@ def generate_invoice_pdf(invoice: InvoiceResponse, order: Order = None) -> Bytes
     buffer.seek(0)
     return buffer
 
-@router.get("/order/{order_id}/pdf")
-def download_invoice_pdf(
-    order_id: int,
-    background_tasks: BackgroundTasks,
-    current_user=Depends(get_current_user),
-    db: Session = Depends(get_db_sync)
-):
-    """
-    Generate and download PDF invoice for an order.
-    Creates a temporary file that auto-deletes after 10 minutes.
-    """
-    # Check if order exists and belongs to current user
-    order = db.query(Order).filter(Order.id == order_id, Order.created_by_user_id == current_user.id).first()
-    if not order:
-        raise HTTPException(status_code=404, detail="Order not found or access denied")
-
-    invoice = db.query(Invoice).filter(Invoice.order_id == order_id).first()
-    if not invoice:
-        raise HTTPException(status_code=404, detail="Invoice not found for this order")
-
-    # Generate PDF
-    pdf_buffer = generate_invoice_pdf(invoice, order)
+async def render_invoice_pdf(invoice: InvoiceResponse) -> BytesIO:
+    """Render on the cpu process pool and await it, so no request thread waits on ReportLab"""
+    started = time.perf_counter()
+    pdf_buffer = await cpu_executor.run(generate_invoice_pdf, invoice)
+    PDF_RENDER_SECONDS.observe(time.perf_counter() - started)
+    return pdf_buffer
 
+def _pdf_file_response(invoice: InvoiceResponse, pdf_buffer: BytesIO, background_tasks: BackgroundTasks) -> FileResponse:
     # Create temporary file
     temp_dir = tempfile.gettempdir()
     temp_filename = f"invoice_{invoice.invoice_id}_{int(time.time())}.pdf"
@@ -246,51 +248,67 @@ def download_invoice_pdf(
         filename=f"{invoice.invoice_id}.pdf"
     )
 
+@router.get("/order/{order_id}/pdf")
+async def download_invoice_pdf(
+    order_id: int,
+    background_tasks: BackgroundTasks,
+    current_user=Depends(get_current_user),
+    db: Session = Depends(get_db_read)
+):
+    """
+    Generate and download PDF invoice for an order.
+    Creates a temporary file that auto-deletes after 10 minutes.
+    """
+    def load() -> InvoiceResponse:
+        # Check if order exists and belongs to current user
+        order = db.query(Order).filter(Order.id == order_id, Order.created_by_user_id == current_user.id).first()
+        if not order:
+            raise HTTPException(status_code=404, detail="Order not found or access denied")
+
+        invoice = db.query(Invoice).filter(Invoice.order_id == order_id).first()
+        if not invoice:
+            raise HTTPException(status_code=404, detail="Invoice not found for this order")
+        invoice_data = InvoiceResponse.model_validate(invoice)
+        # Everything needed is loaded, give the connection back while the PDF renders
+        db.close()
+        return invoice_data
+
+    invoice = await run_db(load)
+    pdf_buffer = await render_invoice_pdf(invoice)
+    return await run_db(_pdf_file_response, invoice, pdf_buffer, background_tasks)
+
 @router.get("/id/{invoice_db_id}/pdf")
-def download_invoice_pdf_by_id(
+async def download_invoice_pdf_by_id(
     invoice_db_id: int,
     background_tasks: BackgroundTasks,
     current_user=Depends(get_current_user),
-    db: Session = Depends(get_db_sync)
+    db: Session = Depends(get_db_read)
 ):
     """
     Generate and download PDF invoice by database ID.
     Creates a temporary file that auto-deletes after 10 minutes.
     """
-    # Get invoice and check ownership
-    invoice = db.query(Invoice).filter(Invoice.id == invoice_db_id).first()
-    if not invoice:
-        raise HTTPException(status_code=404, detail="Invoice not found")
-
-    # Check if the invoice belongs to the current user (through the order)
-    order = db.query(Order).filter(Order.id == invoice.order_id, Order.created_by_user_id == current_user.id).first()
-    if not order:
-        raise HTTPException(status_code=403, detail="Access denied")
-
-    # Generate PDF
-    pdf_buffer = generate_invoice_pdf(invoice, order)
-
-    # Create temporary file
-    temp_dir = tempfile.gettempdir()
-    temp_filename = f"invoice_{invoice.invoice_id}_{int(time.time())}.pdf"
-    temp_filepath = os.path.join(temp_dir, temp_filename)
-
-    # Write PDF to temporary file
-    with open(temp_filepath, 'wb') as f:
-        f.write(pdf_buffer.getvalue())
-
-    # Schedule file deletion after 10 minutes
-    background_tasks.add_task(delete_file_after_delay, temp_filepath, 600)
-
-    # Return file response
-    return FileResponse(
-        path=temp_filepath,
-        media_type='application/pdf',
-        filename=f"{invoice.invoice_id}.pdf"
-    )
+    def load() -> InvoiceResponse:
+        # Get invoice and check ownership
+        invoice = db.query(Invoice).filter(Invoice.id == invoice_db_id).first()
+        if not invoice:
+            raise HTTPException(status_code=404, detail="Invoice not found")
+
+        # Check if the invoice belongs to the current user (through the order)
+        order = db.query(Order).filter(Order.id == invoice.order_id, Order.created_by_user_id == current_user.id).first()
+        if not order:
+            raise HTTPException(status_code=403, detail="Access denied")
+        invoice_data = InvoiceResponse.model_validate(invoice)
+        # Everything needed is loaded, give the connection back while the PDF renders
+        db.close()
+        return invoice_data
+
+    invoice = await run_db(load)
+    pdf_buffer = await render_invoice_pdf(invoice)
+    return await run_db(_pdf_file_response, invoice, pdf_buffer, background_tasks)
 
 @router.get("/order/{order_id}", response_model=InvoiceResponse)
-def get_invoice_by_order(order_id: int, current_user = Depends(get_current_user), db: Session = Depends(get_db_sync)):
+def get_invoice_by_order(order_id: int, current_user = Depends(get_current_user), db: Session = Depends(get_db_read)):
     """
     Get invoice by order ID. Authenticated users can view their own invoices.
     """
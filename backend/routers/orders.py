@@ -1,10 +1,17 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Header, status
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import func
-from database import get_db, get_db_sync
-from models import Order, City, User, OrderStatus
+from sqlalchemy import func, exists
+from typing import Optional
+import asyncio
+from database import get_db, get_db_sync, get_db_read, AsyncSessionLocal
+from models import Order, Invoice, City, User, OrderStatus, InvoiceStatus, ORDER_TRANSITIONS, order_statuses_leading_to
 from schemas import CreateOrder, OrderResponse, CancelOrderRequest, AssignOrderRequest
-from auth import get_current_user
+from auth import get_current_user, get_current_user_from_token
+from config import settings
+from realtime import order_events, order_status_event
+from bulk import update_orders
+from serialization import dumps, FastJSONResponse, ORDER_COLUMNS, INVOICE_COLUMNS, ORDER_WITH_INVOICE_COLUMNS, order_rows_to_dicts
 
 router = APIRouter()
 
@@ -42,86 +49,175 @@ def create_order(order_data: CreateOrder, current_user: User = Depends(get_curre
     return new_order
 
 @router.get("/", response_model=list[OrderResponse])
-def get_user_orders(current_user: User = Depends(get_current_user), db: Session = Depends(get_db_sync)):
+def get_user_orders(current_user: User = Depends(get_current_user), db: Session = Depends(get_db_read)):
     """
     Get all orders for the authenticated user.
     """
-    orders = db.query(Order).filter(Order.created_by_user_id == current_user.id).all()
+    rows = db.query(*ORDER_WITH_INVOICE_COLUMNS).outerjoin(Invoice, Invoice.order_id == Order.id).filter(
+        Order.created_by_user_id == current_user.id
+    ).all()
 
-    return orders
+    return FastJSONResponse(order_rows_to_dicts(rows))
+
+@router.get("/events")
+async def stream_order_events(token: Optional[str] = None, authorization: Optional[str] = Header(None)):
+    """
+    Server-Sent Events stream of status changes to the caller's orders and
+    their invoices, so the app doesn't have to poll GET /orders/. Accepts the
+    access token as a Bearer header or, for EventSource clients, ?token=.
+    The first event is "ready": fetch GET /orders/ once then, and again on
+    every reconnect or "resync" event.
+    """
+    if token is None and authorization and authorization.lower().startswith("bearer "):
+        token = authorization[7:]
+    if not token:
+        raise HTTPException(status_code=401, detail="Not authenticated", headers={"WWW-Authenticate": "Bearer"})
+    # Short-lived session, nothing is held open while the stream is idle
+    async with AsyncSessionLocal() as db:
+        user = await get_current_user_from_token(token, db)
+
+    queue = order_events.subscribe(user.id)
+    if queue is None:
+        raise HTTPException(status_code=429, detail="Too many open event streams")
+
+    async def stream():
+        try:
+            yield "retry: 5000\nevent: ready\ndata: {}\n\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=settings.sse_heartbeat_seconds)
+                except asyncio.TimeoutError:
+                    # Comment line, keeps proxies from closing an idle stream
+                    yield ": ping\n\n"
+                    continue
+                yield f"event: {event['type']}\ndata: {dumps(event).decode()}\n\n"
+        finally:
+            order_events.unsubscribe(user.id, queue)
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @router.get("/{order_id}", response_model=OrderResponse)
-def get_order(order_id: str, current_user: User = Depends(get_current_user), db: Session = Depends(get_db_sync)):
+def get_order(order_id: str, current_user: User = Depends(get_current_user), db: Session = Depends(get_db_read)):
     """
     Get a specific order by order_id. Only the user who created the order can access it.
     """
-    order = db.query(Order).filter(Order.order_id == order_id).first()
-    if not order:
+    row = db.query(*ORDER_WITH_INVOICE_COLUMNS).outerjoin(Invoice, Invoice.order_id == Order.id).filter(
+        Order.order_id == order_id
+    ).first()
+    if not row:
         raise HTTPException(status_code=404, detail="Order not found")
-    if order.created_by_user_id != current_user.id:
+    order = order_rows_to_dicts([row])[0]
+    if order["created_by_user_id"] != current_user.id:
         raise HTTPException(status_code=403, detail="Not authorized to access this order")
 
-    return order
+    return FastJSONResponse(order)
+
+def _parse_if_match(if_match: Optional[str]) -> Optional[int]:
+    """Expected order version from an If-Match header ("3" or 3), if any"""
+    if if_match is None:
+        return None
+    try:
+        return int(if_match.strip().strip('"'))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="If-Match must be an order version number")
+
+def _transition_order(db: Session, order_id: str, target: OrderStatus, expected_version: Optional[int], conditions: list, values: dict):
+    """
+    Move an order to `target` with one UPDATE that only matches when the
+    current status may lead to `target` and all `conditions` hold. Returns
+    the updated order as a response dict and the courier it had before, or
+    (None, None) if nothing matched.
+    """
+    if expected_version is not None:
+        conditions = [*conditions, Order.version == expected_version]
+    stmt, previous_courier_id = update_orders(
+        Order.order_id == order_id,
+        Order.status.in_(order_statuses_leading_to(target)),
+        *conditions,
+        values={"status": target, "version": Order.version + 1, **values},
+    )
+    row = db.execute(stmt.returning(*ORDER_COLUMNS, previous_courier_id), execution_options={"synchronize_session": False}).first()
+    if row is None:
+        db.rollback()
+        return None, None
+    db.commit()
+
+    invoice = db.query(*INVOICE_COLUMNS).filter(Invoice.order_id == row.id).first()
+    order = order_rows_to_dicts([tuple(row)[:len(ORDER_COLUMNS)] + (tuple(invoice) if invoice else (None,) * len(INVOICE_COLUMNS))])[0]
+    return order, row.previous_courier_id
+
+def _order_conflict(order: Order, expected_version: Optional[int]):
+    """Nothing else explains the failed update, so the order changed underneath us"""
+    raise HTTPException(
+        status_code=409,
+        detail=f"Order was modified concurrently (version {order.version}{f', expected {expected_version}' if expected_version is not None else ''}), please retry",
+        headers={"Retry-After": "0"}
+    )
 
 @router.put("/{order_id}/cancel", response_model=OrderResponse)
-def cancel_order(order_id: str, cancel_data: CancelOrderRequest, current_user: User = Depends(get_current_user), db: Session = Depends(get_db_sync)):
+def cancel_order(order_id: str, cancel_data: CancelOrderRequest, current_user: User = Depends(get_current_user), db: Session = Depends(get_db_sync), if_match: Optional[str] = Header(None)):
     """
     Cancel an order. Only the user who created the order can cancel it.
+    Send the order version in If-Match to only cancel the version you saw.
     """
+    expected_version = _parse_if_match(if_match)
+    order, _ = _transition_order(
+        db, order_id, OrderStatus.CANCELLED, expected_version,
+        conditions=[
+            Order.created_by_user_id == current_user.id,
+            # Orders with a paid invoice are refunded through customer service
+            ~exists().where(Invoice.order_id == Order.id, Invoice.status == InvoiceStatus.PAID),
+        ],
+        values={"comments": f"{cancel_data.reason} by ID:{current_user.id} and name:{current_user.name}"},
+    )
+    if order is not None:
+        order_events.publish((order["created_by_user_id"], order["assigned_to_user_id"]), order_status_event(order))
+        return FastJSONResponse(order)
+
+    # Work out why nothing was updated, only on the failure path
     order = db.query(Order).filter(Order.order_id == order_id).first()
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     if order.created_by_user_id != current_user.id:
         raise HTTPException(status_code=403, detail="Not authorized to cancel this order")
-
-    # Check if order can be cancelled
-    if order.status in [OrderStatus.CANCELLED, OrderStatus.DONE]:
+    if OrderStatus.CANCELLED not in ORDER_TRANSITIONS[order.status]:
         raise HTTPException(status_code=400, detail="Order cannot be cancelled")
-
-    # Check if order has a paid invoice
-    if order.invoice and order.invoice.status == "paid":
+    if order.invoice and order.invoice.status == InvoiceStatus.PAID:
         raise HTTPException(status_code=400, detail="Order cannot be cancelled as it has a paid invoice. Please contact customer service.")
-
-    # Update order
-    order.status = OrderStatus.CANCELLED
-    order.comments = f"{cancel_data.reason} by ID:{current_user.id} and name:{current_user.name}"
-    # updated_at will be automatically updated due to onupdate=func.now()
-
-    db.commit()
-    db.refresh(order)
-
-    return order
+    _order_conflict(order, expected_version)
 
 @router.put("/{order_id}/assign", response_model=OrderResponse)
-def assign_order(order_id: str, request: AssignOrderRequest, current_user: User = Depends(get_current_user), db: Session = Depends(get_db_sync)):
+def assign_order(order_id: str, request: AssignOrderRequest, current_user: User = Depends(get_current_user), db: Session = Depends(get_db_sync), if_match: Optional[str] = Header(None)):
     """
     Assign an order to a courier. Only admins can assign orders.
+    Send the order version in If-Match to only assign the version you saw.
     """
     if not current_user.is_admin:
         raise HTTPException(status_code=403, detail="Not authorized to assign orders")
 
+    expected_version = _parse_if_match(if_match)
+    order, previous_courier_id = _transition_order(
+        db, order_id, OrderStatus.RECEIVED_BY_COURIER, expected_version,
+        conditions=[
+            exists().where(User.id == request.assigned_to_user_id, User.role == "Courier"),
+        ],
+        values={
+            "assigned_to_user_id": request.assigned_to_user_id,
+            "comments": f"Assigned to courier ID:{request.assigned_to_user_id} by admin ID:{current_user.id}",
+        },
+    )
+    if order is not None:
+        order_events.publish((order["created_by_user_id"], order["assigned_to_user_id"], previous_courier_id), order_status_event(order))
+        return FastJSONResponse(order)
+
     order = db.query(Order).filter(Order.order_id == order_id).first()
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
-
-    # Check if the assigned user exists and is a courier
     assigned_user = db.query(User).filter(User.id == request.assigned_to_user_id).first()
     if not assigned_user:
         raise HTTPException(status_code=404, detail="Assigned user not found")
     if assigned_user.role != "Courier":
         raise HTTPException(status_code=400, detail="Assigned user must be a courier")
-
-    # Check if order can be assigned
-    if order.status in [OrderStatus.CANCELLED, OrderStatus.DONE]:
+    if OrderStatus.RECEIVED_BY_COURIER not in ORDER_TRANSITIONS[order.status]:
         raise HTTPException(status_code=400, detail="Order cannot be assigned")
-
-    # Update order
-    order.assigned_to_user_id = request.assigned_to_user_id
-    order.status = OrderStatus.RECEIVED_BY_COURIER
-    order.comments = f"Assigned to courier ID:{request.assigned_to_user_id} by admin ID:{current_user.id}"
-    # updated_at will be automatically updated due to onupdate=func.now()
-
-    db.commit()
-    db.refresh(order)
-
-    return order
+    _order_conflict(order, expected_version)
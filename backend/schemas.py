@@ -162,6 +162,7 @@ class OrderResponse(BaseModel):
     comments: Optional[str]
     updated_at: datetime
     city_id: int
+    version: int
     invoice: Optional[InvoiceResponse] = None  # Include invoice information
 
     class Config:
@@ -194,6 +195,27 @@ class CancelOrderRequest(BaseModel):
 class AssignOrderRequest(BaseModel):
     assigned_to_user_id: int
 
+# Bulk admin actions, each applied as one UPDATE over `ids` (database ids)
+class BulkOrderStatusRequest(BaseModel):
+    ids: list[int]
+    status: OrderStatusEnum
+
+class BulkOrderAssignRequest(BaseModel):
+    ids: list[int]
+    assigned_to_user_id: int
+
+class BulkOrderCancelRequest(BaseModel):
+    ids: list[int]
+    reason: str
+
+class BulkInvoiceStatusRequest(BaseModel):
+    ids: list[int]
+    status: InvoiceStatusEnum
+
+class BulkActionResult(BaseModel):
+    affected: list[int]
+    rejected: dict[int, str]
+
 # Chat schemas
 class CreateConversationRequest(BaseModel):
     other_user_id: int  # The ID of the other user (customer or courier)
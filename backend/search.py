@@ -0,0 +1,260 @@
+from typing import Dict, List, Optional, Tuple
+import logging
+import re
+from sqlalchemy import column, delete, event, func, inspect, select, table, text
+from sqlalchemy.orm import Session
+from database import Base, sync_engine
+from models import Order, Message, MessageArchive
+from serialization import ORDER_COLUMNS, ORDER_FIELDS, MESSAGE_COLUMNS, MESSAGE_ARCHIVE_COLUMNS, MESSAGE_FIELDS, rows_to_dicts
+
+logger = logging.getLogger(__name__)
+
+# Full-text search over chat messages and order descriptions, for support
+# staff. Each searchable source has a side table keyed by the row id:
+#
+#   sqlite    FTS5 virtual table, ranked with bm25
+#   postgres  tsvector column with a GIN index, ranked with ts_rank
+#
+# Text is normalized in Python before it is indexed or queried (Arabic
+# diacritics, tatweel and letter variants folded, the definite article split
+# off), so both backends match the same way. Rows are kept in sync by ORM
+# events on insert, update and delete. Core statements bypass those events:
+# bulk UPDATEs that set an indexed column call SearchIndex.refresh, bulk
+# INSERTs (seed data) index_rows_from. Archived messages keep their entry,
+# results are read from messages and messages_archive.
+
+_DIALECT = sync_engine.dialect.name
+
+# Tashkeel, superscript alef and tatweel
+_ARABIC_MARKS = re.compile("[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]")
+_ARABIC_FOLD = str.maketrans({
+    "أ": "ا", "إ": "ا", "آ": "ا", "ٱ": "ا",  # alef variants
+    "ى": "ي",  # alef maksura -> ya
+    "ة": "ه",  # ta marbuta -> ha
+    "ؤ": "و",  # waw with hamza
+    "ئ": "ي",  # ya with hamza
+    "ی": "ي", "ک": "ك",  # Persian ya and keheh
+    **{chr(0x0660 + digit): str(digit) for digit in range(10)},  # Arabic-Indic digits
+    **{chr(0x06f0 + digit): str(digit) for digit in range(10)},  # Persian digits
+})
+# Definite article, alone or after a one-letter conjunction/preposition
+_ARTICLE_PREFIXES = ("وال", "بال", "كال", "فال", "لل", "ال")
+_TOKEN = re.compile(r"\w+")
+
+
+def normalize(value: str) -> str:
+    return _ARABIC_MARKS.sub("", value).translate(_ARABIC_FOLD).lower()
+
+
+def _strip_article(token: str) -> str:
+    for prefix in _ARTICLE_PREFIXES:
+        if token.startswith(prefix) and len(token) - len(prefix) >= 2:
+            return token[len(prefix):]
+    return token
+
+
+def document_text(value: Optional[str]) -> str:
+    """Indexed form of a text: normalized tokens, plus article-less variants"""
+    tokens = []
+    for token in _TOKEN.findall(normalize(value or "")):
+        tokens.append(token)
+        stem = _strip_article(token)
+        if stem != token:
+            tokens.append(stem)
+    return " ".join(tokens)
+
+
+def query_tokens(term: str) -> List[str]:
+    return [_strip_article(token) for token in _TOKEN.findall(normalize(term))]
+
+
+class SearchIndex:
+    """Side table holding the searchable document of one column"""
+
+    def __init__(self, name: str, source):
+        self.name = name
+        self.source = source
+        key = "rowid" if _DIALECT == "sqlite" else "id"
+        self.table = table(name, column(key), column("document"))
+        self.key = self.table.c[key]
+
+    def create(self, connection):
+        if _DIALECT == "sqlite":
+            connection.execute(text(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.name} USING fts5(document, tokenize = 'unicode61 remove_diacritics 2')"
+            ))
+        else:
+            connection.execute(text(f"CREATE TABLE IF NOT EXISTS {self.name} (id INTEGER PRIMARY KEY, document TSVECTOR NOT NULL)"))
+            connection.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{self.name}_document ON {self.name} USING GIN (document)"))
+
+    def upsert(self, connection, row_id: int, value: Optional[str]):
+        document = document_text(value)
+        if _DIALECT == "sqlite":
+            connection.execute(text(f"DELETE FROM {self.name} WHERE rowid = :id"), {"id": row_id})
+            connection.execute(text(f"INSERT INTO {self.name} (rowid, document) VALUES (:id, :document)"), {"id": row_id, "document": document})
+        else:
+            connection.execute(text(
+                f"INSERT INTO {self.name} (id, document) VALUES (:id, to_tsvector('simple', :document)) "
+                f"ON CONFLICT (id) DO UPDATE SET document = excluded.document"
+            ), {"id": row_id, "document": document})
+
+    def refresh(self, connection, row_ids):
+        """Re-index rows changed by a Core UPDATE, which the ORM events don't see"""
+        key = self.source.class_.id
+        for row_id, value in connection.execute(select(key, self.source).where(key.in_(list(row_ids)))):
+            self.upsert(connection, row_id, value)
+
+    def remove(self, connection, row_ids):
+        connection.execute(delete(self.table).where(self.key.in_(list(row_ids))))
+
+    def match(self, term: str, limit: Optional[int] = None, offset: int = 0):
+        """
+        Select of (id, rank) for rows containing every term, best first, or
+        None when the term has nothing to search for. Each term matches as a
+        prefix, so a partial word still finds the message.
+        """
+        tokens = query_tokens(term)
+        if not tokens:
+            return None
+        if _DIALECT == "sqlite":
+            query = " ".join(f'"{token}"*' for token in tokens)
+            # bm25 is negative, lower is better
+            rank = func.bm25(text(self.name))
+            stmt = select(self.key.label("id"), rank.label("rank")).where(self.table.c.document.op("MATCH")(query)).order_by(rank)
+        else:
+            query = func.to_tsquery("simple", " & ".join(f"{token}:*" for token in tokens))
+            rank = func.ts_rank(self.table.c.document, query)
+            stmt = select(self.key.label("id"), rank.label("rank")).where(self.table.c.document.op("@@")(query)).order_by(rank.desc())
+        if limit is not None:
+            stmt = stmt.limit(limit).offset(offset)
+        return stmt
+
+    def match_ids(self, term: str):
+        """Subquery of matching ids, for narrowing a listing query"""
+        stmt = self.match(term)
+        return select(stmt.subquery().c.id) if stmt is not None else None
+
+
+message_index = SearchIndex("messages_fts", Message.content)
+order_index = SearchIndex("orders_fts", Order.description)
+
+
+@event.listens_for(Base.metadata, "after_create")
+def _create_indexes(target, connection, **kw):
+    for index in (message_index, order_index):
+        index.create(connection)
+
+
+def _sync(index: SearchIndex):
+    attribute = index.source.key
+
+    def after_insert(mapper, connection, target):
+        index.upsert(connection, target.id, getattr(target, attribute))
+
+    def after_update(mapper, connection, target):
+        # Status changes and the like leave the document alone
+        if inspect(target).attrs[attribute].history.has_changes():
+            index.upsert(connection, target.id, getattr(target, attribute))
+
+    def after_delete(mapper, connection, target):
+        index.remove(connection, (target.id,))
+
+    mapped = index.source.class_
+    event.listen(mapped, "after_insert", after_insert)
+    event.listen(mapped, "after_update", after_update)
+    event.listen(mapped, "after_delete", after_delete)
+
+
+_sync(message_index)
+_sync(order_index)
+
+
+def search_messages(db: Session, term: str, limit: int = 20, offset: int = 0) -> List[dict]:
+    """Messages matching `term`, best first, from the hot table and the archive"""
+    ranked = _ranked(db, message_index, term, limit, offset)
+    if not ranked:
+        return []
+    ids = list(ranked)
+    rows = db.query(*MESSAGE_COLUMNS).filter(Message.id.in_(ids)).all()
+    rows += db.query(*MESSAGE_ARCHIVE_COLUMNS).filter(MessageArchive.id.in_(ids)).all()
+    return _in_rank_order(ranked, rows_to_dicts(MESSAGE_FIELDS, rows))
+
+
+def search_orders(db: Session, term: str, limit: int = 20, offset: int = 0) -> List[dict]:
+    """Orders whose description matches `term`, best first"""
+    ranked = _ranked(db, order_index, term, limit, offset)
+    if not ranked:
+        return []
+    rows = db.query(*ORDER_COLUMNS).filter(Order.id.in_(list(ranked))).all()
+    return _in_rank_order(ranked, rows_to_dicts(ORDER_FIELDS, rows))
+
+
+def _ranked(db: Session, index: SearchIndex, term: str, limit: int, offset: int) -> Dict[int, float]:
+    stmt = index.match(term, limit, offset)
+    if stmt is None:
+        return {}
+    return {row_id: rank for row_id, rank in db.execute(stmt)}
+
+
+def _in_rank_order(ranked: Dict[int, float], rows: List[dict]) -> List[dict]:
+    by_id = {row["id"]: row for row in rows}
+    results = []
+    for row_id, rank in ranked.items():
+        row = by_id.get(row_id)
+        # Gone since it was indexed (a purge in progress), skip it
+        if row is not None:
+            row["rank"] = rank
+            results.append(row)
+    return results
+
+
+def rebuild(db: Session, batch_size: int = 1000) -> Dict[str, int]:
+    """
+    Recreate both indexes from the tables, for databases that had data before
+    search was added or after the normalization rules change
+    """
+    connection = db.connection()
+    for index in (message_index, order_index):
+        index.create(connection)
+        connection.execute(delete(index.table))
+    db.commit()
+    counts = _index_rows(db, [
+        (message_index, (Message.id, Message.content), 0),
+        (message_index, (MessageArchive.id, MessageArchive.content), 0),
+        (order_index, (Order.id, Order.description), 0),
+    ], batch_size)
+    logger.info("Rebuilt search indexes: %s", counts, extra={"event": "search.rebuilt"})
+    return counts
+
+
+def index_rows_from(db: Session, first_message_id: int, first_order_id: int, batch_size: int = 1000) -> Dict[str, int]:
+    """Index the messages and orders from the given ids on, after bulk INSERTs"""
+    for index in (message_index, order_index):
+        index.create(db.connection())
+    return _index_rows(db, [
+        (message_index, (Message.id, Message.content), first_message_id - 1),
+        (order_index, (Order.id, Order.description), first_order_id - 1),
+    ], batch_size)
+
+
+def _index_rows(db: Session, sources: List[Tuple[SearchIndex, tuple, int]], batch_size: int) -> Dict[str, int]:
+    """Upsert each source's rows after its starting id, one committed batch at a time"""
+    counts = {}
+    for index, (key, value), last_id in sources:
+        while True:
+            rows = db.query(key, value).filter(key > last_id).order_by(key).limit(batch_size).all()
+            if not rows:
+                break
+            connection = db.connection()
+            for row_id, document in rows:
+                index.upsert(connection, row_id, document)
+            db.commit()
+            last_id = rows[-1][0]
+            counts[index.name] = counts.get(index.name, 0) + len(rows)
+    return counts
+
+
+if __name__ == "__main__":
+    from database import SessionLocal
+    with SessionLocal() as session:
+        print(rebuild(session))
@@ -0,0 +1,88 @@
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import Any, Iterable, List, Sequence
+import enum
+import json
+from fastapi.responses import Response
+from models import Order, Invoice, Conversation, Message, MessageArchive
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Fast path for read-heavy endpoints. Columns are selected directly (no ORM
+# identity map, no lazy loads), turned into plain dicts and encoded once.
+# Rows come straight from the database, so they are not re-validated through
+# the response models; the dict keys below must stay in sync with
+# OrderResponse, InvoiceResponse, ConversationResponse and MessageResponse.
+
+INVOICE_FIELDS = (
+    "id", "invoice_id", "order_id", "full_amount", "service_fee", "order_only_price", "courier_fee",
+    "status", "description", "comment", "sent_to_user_via_email", "sent_at", "due_date",
+    "tax_amount", "discount_amount", "created_at", "updated_at",
+)
+ORDER_FIELDS = (
+    "id", "order_id", "created_by_user_id", "assigned_to_user_id", "description", "creation_date",
+    "delivery_date", "status", "comments", "updated_at", "city_id", "version",
+)
+CONVERSATION_FIELDS = ("id", "customer_id", "courier_id", "status", "created_at")
+MESSAGE_FIELDS = (
+    "id", "conversation_id", "sender_id", "content", "sent_at", "message_type", "invoice_description",
+    "invoice_gift_price", "invoice_service_fee", "invoice_delivery_fee", "invoice_total",
+)
+
+INVOICE_COLUMNS = tuple(getattr(Invoice, name) for name in INVOICE_FIELDS)
+ORDER_COLUMNS = tuple(getattr(Order, name) for name in ORDER_FIELDS)
+CONVERSATION_COLUMNS = tuple(getattr(Conversation, name) for name in CONVERSATION_FIELDS)
+MESSAGE_COLUMNS = tuple(getattr(Message, name) for name in MESSAGE_FIELDS)
+MESSAGE_ARCHIVE_COLUMNS = tuple(getattr(MessageArchive, name) for name in MESSAGE_FIELDS)
+# Orders are selected with their invoice outer-joined, invoice columns last
+ORDER_WITH_INVOICE_COLUMNS = ORDER_COLUMNS + INVOICE_COLUMNS
+
+_ORDER_WIDTH = len(ORDER_FIELDS)
+
+
+def order_rows_to_dicts(rows: Iterable[Sequence[Any]]) -> List[dict]:
+    """Build OrderResponse-shaped dicts from ORDER_WITH_INVOICE_COLUMNS rows"""
+    orders = []
+    for row in rows:
+        order = dict(zip(ORDER_FIELDS, row[:_ORDER_WIDTH]))
+        invoice = row[_ORDER_WIDTH:]
+        # Invoice.id is never null, so a null there means no invoice was joined
+        order["invoice"] = dict(zip(INVOICE_FIELDS, invoice)) if invoice[0] is not None else None
+        orders.append(order)
+    return orders
+
+
+def rows_to_dicts(fields: Sequence[str], rows: Iterable[Sequence[Any]]) -> List[dict]:
+    return [dict(zip(fields, row)) for row in rows]
+
+
+def _default(value):
+    """Encode the types the stdlib encoder does not know, matching pydantic's JSON output"""
+    if isinstance(value, datetime):
+        text = value.isoformat()
+        return text[:-6] + "Z" if value.utcoffset() == timedelta(0) else text
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, enum.Enum):
+        return value.value
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    if orjson is not None:
+        # UTC datetimes as "Z", like pydantic does for response models
+        return orjson.dumps(content, default=_default, option=orjson.OPT_UTC_Z)
+    return json.dumps(content, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(Response):
+    """JSON response encoded with orjson when installed, without response model validation"""
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -0,0 +1,227 @@
+import logging
+import re
+import threading
+import time
+from collections import Counter as ShapeCounter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+from sqlalchemy import event
+from config import settings
+from database import engine, sync_engine, replica_set
+from metrics import REQUEST_DB_QUERIES, REQUEST_DB_SECONDS
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r"\s+")
+# Expanded IN lists and multi-row VALUES differ only in their placeholder count
+_PLACEHOLDER_LIST = re.compile(r"\(\s*(?:\?|%\(\w+\)s|\$\d+|:\w+)(?:\s*,\s*(?:\?|%\(\w+\)s|\$\d+|:\w+))*\s*\)")
+
+
+def statement_shape(statement: str) -> str:
+    """Statement text with parameter lists collapsed, used to spot repeats"""
+    return _PLACEHOLDER_LIST.sub("(?)", _WHITESPACE.sub(" ", statement).strip())
+
+
+class QueryProfile:
+    """
+    Statements run while serving one request. Shared with threadpool workers
+    through the context, so sync handlers and dependencies add to it too.
+    """
+
+    __slots__ = ("queries", "db_seconds", "shapes", "slow")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.shapes: ShapeCounter = ShapeCounter()
+        self.slow: List[dict] = []
+
+    def record(self, statement: str, elapsed: float):
+        self.queries += 1
+        self.db_seconds += elapsed
+        shape = statement_shape(statement)
+        self.shapes[shape] += 1
+        if elapsed * 1000 >= settings.sql_slow_query_ms:
+            self.slow.append({"statement": shape, "ms": round(elapsed * 1000, 2)})
+
+    def duplicates(self, threshold: int = 2) -> Dict[str, int]:
+        return {shape: count for shape, count in self.shapes.items() if count >= threshold}
+
+    def n_plus_one(self) -> Dict[str, int]:
+        """Shapes repeated often enough within one request to look like a per-row lazy load"""
+        return self.duplicates(settings.sql_n_plus_one_threshold)
+
+
+current_profile: ContextVar[Optional[QueryProfile]] = ContextVar("current_profile", default=None)
+
+
+class SlowQueryLog:
+    """
+    Rolling table of the slowest statement shapes seen recently. Entries not
+    seen within the window are dropped; beyond `max_shapes` the least recent goes.
+    """
+
+    def __init__(self, window_seconds: float, max_shapes: int = 500):
+        self.window_seconds = window_seconds
+        self.max_shapes = max_shapes
+        self._entries: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def record(self, shape: str, elapsed: float, route: Optional[str] = None):
+        now = time.time()
+        ms = elapsed * 1000
+        with self._lock:
+            entry = self._entries.pop(shape, None)
+            if entry is None:
+                entry = {"statement": shape, "count": 0, "total_ms": 0.0, "max_ms": 0.0, "route": route}
+            entry["count"] += 1
+            entry["total_ms"] += ms
+            if ms >= entry["max_ms"]:
+                entry["max_ms"] = ms
+                entry["route"] = route
+            entry["last_seen"] = now
+            # Re-inserted so dict order stays least-recently-seen first
+            self._entries[shape] = entry
+            while len(self._entries) > self.max_shapes:
+                self._entries.pop(next(iter(self._entries)))
+
+    def top(self, limit: int = 20) -> List[dict]:
+        cutoff = time.time() - self.window_seconds
+        with self._lock:
+            for shape in [shape for shape, entry in self._entries.items() if entry["last_seen"] < cutoff]:
+                del self._entries[shape]
+            entries = [dict(entry) for entry in self._entries.values()]
+        entries.sort(key=lambda entry: entry["max_ms"], reverse=True)
+        for entry in entries[:limit]:
+            entry["avg_ms"] = round(entry["total_ms"] / entry["count"], 2)
+            entry["total_ms"] = round(entry["total_ms"], 2)
+            entry["max_ms"] = round(entry["max_ms"], 2)
+        return entries[:limit]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+slow_queries = SlowQueryLog(settings.sql_slow_query_window_seconds, settings.sql_slow_query_table_size)
+
+# Open assert_max_queries() blocks, they see every statement in the process
+_captures: List[QueryProfile] = []
+_captures_lock = threading.Lock()
+
+# Route template of the request being served, for the slow query table
+_current_route: ContextVar[Optional[str]] = ContextVar("current_route", default=None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_started"].pop()
+    profile = current_profile.get()
+    if profile is not None:
+        profile.record(statement, elapsed)
+    if _captures:
+        with _captures_lock:
+            for capture in _captures:
+                capture.record(statement, elapsed)
+    if elapsed * 1000 >= settings.sql_slow_query_ms:
+        slow_queries.record(statement_shape(statement), elapsed, _current_route.get())
+
+
+def _handle_error(exception_context):
+    # A failed statement never reaches after_cursor_execute, drop its start time
+    started = exception_context.connection.info.get("query_started") if exception_context.connection is not None else None
+    if started:
+        started.pop()
+
+
+for _engine in (sync_engine, engine.sync_engine, *replica_set.engines()):
+    event.listen(_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(_engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(_engine, "handle_error", _handle_error)
+
+
+class ProfilerMiddleware:
+    """
+    Pure ASGI middleware giving each HTTP request its own QueryProfile. Query
+    counts go to metrics; with `debug` on they are also returned as headers.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        profile = QueryProfile()
+        token = current_profile.set(profile)
+        route_token = _current_route.set(scope["path"])
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                route = scope.get("route")
+                if route is not None:
+                    _current_route.set(route.path)
+                if settings.debug:
+                    message["headers"] = list(message.get("headers", [])) + _debug_headers(profile)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_headers)
+        finally:
+            current_profile.reset(token)
+            _current_route.reset(route_token)
+            route = scope.get("route")
+            template = route.path if route is not None else "unmatched"
+            REQUEST_DB_QUERIES.observe(profile.queries, template)
+            REQUEST_DB_SECONDS.observe(profile.db_seconds, template)
+            suspects = profile.n_plus_one()
+            if suspects:
+                logger.warning(
+                    "Possible N+1: %d repeated statement shape(s) on %s %s",
+                    len(suspects), scope["method"], template,
+                    extra={"event": "db.n_plus_one", "route": template, "queries": profile.queries, "repeats": suspects},
+                )
+
+
+def _debug_headers(profile: QueryProfile) -> list:
+    suspects = profile.n_plus_one()
+    headers = [
+        (b"x-db-query-count", str(profile.queries).encode()),
+        (b"x-db-time-ms", f"{profile.db_seconds * 1000:.2f}".encode()),
+        (b"x-db-duplicate-queries", str(sum(count - 1 for count in profile.duplicates().values())).encode()),
+        (b"x-db-slow-queries", str(len(profile.slow)).encode()),
+    ]
+    if suspects:
+        worst = max(suspects.values())
+        headers.append((b"x-db-n-plus-one", f"{len(suspects)} shape(s), worst repeated {worst}x".encode()))
+    return headers
+
+
+@contextmanager
+def assert_max_queries(limit: int):
+    """
+    Fail if more than `limit` statements run inside the block. Counts every
+    statement in the process, so it also sees queries made by the app while
+    a TestClient request is being served on its portal thread:
+
+        with assert_max_queries(3):
+            client.get("/orders/", headers=auth)
+    """
+    capture = QueryProfile()
+    with _captures_lock:
+        _captures.append(capture)
+    try:
+        yield capture
+    finally:
+        with _captures_lock:
+            _captures.remove(capture)
+
+    if capture.queries > limit:
+        details = "".join(f"\n  {count}x {shape}" for shape, count in capture.shapes.most_common())
+        raise AssertionError(f"Expected at most {limit} queries, {capture.queries} were executed:{details}")
@@ -0,0 +1,25 @@
+import os
+import sys
+import tempfile
+
+# Settings are read at import time, so the test database is configured before
+# any backend module is imported
+_database = os.path.join(tempfile.mkdtemp(), "test.db")
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{_database}"
+os.environ.setdefault("SECRET_KEY", "test")
+os.environ.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "30")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from database import Base, SessionLocal, sync_engine
+
+
+@pytest.fixture
+def db():
+    Base.metadata.create_all(sync_engine)
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+        Base.metadata.drop_all(sync_engine)
@@ -0,0 +1,59 @@
+from datetime import datetime, timedelta, timezone
+import pytest
+from sqlalchemy import delete
+import bulk
+import search
+from archive import archive_messages
+from models import City, Conversation, Message, Order, OrderStatus, User
+
+
+@pytest.fixture
+def orders(db):
+    admin = User(phone_number="500000001", role="Admin", is_admin=True)
+    courier = User(phone_number="500000002", role="Courier")
+    city = City(name="Riyadh", active=True)
+    db.add_all([admin, courier, city])
+    db.commit()
+    rows = [Order(order_id=f"ORD-{n}", created_by_user_id=admin.id, city_id=city.id, description=description)
+            for n, description in enumerate(["ورد أحمر", "Chocolate box"])]
+    db.add_all(rows)
+    db.commit()
+    return admin, courier, rows
+
+
+def test_bulk_assign_keeps_orders_searchable(db, orders):
+    admin, courier, (flowers, _) = orders
+    result = bulk.assign_orders(db, [flowers.id], courier.id, admin)
+    assert result["affected"] == [flowers.id]
+    found = search.search_orders(db, "الورد")
+    assert [(order["id"], order["status"]) for order in found] == [(flowers.id, OrderStatus.RECEIVED_BY_COURIER)]
+
+
+def test_bulk_update_of_description_reindexes(db, orders):
+    admin, _, (_, chocolate) = orders
+    bulk.transition_orders(db, [chocolate.id], OrderStatus.CANCELLED, admin, values={"description": "Perfume"})
+    assert search.search_orders(db, "chocolate") == []
+    assert [order["id"] for order in search.search_orders(db, "perf")] == [chocolate.id]
+
+
+def test_archived_messages_stay_searchable(db, orders):
+    admin, courier, _ = orders
+    conversation = Conversation(customer_id=admin.id, courier_id=courier.id, status="active")
+    db.add(conversation)
+    db.commit()
+    old = datetime.utcnow() - timedelta(days=200)
+    db.add_all([Message(conversation_id=conversation.id, sender_id=courier.id, content=content, sent_at=old)
+                for content in ("تم التوصيل", "Delivered, thank you")])
+    db.commit()
+    assert archive_messages(db, datetime.now(timezone.utc) - timedelta(days=90), 100) == 1
+    assert [message["content"] for message in search.search_messages(db, "التوصيل")] == ["تم التوصيل"]
+
+
+def test_index_rows_from_covers_core_inserts(db, orders):
+    _, _, rows = orders
+    # As after seed_data's COPY/executemany, which no ORM event sees
+    db.execute(delete(search.order_index.table))
+    db.commit()
+    assert search.search_orders(db, "chocolate") == []
+    assert search.index_rows_from(db, first_message_id=1, first_order_id=rows[1].id) == {"orders_fts": 1}
+    assert [order["id"] for order in search.search_orders(db, "chocolate")] == [rows[1].id]
@@ -0,0 +1,143 @@
+from typing import Dict, Optional, Tuple
+import asyncio
+import logging
+import os
+import time
+from sqlalchemy import select, text
+from config import settings
+from database import engine, sync_engine, AsyncSessionLocal, SessionLocal
+from models import Order, Invoice, Conversation, Message, User, JWTToken
+from serialization import ORDER_WITH_INVOICE_COLUMNS, CONVERSATION_COLUMNS, MESSAGE_COLUMNS
+from executors import cpu_executor
+import metrics
+
+logger = logging.getLogger(__name__)
+
+_imported_at = time.monotonic()
+
+
+def process_uptime() -> float:
+    """Seconds since this process was started by the OS, not since this module was imported"""
+    try:
+        with open("/proc/self/stat") as f:
+            # Field 22 is the start time in clock ticks after boot; the command
+            # name (field 2) may contain spaces, so count from its closing paren
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            system_uptime = float(f.read().split()[0])
+        return system_uptime - start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return time.monotonic() - _imported_at
+
+
+class Readiness:
+    """
+    Tracks the warmup run. The process is live as soon as it serves HTTP and
+    ready once the database answered and the caches below were filled.
+    """
+
+    def __init__(self):
+        self.ready = False
+        self.error: Optional[str] = None
+        self.attempts = 0
+        self.startup_seconds: Optional[float] = None
+        self.steps: Dict[str, float] = {}
+
+    def status(self) -> dict:
+        return {
+            "ready": self.ready,
+            "attempts": self.attempts,
+            "error": self.error,
+            "startup_seconds": self.startup_seconds,
+            "steps": self.steps,
+        }
+
+
+readiness = Readiness()
+
+
+async def _warm_async_pool():
+    # Open connections side by side so the pool holds several once they are returned
+    async def ping():
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+    await asyncio.gather(*(ping() for _ in range(settings.warmup_db_connections)))
+
+
+def _warm_sync_pool():
+    connections = [sync_engine.connect() for _ in range(settings.warmup_db_connections)]
+    try:
+        for conn in connections:
+            conn.execute(text("SELECT 1"))
+    finally:
+        for conn in connections:
+            conn.close()
+
+
+def _warm_city_catalog():
+    from routers.cities import city_catalog
+    with SessionLocal() as db:
+        city_catalog.load(db)
+
+
+def _warm_sync_queries():
+    """Run the hot read queries once with ids that match nothing, filling the
+    SQLAlchemy compiled statement cache and the database's plan cache"""
+    with SessionLocal() as db:
+        db.query(*ORDER_WITH_INVOICE_COLUMNS).outerjoin(Invoice, Invoice.order_id == Order.id).filter(
+            Order.created_by_user_id == -1
+        ).all()
+        db.query(*CONVERSATION_COLUMNS).filter(
+            (Conversation.customer_id == -1) | (Conversation.courier_id == -1)
+        ).all()
+        db.query(*MESSAGE_COLUMNS).filter(Message.conversation_id == -1).order_by(Message.sent_at.desc()).limit(50).all()
+        db.query(User).filter(User.phone_number == "").first()
+        db.query(JWTToken).filter(JWTToken.access_token == "", JWTToken.is_revoked == False).first()
+
+
+async def _warm_async_queries():
+    async with AsyncSessionLocal() as db:
+        await db.execute(select(User).where(User.phone_number == ""))
+        await db.execute(select(JWTToken).where(JWTToken.access_token == "", JWTToken.is_revoked == False))
+        await db.execute(select(Conversation).where(Conversation.id == -1))
+
+
+async def _step(name: str, coro):
+    started = time.perf_counter()
+    await coro
+    readiness.steps[name] = round(time.perf_counter() - started, 4)
+
+
+async def warm_up():
+    """Warm pools, caches and query plans, retrying until the database answers"""
+    while not readiness.ready:
+        readiness.attempts += 1
+        try:
+            await _step("async_pool", _warm_async_pool())
+            await _step("sync_pool", asyncio.to_thread(_warm_sync_pool))
+            await _step("city_catalog", asyncio.to_thread(_warm_city_catalog))
+            await _step("sync_queries", asyncio.to_thread(_warm_sync_queries))
+            await _step("async_queries", _warm_async_queries())
+            await _step("cpu_pool", asyncio.to_thread(cpu_executor.warm_up))
+        except Exception as e:
+            readiness.error = f"{type(e).__name__}: {e}"
+            logger.warning("Warmup attempt %s failed: %s", readiness.attempts, readiness.error, extra={"event": "app.warmup_failed"})
+            await asyncio.sleep(settings.warmup_retry_seconds)
+            continue
+        readiness.error = None
+        readiness.startup_seconds = round(process_uptime(), 3)
+        readiness.ready = True
+        logger.info("Ready %.3fs after process start", readiness.startup_seconds,
+                    extra={"event": "app.ready", "startup_seconds": readiness.startup_seconds, "steps": readiness.steps})
+
+
+def _ready() -> Dict[Tuple, float]:
+    return {(): 1.0 if readiness.ready else 0.0}
+
+
+def _startup_seconds() -> Dict[Tuple, float]:
+    return {(): readiness.startup_seconds} if readiness.startup_seconds is not None else {}
+
+
+metrics.GaugeCallback("giftly_ready", "1 once startup warmup has completed", (), _ready)
+metrics.GaugeCallback("giftly_startup_seconds", "Seconds from process start until ready", (), _startup_seconds)
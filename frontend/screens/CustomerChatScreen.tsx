@@ -47,6 +47,7 @@ export const CustomerChatScreen: React.FC<Props> = ({ onBack, orderId, onShowInv
   const wsRef = useRef<WebSocket | null>(null);
   const reconnectTimeoutRef = useRef<NodeJS.Timeout | null>(null);
   const reconnectAttemptsRef = useRef(0);
+  const lastMessageIdRef = useRef<number | null>(null);
   const maxReconnectAttempts = 5;
 
   // Update the ref whenever onChatStateChange changes
@@ -114,6 +115,12 @@ export const CustomerChatScreen: React.FC<Props> = ({ onBack, orderId, onShowInv
     }, 100);
   }, []);
 
+  // Track the newest message id so reconnects only replay what was missed
+  useEffect(() => {
+    const ids = messages.map(msg => Number(msg.id)).filter(id => Number.isFinite(id));
+    lastMessageIdRef.current = ids.length > 0 ? Math.max(...ids) : null;
+  }, [messages]);
+
   // WebSocket connection management
   const connectWebSocket = useCallback(() => {
     if (!conversation || !token) return;
@@ -122,7 +129,8 @@ export const CustomerChatScreen: React.FC<Props> = ({ onBack, orderId, onShowInv
     const apiBaseUrl = 'https://971c-37-106-14-206.ngrok-free.app'; // Should match API_BASE_URL
     // Use wss:// for secure WebSocket connection
     const wsBaseUrl = apiBaseUrl.replace(/^https:/, 'wss:').replace(/^http:/, 'ws:');
-    const wsUrl = `${wsBaseUrl}/ws/chat/${conversation.id}?token=${encodeURIComponent(token)}`;
+    const lastSeen = lastMessageIdRef.current !== null ? `&last_seen_message_id=${lastMessageIdRef.current}` : '';
+    const wsUrl = `${wsBaseUrl}/ws/chat/${conversation.id}?token=${encodeURIComponent(token)}${lastSeen}`;
 
     console.log('Connecting to WebSocket:', wsUrl);
     setReconnecting(true);
@@ -141,6 +149,17 @@ export const CustomerChatScreen: React.FC<Props> = ({ onBack, orderId, onShowInv
         const data = JSON.parse(event.data);
         console.log('Received WebSocket message:', data);
 
+        // Answer server heartbeats so the connection is not evicted as idle
+        if (data.type === 'ping') {
+          ws.send(JSON.stringify({ type: 'pong' }));
+          return;
+        }
+
+        // Typing/presence events are not chat messages
+        if (data.type && data.type !== 'message') {
+          return;
+        }
+
         const newMessage = convertChatMessageToMessage(data);
         setMessages(prev => {
           // Check if message already exists to avoid duplicates